@@ -0,0 +1,183 @@
+# alert_index.py
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Полшага округления цены под бонус (6 знаков, см. users.adjust_prices_for_bonus)
+ROUNDING_EDGE = 5e-7
+
+
+class AlertCrossingIndex:
+    """
+    Индекс активных таймеров для поиска «пересечённых» цен без перебора всех алертов.
+
+    Пользователь видит цену base_buy / (1 + bonus), поэтому цель target_price
+    переводится в порог по базовой цене: threshold = target_price * (1 + bonus).
+    Пороги хранятся отсортированными отдельно для (ресурс, направление):
+      down — сработал, если base_buy <= threshold  (хвост списка от bisect_left)
+      up   — сработал, если base_buy >= threshold  (голова списка до bisect_right)
+    Поиск — O(log n + k). Множитель (1 + bonus) считается один раз на уровень бонуса.
+    Цена под бонус сравнивается с целью после округления до 6 знаков
+    (users.adjust_prices_for_bonus), поэтому порог сдвинут на полшага округления
+    в сторону срабатывания: цена, которую игрок видит равной цели, — пересечение.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sorted: Dict[Tuple[str, str], List[Tuple[float, int]]] = {}
+        # alert_id -> (resource, direction, threshold, user_id, target_price)
+        self._alerts: Dict[int, Tuple[str, str, float, int, float]] = {}
+        self._by_user: Dict[int, set] = {}
+        self._tier_factor: Dict[float, float] = {}
+
+    def _factor(self, bonus: float) -> float:
+        bonus = round(float(bonus or 0.0), 6)
+        factor = self._tier_factor.get(bonus)
+        if factor is None:
+            factor = self._tier_factor[bonus] = 1 + bonus
+        return factor
+
+    def _add_locked(self, alert_id: int, user_id: int, resource: str, direction: str, target_price: float, bonus: float):
+        self._remove_locked(alert_id)
+        edge = ROUNDING_EDGE if direction == "down" else -ROUNDING_EDGE
+        threshold = (float(target_price) + edge) * self._factor(bonus)
+        insort(self._sorted.setdefault((resource, direction), []), (threshold, alert_id))
+        self._alerts[alert_id] = (resource, direction, threshold, user_id, float(target_price))
+        self._by_user.setdefault(user_id, set()).add(alert_id)
+
+    def _remove_locked(self, alert_id: int) -> bool:
+        info = self._alerts.pop(alert_id, None)
+        if info is None:
+            return False
+        resource, direction, threshold, user_id, _ = info
+        bucket = self._sorted.get((resource, direction), [])
+        i = bisect_left(bucket, (threshold, alert_id))
+        if i < len(bucket) and bucket[i] == (threshold, alert_id):
+            del bucket[i]
+        user_ids = self._by_user.get(user_id)
+        if user_ids is not None:
+            user_ids.discard(alert_id)
+            if not user_ids:
+                del self._by_user[user_id]
+        return True
+
+    def load(self, alerts: Iterable[Dict], bonus_by_user: Dict[int, float]) -> None:
+        """Пересобирает индекс из списка активных алертов."""
+        with self._lock:
+            self._sorted.clear()
+            self._alerts.clear()
+            self._by_user.clear()
+            for a in alerts:
+                self._add_locked(a['id'], a['user_id'], a['resource'], a['direction'], a['target_price'],
+                                 bonus_by_user.get(a['user_id'], 0.0))
+
+    def add(self, alert_id: int, user_id: int, resource: str, direction: str, target_price: float, bonus: float = 0.0) -> None:
+        with self._lock:
+            self._add_locked(alert_id, user_id, resource, direction, target_price, bonus)
+
+    def remove(self, alert_id: int) -> bool:
+        with self._lock:
+            return self._remove_locked(alert_id)
+
+    def remove_user(self, user_id: int) -> int:
+        with self._lock:
+            ids = list(self._by_user.get(user_id, ()))
+            for alert_id in ids:
+                self._remove_locked(alert_id)
+            return len(ids)
+
+    def update_user_bonus(self, user_id: int, bonus: float) -> None:
+        """Пересчитывает пороги алертов пользователя после смены бонуса."""
+        with self._lock:
+            for alert_id in list(self._by_user.get(user_id, ())):
+                resource, direction, _, _, target = self._alerts[alert_id]
+                self._add_locked(alert_id, user_id, resource, direction, target, bonus)
+
+    def crossed(self, resource: str, base_buy: float) -> List[int]:
+        """id алертов по ресурсу, цель которых достигнута при базовой цене покупки base_buy."""
+        with self._lock:
+            down = self._sorted.get((resource, "down"), [])
+            up = self._sorted.get((resource, "up"), [])
+            hit = [alert_id for _, alert_id in down[bisect_left(down, (base_buy, -1)):]]
+            hit += [alert_id for _, alert_id in up[:bisect_right(up, (base_buy, float('inf')))]]
+            return hit
+
+    def get(self, alert_id: int) -> Optional[Tuple[str, str, float, int, float]]:
+        with self._lock:
+            return self._alerts.get(alert_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._alerts)
+
+
+class ProfitAlertIndex:
+    """
+    Групповые алерты покупки (/buyalert) по ресурсам, отсортированные по threshold_price.
+    Алерт срабатывает при buy <= threshold_price — это хвост списка от bisect_left;
+    min_quantity проверяется уже для найденных кандидатов.
+    На чат и ресурс — не больше одного алерта (как в chat_profit_alerts).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sorted: Dict[str, List[Tuple[float, int, int]]] = {}
+        # (chat_id, resource) -> (threshold_price, min_quantity)
+        self._alerts: Dict[Tuple[int, str], Tuple[float, int]] = {}
+
+    def _remove_locked(self, chat_id: int, resource: str) -> bool:
+        info = self._alerts.pop((chat_id, resource), None)
+        if info is None:
+            return False
+        threshold, min_qty = info
+        bucket = self._sorted.get(resource, [])
+        i = bisect_left(bucket, (threshold, chat_id, min_qty))
+        if i < len(bucket) and bucket[i] == (threshold, chat_id, min_qty):
+            del bucket[i]
+        return True
+
+    def _set_locked(self, chat_id: int, resource: str, threshold_price: float, min_quantity: int):
+        self._remove_locked(chat_id, resource)
+        entry = (float(threshold_price), chat_id, int(min_quantity))
+        insort(self._sorted.setdefault(resource, []), entry)
+        self._alerts[(chat_id, resource)] = (entry[0], entry[2])
+
+    def load(self, alerts: Iterable[Dict]) -> None:
+        with self._lock:
+            self._sorted.clear()
+            self._alerts.clear()
+            for a in alerts:
+                self._set_locked(a['chat_id'], a['resource'], a['threshold_price'], a['min_quantity'])
+
+    def set(self, chat_id: int, resource: str, threshold_price: float, min_quantity: int) -> None:
+        with self._lock:
+            self._set_locked(chat_id, resource, threshold_price, min_quantity)
+
+    def remove(self, chat_id: int, resource: str) -> bool:
+        with self._lock:
+            return self._remove_locked(chat_id, resource)
+
+    def remove_chat(self, chat_id: int) -> int:
+        with self._lock:
+            keys = [key for key in self._alerts if key[0] == chat_id]
+            for key in keys:
+                self._remove_locked(*key)
+            return len(keys)
+
+    def matching(self, resource: str, buy: float, quantity: int) -> List[Dict]:
+        """Алерты, для которых buy <= threshold_price и quantity >= min_quantity."""
+        with self._lock:
+            bucket = self._sorted.get(resource, [])
+            return [
+                {"chat_id": chat_id, "resource": resource, "threshold_price": threshold, "min_quantity": min_qty}
+                for threshold, chat_id, min_qty in bucket[bisect_left(bucket, (buy,)):]
+                if quantity >= min_qty
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._alerts)
+
+
+alert_index = AlertCrossingIndex()
+profit_alert_index = ProfitAlertIndex()
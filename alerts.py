@@ -1,5 +1,6 @@
 
 # alerts.py
+import queue
 import threading
 import time
 import logging
@@ -7,51 +8,59 @@ from datetime import datetime, timedelta
 from typing import List, Optional
 from telebot import types
 import database
+import estimator
 import users
 import market
+from snapshot import market_snapshot
+from scheduler import timer_scheduler
+from alert_index import alert_index, profit_alert_index
+from dispatcher import outbound, PRIORITY_ALERT, PRIORITY_INFO, PRIORITY_REMINDER
+import outbox
+from outbox import outbox_worker
 
 logger = logging.getLogger(__name__)
 
 
-def calculate_speed(records: List[dict], price_field: str = "buy") -> Optional[float]:
-    if not records or len(records) < 2:
-        return None
-    prev = records[-2]
-    last = records[-1]
-    price_delta = last[price_field] - prev[price_field]
-    time_delta_minutes = (last['timestamp'] - prev['timestamp']) / 60.0
-    if time_delta_minutes < 0.1:
-        return None
-    speed = price_delta / time_delta_minutes
-    return round(speed, 6)
-
-
-def get_trend(records: List[dict], price_field: str = "buy") -> str:
-    if not records or len(records) < 2:
-        return "stable"
-    prev_price = records[-2][price_field]
-    last_price = records[-1][price_field]
-    if last_price > prev_price:
-        return "up"
-    elif last_price < prev_price:
-        return "down"
-    else:
-        return "stable"
+# Таймеры не используют оценку скорости, если последний тик старше этого окна
+TIMER_LOOKBACK_MINUTES = 15
+
+
+def close_alert(alert_id: int, status: str, messages: Optional[List[dict]] = None) -> bool:
+    """
+    Переводит активный алерт в конечный статус и снимает его таймер.
+    messages записываются в outbox в той же транзакции, что и статус.
+    Возвращает False, если алерт уже закрыт другим потоком (сообщения не отправляются).
+    """
+    if not database.update_alert_status(alert_id, status, outbox=messages):
+        return False
+    timer_scheduler.cancel(alert_id)
+    if messages:
+        outbox_worker.wake()
+    return True
+
+
+def _final_message(alert: dict, chat_id: int, text: str, priority: int = PRIORITY_ALERT, parse_mode: Optional[str] = None) -> dict:
+    # Один итоговый ответ на алерт и получателя, по какому бы пути он ни завершился
+    return outbox.message(f"alert:{alert['id']}:final:{chat_id}", chat_id, text, priority, parse_mode)
 
 
 def schedule_alert(alert_id: int, bot):
+    """
+    Срабатывание таймера: вызывается планировщиком (timer_scheduler), когда
+    наступило alert_time.
+    """
     try:
         alert = database.get_alert_by_id(alert_id)
-        if not alert:
+        if not alert or alert.get('status') != 'active':
             return
 
-        alert_time = datetime.fromisoformat(alert['alert_time'])
-        now = datetime.now()
-        sleep_s = (alert_time - now).total_seconds()
-        if sleep_s > 0:
-            time.sleep(sleep_s)
+        # Время могли перенести (update_dynamic_timers_once) — переставляем таймер
+        alert_ts = datetime.fromisoformat(alert['alert_time']).timestamp()
+        if alert_ts - time.time() > 1:
+            timer_scheduler.reschedule(alert_id, alert_ts)
+            return
 
-        current = database.get_latest_market(alert['resource'])
+        current = market_snapshot.get_latest(alert['resource'])
         if not current:
             try:
 
@@ -63,7 +72,7 @@ def schedule_alert(alert_id: int, bot):
                     
             except Exception:
                 pass
-            database.update_alert_status(alert_id, 'error')
+            close_alert(alert_id, 'error')
             return
 
         current_price_adj, _ = users.adjust_prices_for_user(alert['user_id'], current['buy'], current['sell'])
@@ -75,45 +84,42 @@ def schedule_alert(alert_id: int, bot):
             reached = True
 
         if reached:
-            try:
-                bot.send_message(alert['user_id'], f"🔔 **Таймер сработал!** 🎯\n{alert['resource']} достигла {alert['target_price']:.2f}💰\nТекущая: {current_price_adj:.2f}💰")
-            except Exception:
-                pass
-            database.update_alert_status(alert_id, 'completed')
+            messages = [_final_message(alert, alert['user_id'], f"🔔 **Таймер сработал!** 🎯\n{alert['resource']} достигла {alert['target_price']:.2f}💰\nТекущая: {current_price_adj:.2f}💰")]
             if alert.get('chat_id') and alert['chat_id'] != alert['user_id']:
-                try:
-                    group_users = database.get_group_users(alert['chat_id'])
-                    mentions = ' '.join([f"@{u['username']}" for u in group_users if u['username']])
-                    alert_msg = f"🔔 **Таймер @{alert['user_id']} сработал!**\n{alert['resource']} достигла {alert['target_price']:.2f}💰 (текущая: {current_price_adj:.2f}💰)\n{mentions}" if mentions else f"🔔 Таймер сработал: {alert['resource']} {alert['target_price']:.2f}💰"
-                    bot.send_message(alert['chat_id'], alert_msg, parse_mode='Markdown')
-                except Exception:
-                    bot.send_message(alert['chat_id'], f"🔔 Таймер сработал: {alert['resource']} {alert['target_price']:.2f}💰")
+                group_users = database.get_group_users(alert['chat_id'])
+                mentions = ' '.join([f"@{u['username']}" for u in group_users if u['username']])
+                alert_msg = f"🔔 **Таймер @{alert['user_id']} сработал!**\n{alert['resource']} достигла {alert['target_price']:.2f}💰 (текущая: {current_price_adj:.2f}💰)\n{mentions}" if mentions else f"🔔 Таймер сработал: {alert['resource']} {alert['target_price']:.2f}💰"
+                messages.append(_final_message(alert, alert['chat_id'], alert_msg, parse_mode='Markdown'))
+            close_alert(alert_id, 'completed', messages)
         else:
-            try:
-                bot.send_message(alert['user_id'], f"⏰ **Таймер истёк**\nЦель ({alert['target_price']:.2f}💰) не достигнута. Текущая: {current_price_adj:.2f}💰")
-            except Exception:
-                pass
-            database.update_alert_status(alert_id, 'expired')
+            close_alert(alert_id, 'expired', [_final_message(alert, alert['user_id'], f"⏰ **Таймер истёк**\nЦель ({alert['target_price']:.2f}💰) не достигнута. Текущая: {current_price_adj:.2f}💰")])
 
     except Exception as e:
         logger.exception("Ошибка в schedule_alert")
         try:
-            database.update_alert_status(alert_id, 'error')
+            close_alert(alert_id, 'error')
         except Exception:
             pass
 
 
-def update_dynamic_timers_once(bot):
+def update_dynamic_timers_once(bot, resources: Optional[List[str]] = None):
+    """
+    Пересчитывает активные таймеры. Если resources указан — только алерты по этим
+    ресурсам (событие от market_snapshot), иначе — все (страховочный опрос).
+    """
     try:
-        active_alerts = database.get_active_alerts()
+        if resources is None:
+            active_alerts = database.get_active_alerts()
+        else:
+            active_alerts = database.get_active_alerts_for_resources(resources)
         now = datetime.now()
         for alert in active_alerts:
             try:
-                records = database.get_recent_market(alert['resource'], minutes=15)
-                if not records or len(records) < 2:
+                estimate = estimator.online_estimates.get(alert['resource'], "buy", TIMER_LOOKBACK_MINUTES * 60)
+                if estimate is None:
                     continue
 
-                latest = database.get_latest_market(alert['resource'])
+                latest = market_snapshot.get_latest(alert['resource'])
                 if not latest:
                     continue
 
@@ -123,30 +129,20 @@ def update_dynamic_timers_once(bot):
 
                 bonus = users.get_user_bonus(alert['user_id'])
                 current_adj_price, _ = users.adjust_prices_for_user(alert['user_id'], latest['buy'], latest['sell'])
-                speed_raw = calculate_speed(records, "buy")
-                if speed_raw is None:
-                    continue
+                speed_raw = estimate.slope
 
                 adj_speed = speed_raw / (1 + bonus) if isinstance(bonus, float) else speed_raw
                 if adj_speed is None or adj_speed == 0:
                     continue
 
-                current_trend = get_trend(records, "buy")
+                current_trend = estimate.trend
                 if (alert['direction'] == "down" and current_trend == "up") or (alert['direction'] == "up" and current_trend == "down"):
-                    try:
-                        bot.send_message(alert['user_id'], f"⚠️ **Тренд изменился** 📊\n{alert['resource']}: теперь {current_trend}. Алерты деактивирован.")
-                    except Exception:
-                        pass
-                    database.update_alert_status(alert['id'], 'trend_changed')
+                    close_alert(alert['id'], 'trend_changed', [_final_message(alert, alert['user_id'], f"⚠️ **Тренд изменился** 📊\n{alert['resource']}: теперь {current_trend}. Алерты деактивирован.", PRIORITY_INFO)])
                     continue
 
                 # Fixed logic: direction based on target vs current at creation, but update if already reached
                 if (alert['direction'] == "down" and current_adj_price <= alert['target_price']) or (alert['direction'] == "up" and current_adj_price >= alert['target_price']):
-                    try:
-                        bot.send_message(alert['user_id'], f"🔔 **Цель достигнута!** 🎯\n{alert['resource']}: {alert['target_price']:.2f}💰 (текущая: {current_adj_price:.2f}💰)")
-                    except Exception:
-                        pass
-                    database.update_alert_status(alert['id'], 'completed')
+                    close_alert(alert['id'], 'completed', [_final_message(alert, alert['user_id'], f"🔔 **Цель достигнута!** 🎯\n{alert['resource']}: {alert['target_price']:.2f}💰 (текущая: {current_adj_price:.2f}💰)")])
                     continue
 
                 # Only update if speed in correct direction
@@ -160,130 +156,253 @@ def update_dynamic_timers_once(bot):
                 time_minutes = price_diff / abs(adj_speed)
                 new_alert_time = datetime.now() + timedelta(minutes=time_minutes)
 
-                database.update_alert_fields(alert['id'], {
-                    'alert_time': new_alert_time.isoformat(),
-                    'speed': adj_speed,
-                    'current_price': current_adj_price
-                })
-
+                messages = []
                 try:
                     old = datetime.fromisoformat(alert['alert_time']) if alert.get('alert_time') else None
                     if old:
                         diff_min = abs((new_alert_time - old).total_seconds() / 60.0)
                         if diff_min > 5:
-                            bot.send_message(alert['user_id'], f"🔄 **Таймер обновлён** ⏱️\n{alert['resource']}: новое время {new_alert_time.strftime('%H:%M:%S')}")
+                            messages.append(outbox.message(
+                                f"alert:{alert['id']}:moved:{new_alert_time.isoformat()}", alert['user_id'],
+                                f"🔄 **Таймер обновлён** ⏱️\n{alert['resource']}: новое время {new_alert_time.strftime('%H:%M:%S')}", PRIORITY_INFO))
                 except Exception:
                     pass
 
+                database.update_alert_fields(alert['id'], {
+                    'alert_time': new_alert_time.isoformat(),
+                    'speed': adj_speed,
+                    'current_price': current_adj_price
+                }, outbox=messages)
+                timer_scheduler.reschedule(alert['id'], new_alert_time.timestamp())
+                if messages:
+                    outbox_worker.wake()
+
             except Exception as e:
                 logger.exception(f"Ошибка при обновлении алерта {alert.get('id')}: {e}")
     except Exception as e:
         logger.exception("Ошибка в update_dynamic_timers_once")
 
 
+CLEANUP_INTERVAL = 600
+STALE_REMINDER_INTERVAL = 60
+
+
+def cleanup_expired_alerts_once():
+    now = datetime.now()
+    active = database.get_active_alerts()
+    expired_ids = []
+    for a in active:
+        try:
+            if not a.get('alert_time'):
+                continue
+            at = datetime.fromisoformat(a['alert_time'])
+            if at < (now - timedelta(hours=1)):
+                expired_ids.append(a['id'])
+        except Exception:
+            continue
+    for aid in expired_ids:
+        close_alert(aid, 'cleanup_expired')
+        logger.info(f"Очистка: деактивирован алерт {aid} (просрочен)")
+
+
 def cleanup_expired_alerts_loop():
     while True:
         try:
-            now = datetime.now()
-            active = database.get_active_alerts()
-            expired_ids = []
-            for a in active:
-                try:
-                    if not a.get('alert_time'):
-                        continue
-                    at = datetime.fromisoformat(a['alert_time'])
-                    if at < (now - timedelta(hours=1)):
-                        expired_ids.append(a['id'])
-                except Exception:
-                    continue
-            for aid in expired_ids:
-                database.update_alert_status(aid, 'cleanup_expired')
-                logger.info(f"Очистка: деактивирован алерт {aid} (просрочен)")
+            cleanup_expired_alerts_once()
         except Exception as e:
             logger.exception("Ошибка в cleanup_expired_alerts_loop")
-        time.sleep(600)
+        time.sleep(CLEANUP_INTERVAL)
+
+
+STALE_DB_TEXT_USER = "⚠️ **БД устарела!** 📉\nДанные не обновлялись >15 мин. Пришлите форвард рынка 🎪.\n/push — настройки."
+STALE_DB_TEXT_CHAT = "⚠️ **БД устарела!** 📉\nДанные не обновлялись >15 мин. Пришлите форвард рынка."
+
+
+def stale_db_reminder_once(bot):
+    global_ts = market_snapshot.get_global_latest_timestamp()
+    now_ts = int(time.time())
+    delta = None if not global_ts else now_ts - global_ts
+    if delta is not None and delta < 15 * 60:
+        return
+
+    # Только получатели, у которых истёк интервал; отметка — пачкой, отправка — одной постановкой в очередь
+    for table, text in (("users", STALE_DB_TEXT_USER), ("chats", STALE_DB_TEXT_CHAT)):
+        while True:
+            ids = database.claim_due_reminders(table, now_ts)
+            if ids:
+                outbound.send_many(ids, text, PRIORITY_REMINDER)
+            if len(ids) < database.REMINDER_BATCH_SIZE:
+                break
 
 
 def stale_db_reminder_loop(bot):
     while True:
         try:
-            global_ts = database.get_global_latest_timestamp()
-            now_ts = int(time.time())
-            delta = None if not global_ts else now_ts - global_ts
-            if delta is not None and delta < 15 * 60:
-                time.sleep(60)
-                continue
+            stale_db_reminder_once(bot)
+        except Exception:
+            logger.exception("Ошибка в stale_db_reminder_loop")
+        time.sleep(STALE_REMINDER_INTERVAL)  # Check every minute, send if interval passed
+
+
+# Основной путь — событие от market_snapshot; опрос остаётся как страховка
+DYNAMIC_TIMERS_FALLBACK_INTERVAL = 300
 
-            users_list = database.get_users_with_notifications_enabled()
-            for u in users_list:
-                uid = u["id"]
-                interval = int(u.get("notify_interval", 15))
-                last = int(u.get("last_reminder", 0))
-                if now_ts - last >= interval * 60:
-                    try:
-                        bot.send_message(uid, "⚠️ **БД устарела!** 📉\nДанные не обновлялись >15 мин. Пришлите форвард рынка 🎪.\n/push — настройки.")
-                    except Exception:
-                        pass
-                    database.set_user_last_reminder(uid, now_ts)
-
-            chats = database.get_chats_with_notifications_enabled()
-            for c in chats:
-                chat_id = c["chat_id"]
-                interval = int(c.get("notify_interval", 15))
-                last = int(c.get("last_reminder", 0))
-                if now_ts - last >= interval * 60:
-                    try:
-                        bot.send_message(chat_id, "⚠️ **БД устарела!** 📉\nДанные не обновлялись >15 мин. Пришлите форвард рынка.")
-                    except Exception:
-                        pass
-                    database.set_chat_last_reminder(chat_id, now_ts)
+_market_events: "queue.Queue[List[str]]" = queue.Queue()
 
+
+def _on_market_update(resources: List[str], version: int):
+    _market_events.put(list(resources))
+
+
+def fire_crossed_alerts(bot, resources: List[str]) -> int:
+    """
+    Завершает таймеры, цель которых пересечена последней ценой.
+    Кандидаты берутся из alert_index бинарным поиском, а не перебором всех алертов.
+    """
+    fired = 0
+    for resource in resources:
+        latest = market_snapshot.get_latest(resource)
+        if not latest:
+            continue
+        for alert_id in alert_index.crossed(resource, latest['buy']):
+            try:
+                alert = database.get_alert_by_id(alert_id)
+                if not alert or alert['status'] != 'active':
+                    alert_index.remove(alert_id)
+                    continue
+                created_ts = datetime.fromisoformat(alert['created_at']).timestamp() if alert.get('created_at') else 0
+                if latest['timestamp'] <= created_ts:
+                    continue
+                current_adj_price, _ = users.adjust_prices_for_user(alert['user_id'], latest['buy'], latest['sell'])
+                if close_alert(alert_id, 'completed', [_final_message(alert, alert['user_id'], f"🔔 **Цель достигнута!** 🎯\n{alert['resource']}: {alert['target_price']:.2f}💰 (текущая: {current_adj_price:.2f}💰)")]):
+                    fired += 1
+            except Exception:
+                logger.exception(f"Ошибка при срабатывании алерта {alert_id}")
+    return fired
+
+
+def market_events_loop(bot):
+    """
+    Разбирает события «ресурс обновлён»: все накопившиеся события сливаются
+    в один пакет и алерты по затронутым ресурсам пересчитываются сразу.
+    """
+    while True:
+        resources = set(_market_events.get())
+        try:
+            while True:
+                resources.update(_market_events.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            fire_profit_alerts(bot, sorted(resources))
+            fire_crossed_alerts(bot, sorted(resources))
+            update_dynamic_timers_once(bot, sorted(resources))
         except Exception:
-            logger.exception("Ошибка в stale_db_reminder_loop")
-        time.sleep(60)  # Check every minute, send if interval passed
+            logger.exception("Ошибка в market_events_loop")
 
 
 def update_dynamic_timers_loop(bot):
     while True:
+        time.sleep(DYNAMIC_TIMERS_FALLBACK_INTERVAL)
         try:
             update_dynamic_timers_once(bot)
         except Exception:
             logger.exception("Ошибка в update_dynamic_timers_loop")
-        time.sleep(60)
+
+
+def fire_profit_alerts(bot, resources: Optional[List[str]] = None) -> int:
+    """
+    Групповые алерты покупки: для каждого обновлённого ресурса находит в
+    profit_alert_index все чаты, где buy <= порога и объём >= min_quantity.
+    """
+    fired = 0
+    for current in market_snapshot.get_latest_all():
+        resource = current['resource']
+        if resources is not None and resource not in resources:
+            continue
+        for alert in profit_alert_index.matching(resource, current['buy'], current['quantity']):
+            chat_id = alert['chat_id']
+            min_qty = alert['min_quantity']
+            try:
+                group_users = database.get_group_users(chat_id)
+                mentions = ' '.join([f"@{u['username']}" for u in group_users if u['username']])
+                alert_msg = f"🛒 **Время покупать!** 📉\n{resource}: {current['buy']:.2f}💰 (≥{min_qty:,} шт.)\n{mentions}"
+                key = f"buyalert:{chat_id}:{resource}:{current['timestamp']}:{alert['threshold_price']}"
+                database.deactivate_profit_alert(chat_id, resource, outbox=[outbox.message(key, chat_id, alert_msg, PRIORITY_ALERT, 'Markdown')])
+                outbox_worker.wake()
+                fired += 1
+            except Exception:
+                # Транзакция откатилась: алерт остаётся активным и сработает на следующем тике
+                logger.exception(f"Ошибка группового алерта {chat_id} по {resource}")
+    return fired
+
+
+def _restore_undelivered_profit_alert(row):
+    """Уведомление не доставлено после всех повторов — алерт снова активен."""
+    _, chat_id, resource, _, threshold = row['idempotency_key'].split(':', 4)
+    if database.restore_profit_alert(int(chat_id), resource, float(threshold)):
+        logger.warning(f"Групповой алерт {chat_id} по {resource} возвращён: уведомление не доставлено")
+
+
+PROFIT_ALERTS_FALLBACK_INTERVAL = 300
+ARCHIVE_INTERVAL = 3600
 
 
 def check_profit_alerts(bot):
+    # Основной путь — market_events_loop; здесь только страховочный проход
     while True:
         try:
-            chats = database.get_chats_with_profit_alerts()
-            for chat in chats:
-                chat_id = chat['chat_id']
-                alerts_list = database.get_chat_profit_alerts(chat_id)
-                latest = database.get_latest_market_all()
-                for alert in alerts_list:
-                    resource = alert['resource']
-                    threshold = alert['threshold_price']
-                    min_qty = alert['min_quantity']
-                    current = next((r for r in latest if r['resource'] == resource), None)
-                    if current and current['buy'] <= threshold and current['quantity'] >= min_qty:
-                        try:
-                            group_users = database.get_group_users(chat_id)
-                            mentions = ' '.join([f"@{u['username']}" for u in group_users if u['username']])
-                            alert_msg = f"🛒 **Время покупать!** 📉\n{resource}: {current['buy']:.2f}💰 (≥{min_qty:,} шт.)\n{mentions}"
-                            bot.send_message(chat_id, alert_msg, parse_mode='Markdown')
-                            database.deactivate_profit_alert(chat_id, resource)
-                        except Exception:
-                            pass
+            fire_profit_alerts(bot)
         except Exception as e:
             logger.exception("Ошибка в check_profit_alerts")
-        time.sleep(300)
+        time.sleep(PROFIT_ALERTS_FALLBACK_INTERVAL)
+
+
+def archive_market_ticks_once():
+    moved = database.archive_market_ticks()
+    if moved:
+        logger.info(f"В архив перенесено тиков: {moved}")
+    pruned_candles = database.prune_minute_candles()
+    if pruned_candles:
+        logger.info(f"Удалено старых минутных свечей: {pruned_candles}")
+    pruned = database.prune_leaderboard_buckets()
+    if pruned:
+        logger.info(f"Удалено устаревших почасовых сумм рейтинга: {pruned}")
+
+
+def archive_market_ticks_loop():
+    while True:
+        try:
+            archive_market_ticks_once()
+        except Exception:
+            logger.exception("Ошибка в archive_market_ticks_loop")
+        time.sleep(ARCHIVE_INTERVAL)
+
+
+def start_event_workers(bot):
+    """Событийные части: исходящая очередь, outbox, индексы, планировщик таймеров."""
+    outbound.start(bot)
+    outbox_worker.on_failed("buyalert", _restore_undelivered_profit_alert)
+    outbox_worker.start()
+    database.load_alert_index()
+    database.load_profit_alert_index()
+    database.load_leaderboard()
+    warmed = estimator.online_estimates.warm_start()
+    logger.info(f"Онлайн-оценки скорости прогреты по {warmed} тикам")
+    timer_scheduler.start(lambda alert_id: schedule_alert(alert_id, bot))
+    restored = timer_scheduler.load_active()
+    logger.info(f"Восстановлено таймеров: {restored}")
+    market_snapshot.subscribe(_on_market_update)
+    threading.Thread(target=market_events_loop, args=(bot,), daemon=True).start()
 
 
 def start_background_tasks(bot):
+    start_event_workers(bot)
     threading.Thread(target=cleanup_expired_alerts_loop, daemon=True).start()
     threading.Thread(target=update_dynamic_timers_loop, args=(bot,), daemon=True).start()
     threading.Thread(target=stale_db_reminder_loop, args=(bot,), daemon=True).start()
     threading.Thread(target=check_profit_alerts, args=(bot,), daemon=True).start()
+    threading.Thread(target=archive_market_ticks_loop, daemon=True).start()
 
 
 def cmd_timer_handler(bot, message):
@@ -308,13 +427,13 @@ def cmd_timer_handler(bot, message):
             bot.reply_to(message, "❌ Неверная цена. Пример: 8.50")
             return
 
-        latest = database.get_latest_market(resource)
+        latest = market_snapshot.get_latest(resource)
         if not latest:
             bot.reply_to(message, f"⚠️ Нет данных по {resource}. Пришлите 🎪.")
             return
 
-        records = database.get_recent_market(resource, minutes=15)
-        if len(records) < 2:
+        estimate = estimator.online_estimates.get(resource, "buy", TIMER_LOOKBACK_MINUTES * 60)
+        if estimate is None:
             bot.reply_to(message, f"⚠️ Недостаточно данных для {resource}.")
             return
 
@@ -328,10 +447,7 @@ def cmd_timer_handler(bot, message):
         else:
             direction = "up"
 
-        speed_raw = calculate_speed(records, "buy")
-        if speed_raw is None:
-            bot.reply_to(message, "⚠️ Не удалось рассчитать скорость.")
-            return
+        speed_raw = estimate.slope
 
         adj_speed = speed_raw / (1 + bonus) if isinstance(bonus, float) else speed_raw
         if adj_speed == 0:
@@ -346,7 +462,7 @@ def cmd_timer_handler(bot, message):
             bot.reply_to(message, f"⚠️ Для роста цель должна быть выше текущей ({current_buy_adj:.2f}💰).")
             return
 
-        trend = get_trend(records, "buy")
+        trend = estimate.trend
         if (direction == "down" and trend == "up") or (direction == "up" and trend == "down"):
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("❌ Отмена", callback_data="timer_cancel"))
@@ -365,6 +481,8 @@ def cmd_timer_handler(bot, message):
         chat_id = message.chat.id if message.chat.type in ['group', 'supergroup'] else None
 
         alert_id = database.insert_alert_record(user_id, resource, target_price, direction, adj_speed, current_buy_adj, alert_time.isoformat(), chat_id)
+        # Таймер ставится до ответа: ошибка Telegram не должна оставить активный алерт без таймера
+        timer_scheduler.schedule(alert_id, alert_time.timestamp())
 
         alert_time_str = alert_time.strftime("%H:%M:%S")
         username = message.from_user.username or str(message.from_user.id)
@@ -386,8 +504,6 @@ def cmd_timer_handler(bot, message):
             except Exception:
                 pass
 
-        threading.Thread(target=schedule_alert, args=(alert_id, bot), daemon=True).start()
-
     except Exception:
         logger.exception("Ошибка в cmd_timer_handler")
         bot.reply_to(message, "❌ Ошибка установки таймера.")
@@ -417,7 +533,10 @@ def cmd_status_handler(bot, message):
 
 def cmd_cancel_handler(bot, message):
     user_id = message.from_user.id
+    active_ids = [a['id'] for a in database.get_user_active_alerts(user_id)]
     count = database.cancel_user_alerts(user_id)
+    for alert_id in active_ids:
+        timer_scheduler.cancel(alert_id)
     bot.reply_to(message, f"🗑️ **Удалено {count} алертов** 📋")
 
 
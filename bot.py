@@ -4,21 +4,29 @@ import logging
 import telebot
 from telebot import types
 import database
+import estimator
 import users
 import alerts
 import market
+import update_pool
+from snapshot import market_snapshot
+from tickstore import tick_store
+from render_cache import RenderCache
+import os
 import time
 import re
 from datetime import datetime
 
 TOKEN = "YOUR_BOT_TOKEN_HERE"
-bot = telebot.TeleBot(TOKEN)
+# polling — long polling TeleBot; webhook — встроенный HTTP-сервер webhook.py
+# (нужны WEBHOOK_URL и WEBHOOK_SECRET)
+RUNTIME = os.getenv("BOT_RUNTIME", "polling")
+# Обработчики выполняет update_pool (шарды по chat.id), а не собственный пул TeleBot
+bot = telebot.TeleBot(TOKEN, threaded=False)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-alerts.start_background_tasks(bot)
-
 #Команда /start
 
 @bot.message_handler(commands=['start'])
@@ -43,30 +51,36 @@ def cmd_help(message):
 
 #Команда /stat
 
-@bot.message_handler(commands=['stat'])
-def cmd_stat(message):
-    user_id = message.from_user.id
-    bonus_pct = int(users.get_user_bonus(user_id) * 100)
-    now = datetime.now()
-    global_ts = database.get_global_latest_timestamp()
+# Текст /stat зависит только от рынка и бонуса — кэшируем готовый ответ
+# по (версия снимка, минута) × бонус; новый форвард сразу сбрасывает кэш
+stat_cache = RenderCache()
+market_snapshot.subscribe(stat_cache.invalidate)
+
+
+def render_stat(bonus: float) -> str:
+    bonus_pct = int(bonus * 100)
+    global_ts = market_snapshot.get_global_latest_timestamp()
     update_str = datetime.fromtimestamp(global_ts).strftime("%d.%m.%Y %H:%M") if global_ts else "❌ Нет данных"
 
     resources = ['Дерево', 'Камень', 'Провизия', 'Лошади']
     reply = f"📊 **Текущая статистика рынка** 🏪\n🕐 Обновлено: {update_str}\n💎 Ваш бонус: +{bonus_pct}%\n━━━━━━━━━━━━━━━━━━━━━━━\n"
     week_start = int(time.time()) - 7*24*3600
+    week_stats = tick_store.week_stats(week_start) if tick_store.enabled else database.get_week_stats(week_start)
 
+    forecasts = market.compute_extrapolated_prices(resources, bonus=bonus)
     for res in resources:
-        pred_buy, pred_sell, trend, speed, last_ts = market.compute_extrapolated_price(res, user_id)
+        pred_buy, pred_sell, trend, speed, last_ts = forecasts[res]
         if pred_buy is None:
             reply += f"{market.RESOURCE_EMOJI.get(res, '❓')} **{res}**: Нет данных\n\n"
             continue
         last_update_str = datetime.fromtimestamp(last_ts).strftime("%H:%M") if last_ts else "N/A"
-        was_buy = database.get_market_week_max_price(res, 'buy', week_start)
-        was_sell = database.get_market_week_max_price(res, 'sell', week_start)
-        was_buy_adj, was_sell_adj = users.adjust_prices_for_user(user_id, was_buy, was_sell)
-        buy_range = database.get_market_week_range(res, 'buy', week_start)
-        sell_range = database.get_market_week_range(res, 'sell', week_start)
-        max_qty = database.get_market_week_max_qty(res, week_start)
+        week = week_stats.get(res, {})
+        was_buy = week.get('max_buy', 0.0)
+        was_sell = week.get('max_sell', 0.0)
+        was_buy_adj, was_sell_adj = users.adjust_prices_for_bonus(bonus, was_buy, was_sell)
+        buy_range = (week.get('min_buy'), week.get('max_buy'))
+        sell_range = (week.get('min_sell'), week.get('max_sell'))
+        max_qty = week.get('max_qty', 0)
         trend_emoji = "📈" if trend == "up" else "📉" if trend == "down" else "➖"
         speed_str = f"{speed:+.4f}/мин" if speed else "стабильно"
         reply += f"{market.RESOURCE_EMOJI.get(res, '')} **{res}**\n"
@@ -79,9 +93,24 @@ def cmd_stat(message):
         reply += f"  📊 Тренд: {trend_emoji} {speed_str}\n\n"
 
     reply += "━━━━━━━━━━━━━━━━━━━━━━━\n📈 Рост | 📉 Падение | ➖ Стабильно\n*Цены с вашим бонусом*"
+    return reply
+
+
+def get_stat_text(user_id: int) -> str:
+    bonus = round(users.get_user_bonus(user_id), 4)
+    generation = (market_snapshot.version, int(time.time()) // 60)
+    return stat_cache.get(generation, bonus, lambda: render_stat(bonus))
+
+
+def stat_markup() -> types.InlineKeyboardMarkup:
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton("🔄 Обновить", callback_data="refresh_stat"))
-    bot.reply_to(message, reply, parse_mode='Markdown', reply_markup=markup)
+    return markup
+
+
+@bot.message_handler(commands=['stat'])
+def cmd_stat(message):
+    bot.reply_to(message, get_stat_text(message.from_user.id), parse_mode='Markdown', reply_markup=stat_markup())
 
 #Команда /history
 
@@ -95,27 +124,24 @@ def cmd_history(message):
         markup.add(*btns)
         bot.reply_to(message, "📜 Выберите ресурс для истории:", reply_markup=markup)
         return
-    records = database.get_market_history(resource, hours=24)
-    if not records:
+    now_ts = int(time.time())
+    candles = database.get_market_candles(resource, now_ts - 24 * 3600, interval=3600)
+    if not candles:
         bot.reply_to(message, f"❌ Нет истории для {resource}.")
         return
+    factor = 1 + users.get_user_bonus(message.from_user.id)
     reply = f"📜 **История {resource} (24ч)** 📊\n━━━━━━━━━━━━━━━━━━━━━━━\n"
-    grouped = {}
-    for r in records:
-        dt = datetime.fromtimestamp(r['timestamp'])
-        hour = dt.hour
-        if hour not in grouped:
-            grouped[hour] = []
-        grouped[hour].append(r)
-    for hour in sorted(grouped, reverse=True):
-        reply += f"🕐 **{hour:02d}:00**:\n"
-        for rec in sorted(grouped[hour], key=lambda x: x['timestamp']):
-            time_str = datetime.fromtimestamp(rec['timestamp']).strftime("%H:%M")
-            buy_adj, sell_adj = users.adjust_prices_for_user(message.from_user.id, rec['buy'], rec['sell'])
-            reply += f"  {time_str} | Купить: {buy_adj:.2f}💰 | Продать: {sell_adj:.2f}💰\n"
-        reply += "\n"
-    trend = market.get_trend(records, "buy")
-    speed = alerts.calculate_speed(records, "buy")
+    for c in reversed(candles):
+        hour_str = datetime.fromtimestamp(c['bucket']).strftime("%H:00")
+        reply += (f"🕐 **{hour_str}** | Купить: {c['open_buy'] / factor:.2f}→{c['close_buy'] / factor:.2f}💰 "
+                  f"({c['low_buy'] / factor:.2f}–{c['high_buy'] / factor:.2f}) | "
+                  f"Продать: {c['close_sell'] / factor:.2f}💰 | 📦 {c['close_quantity']:,}\n")
+    reply += "\n"
+    # Тренд — по минутным свечам последнего часа
+    records = database.get_market_candles(resource, now_ts - 3600, interval=60) or candles
+    estimate = estimator.fit_records(records, "buy")
+    trend = estimate.trend if estimate else "stable"
+    speed = estimate.slope if estimate else None
     trend_str = f"**Тренд:** {'📉 Падает' if trend=='down' else '📈 Растёт' if trend=='up' else '➖ Стабилен'} ({speed:+.4f}/мин)" if speed else "**Тренд:** ➖ Стабилен"
     reply += trend_str
     bot.reply_to(message, reply, parse_mode='Markdown')
@@ -137,7 +163,7 @@ def cmd_cancel(message):
 @bot.message_handler(commands=['settings'])
 def cmd_settings(message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = database.get_user_settings(user_id)
     anchor = bool(user.get('anchor', 0))
     trade_level = user.get('trade_level', 0)
     bonus = (0.02 if anchor else 0) + (0.02 * trade_level)
@@ -154,7 +180,7 @@ def cmd_settings(message):
 def callback_settings(call):
     user_id = call.from_user.id
     if call.data == "settings_anchor":
-        current = database.get_user(user_id).get('anchor', 0)
+        current = database.get_user_settings(user_id).get('anchor', 0)
         new = 1 - current
         database.update_user_field(user_id, 'anchor', new)
         bonus = users.get_user_bonus(user_id)
@@ -270,25 +296,7 @@ def cmd_buyalert(message):
         return
 
     chat_id = message.chat.id
-    conn = database.get_connection()
-    c = conn.cursor()
-
-    # Сначала попробуем обновить
-    c.execute("""
-        UPDATE chat_profit_alerts
-        SET threshold_price = ?, min_quantity = ?, active = 1
-        WHERE chat_id = ? AND resource = ?
-    """, (threshold, min_qty, chat_id, resource))
-
-    # Если обновлено 0 строк — значит, записи не было, вставляем новую
-    if c.rowcount == 0:
-        c.execute("""
-            INSERT INTO chat_profit_alerts (chat_id, resource, threshold_price, min_quantity, active)
-            VALUES (?, ?, ?, ?, 1)
-        """, (chat_id, resource, threshold, min_qty))
-
-    conn.commit()
-    conn.close()
+    database.upsert_profit_alert(chat_id, resource, threshold, min_qty)
 
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton("🗑️ Удалить", callback_data=f"clear_alert_{resource.lower()}"))
@@ -365,7 +373,7 @@ def handle_transaction(bot, message):
         total_gold = float(total_str.replace(',', ''))
         resource = market.EMOJI_TO_RESOURCE[emoji]
         action = 'buy'
-        latest = database.get_latest_market(resource)
+        latest = market_snapshot.get_latest(resource)
         price = total_gold / quantity if quantity > 0 else 0
         profit = -total_gold  # Расход
         database.insert_transaction(user_id, resource, action, quantity, price, total_gold, profit, timestamp)
@@ -377,17 +385,27 @@ def handle_transaction(bot, message):
         total_gold = float(total_str.replace(',', ''))
         resource = market.EMOJI_TO_RESOURCE[emoji]
         action = 'sell'
-        latest = database.get_latest_market(resource)
+        latest = market_snapshot.get_latest(resource)
         price = total_gold / quantity if quantity > 0 else 0
         profit = total_gold  # Выручка
         database.insert_transaction(user_id, resource, action, quantity, price, total_gold, profit, timestamp)
         profit_str = f" (+{profit:.2f} выгода)"
         bot.reply_to(message, f"📤 **Продажа зафиксирована**\n{resource}: {quantity:,} по {price:.2f}💰 = {total_gold:.2f}💰{profit_str}")
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith(('menu_', 'hist_', 'balert_', 'clear_alert_')))
+@bot.callback_query_handler(func=lambda call: call.data.startswith(('menu_', 'hist_', 'balert_', 'clear_alert_', 'refresh_stat')))
 def callback_menu(call):
     if call.data.startswith('menu_stat'):
         cmd_stat(call.message)
+    elif call.data == 'refresh_stat':
+        text = get_stat_text(call.from_user.id)
+        if text != call.message.text:
+            try:
+                bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                                      parse_mode='Markdown', reply_markup=stat_markup())
+            except telebot.apihelper.ApiTelegramException as e:
+                # «message is not modified» — текст уже актуален
+                logger.debug(f"refresh_stat: {e}")
+        bot.answer_callback_query(call.id, "🔄 Обновлено")
     elif call.data.startswith('menu_alerts'):
         cmd_status(call.message)
     elif call.data.startswith('menu_settings'):
@@ -420,24 +438,23 @@ def handle_buyalert_step(message, res):
         min_qty = int(parts[1])
         # Proceed with insert/update as in cmd_buyalert
         chat_id = message.chat.id
-        conn = database.get_connection()
-        c = conn.cursor()
-        c.execute("""
-            UPDATE chat_profit_alerts SET threshold_price = ?, min_quantity = ?, active = 1 WHERE chat_id = ? AND resource = ?
-        """, (threshold, min_qty, chat_id, res))
-        if c.rowcount == 0:
-            c.execute("""
-                INSERT INTO chat_profit_alerts (chat_id, resource, threshold_price, min_quantity, active) VALUES (?, ?, ?, ?, 1)
-            """, (chat_id, res, threshold, min_qty))
-        conn.commit()
-        conn.close()
+        database.upsert_profit_alert(chat_id, res, threshold, min_qty)
         bot.reply_to(message, f"✅ Алерты для {res}: ≤{threshold}💰 при ≥{min_qty:,}")
     except ValueError:
         bot.reply_to(message, "❌ Неверный формат.")
 
 def main():
-    logger.info("Бот запущен.")
+    market_snapshot.load()
+    if tick_store.enabled:
+        tick_store.sync_from_db()
     try:
+        pool = update_pool.attach(bot)
+        logger.info(f"Бот запущен (режим {RUNTIME}, воркеров {pool.workers}).")
+        alerts.start_background_tasks(bot)
+        if RUNTIME == "webhook":
+            import webhook
+            webhook.run(bot)
+            return
         bot.infinity_polling(timeout=10, long_polling_timeout=5)
     except Exception as e:
         logger.exception(f"Ошибка при запуске polling: {e}")
@@ -1,35 +1,53 @@
 # database.py
+import os
 import sqlite3
+import threading
 import time
-from typing import List, Optional, Dict, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Dict, Tuple, Union
 import json
 from datetime import datetime
 
+from alert_index import alert_index, profit_alert_index
+from leaderboard import leaderboard, BUCKET_SECONDS as LEADERBOARD_BUCKET
+
 DB_PATH = "bsp.db"
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Каждый поток держит одно долгоживущее соединение: WAL позволяет фоновым
+# потокам читать, пока другой поток пишет, а synchronous=NORMAL убирает fsync
+# на каждый коммит (в WAL это безопасно — теряется максимум последний коммит
+# при отключении питания, но не целостность БД).
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
+_local = threading.local()
+
+
+def archive_path(db_path: str) -> str:
+    """Файл архива сырых тиков рядом с основной БД: bsp.db -> bsp_archive.db."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # Старые тики живут в отдельной подключённой БД (см. archive_market_ticks);
+    # market_all — единый вид на оперативные и архивные строки
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(path),))
+    conn.execute("PRAGMA archive.journal_mode=WAL")
+    conn.execute("PRAGMA archive.synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive.market (
             id INTEGER PRIMARY KEY,
-            username TEXT,
-            bonus REAL DEFAULT 0,
-            notify_enabled INTEGER DEFAULT 1,
-            notify_interval INTEGER DEFAULT 15,
-            last_reminder INTEGER DEFAULT 0,
-            anchor INTEGER DEFAULT 0,
-            trade_level INTEGER DEFAULT 0
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS market (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
             resource TEXT,
             buy REAL,
             sell REAL,
@@ -37,313 +55,762 @@ def init_db():
             timestamp INTEGER
         )
     """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            resource TEXT,
-            target_price REAL,
-            direction TEXT,
-            speed REAL,
-            current_price REAL,
-            alert_time TEXT,
-            status TEXT DEFAULT 'active',
-            created_at TEXT,
-            chat_id INTEGER
-        )
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_market_resource_ts ON market (resource, timestamp)")
+    conn.execute("""
+        CREATE TEMP VIEW IF NOT EXISTS market_all AS
+        SELECT id, resource, buy, sell, quantity, timestamp FROM main.market
+        UNION ALL
+        SELECT id, resource, buy, sell, quantity, timestamp FROM archive.market
     """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp INTEGER,
-            text TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER PRIMARY KEY,
-            notify_enabled INTEGER DEFAULT 1,
-            notify_interval INTEGER DEFAULT 15,
-            last_reminder INTEGER DEFAULT 0,
-            pinned_message_id INTEGER,
-            no_pin INTEGER DEFAULT 0,
-            profit_settings TEXT DEFAULT '{}'
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS chat_profit_alerts (
+    conn.commit()
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока (создаёт при первом обращении).
+    Соединение живёт до конца потока — закрывать его не нужно.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+
+def close_connection() -> None:
+    """Закрывает соединение текущего потока, если оно было открыто."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+        _local.path = None
+
+
+@contextmanager
+def transaction():
+    """
+    Курсор внутри одной транзакции: коммит при успехе, откат при исключении.
+    """
+    conn = get_connection()
+    with conn:
+        yield conn.cursor()
+
+
+def _fetchone(sql: str, params=()) -> Optional[sqlite3.Row]:
+    return get_connection().execute(sql, params).fetchone()
+
+
+def _fetchall(sql: str, params=()) -> List[sqlite3.Row]:
+    return get_connection().execute(sql, params).fetchall()
+
+def init_db():
+    with transaction() as c:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                username TEXT,
+                bonus REAL DEFAULT 0,
+                notify_enabled INTEGER DEFAULT 1,
+                notify_interval INTEGER DEFAULT 15,
+                last_reminder INTEGER DEFAULT 0,
+                anchor INTEGER DEFAULT 0,
+                trade_level INTEGER DEFAULT 0
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS market (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                resource TEXT,
+                buy REAL,
+                sell REAL,
+                quantity INTEGER,
+                timestamp INTEGER
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                resource TEXT,
+                target_price REAL,
+                direction TEXT,
+                speed REAL,
+                current_price REAL,
+                alert_time TEXT,
+                status TEXT DEFAULT 'active',
+                created_at TEXT,
+                chat_id INTEGER
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp INTEGER,
+                text TEXT
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS chats (
+                chat_id INTEGER PRIMARY KEY,
+                notify_enabled INTEGER DEFAULT 1,
+                notify_interval INTEGER DEFAULT 15,
+                last_reminder INTEGER DEFAULT 0,
+                pinned_message_id INTEGER,
+                no_pin INTEGER DEFAULT 0,
+                profit_settings TEXT DEFAULT '{}'
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS chat_profit_alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                resource TEXT,
+                threshold_price REAL,
+                min_quantity INTEGER,
+                active INTEGER DEFAULT 1
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                resource TEXT,
+                action TEXT,
+                quantity INTEGER,
+                price REAL,
+                total_gold REAL,
+                profit REAL DEFAULT 0,
+                timestamp INTEGER
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS group_users (
+                chat_id INTEGER,
+                user_id INTEGER,
+                username TEXT,
+                PRIMARY KEY (chat_id, user_id)
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_at INTEGER
+            )
+        """)
+    run_migrations()
+
+# Migrations
+# Каждая миграция — (версия, список шагов). Шаг — SQL или функция от курсора
+# (для переноса данных). Применяются по возрастанию версии, каждая в своей
+# транзакции вместе с записью в schema_version.
+# Уже выпущенные миграции не меняем — только добавляем новые в конец.
+MIGRATIONS: List[Tuple[int, List[Union[str, Callable]]]] = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_market_resource_ts ON market (resource, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_market_ts ON market (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_status ON alerts (status)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_user_status ON alerts (user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_ts_user ON transactions (timestamp, user_id, action, total_gold)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_ts ON transactions (user_id, timestamp, action, total_gold)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_profit_alerts_chat_active ON chat_profit_alerts (chat_id, active)",
+    ]),
+    # Покрывающий индекс для недельной статистики (get_week_stats) — заменяет
+    # idx_market_resource_ts, который является его префиксом.
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_market_resource_ts_prices ON market (resource, timestamp, buy, sell, quantity)",
+        "DROP INDEX IF EXISTS idx_market_resource_ts",
+    ]),
+    # Дедупликация форвардов: один и тот же снимок рынка сохраняется один раз
+    (3, [
+        """CREATE TABLE IF NOT EXISTS market_dedup (
+            digest TEXT PRIMARY KEY,
+            timestamp INTEGER
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_market_dedup_ts ON market_dedup (timestamp)",
+    ]),
+    # Outbox: уведомления пишутся в той же транзакции, что и смена статуса алерта
+    (4, [
+        """CREATE TABLE IF NOT EXISTS outbox (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,
             chat_id INTEGER,
+            text TEXT,
+            parse_mode TEXT,
+            priority INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at INTEGER,
+            created_at INTEGER,
+            sent_at INTEGER,
+            last_error TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)",
+    ]),
+    # Свечи OHLC (1 мин и 1 ч) по ресурсам; заполняются из уже накопленных тиков
+    (5, [
+        """CREATE TABLE IF NOT EXISTS market_candles (
+            interval INTEGER,
             resource TEXT,
-            threshold_price REAL,
-            min_quantity INTEGER,
-            active INTEGER DEFAULT 1
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bucket INTEGER,
+            open_buy REAL, high_buy REAL, low_buy REAL, close_buy REAL,
+            open_sell REAL, high_sell REAL, low_sell REAL, close_sell REAL,
+            close_quantity INTEGER,
+            max_quantity INTEGER,
+            ticks INTEGER,
+            open_ts INTEGER,
+            close_ts INTEGER,
+            PRIMARY KEY (interval, resource, bucket)
+        ) WITHOUT ROWID""",
+        lambda c: _rebuild_candles(c, 0),
+    ]),
+    # Напоминания «БД устарела»: срок следующего хранится явно, чтобы выбирать
+    # только получателей, которым пора, по частичному индексу
+    (6, [
+        "ALTER TABLE users ADD COLUMN next_reminder_at INTEGER DEFAULT 0",
+        "ALTER TABLE chats ADD COLUMN next_reminder_at INTEGER DEFAULT 0",
+        "UPDATE users SET next_reminder_at = COALESCE(last_reminder, 0) + COALESCE(notify_interval, 15) * 60",
+        "UPDATE chats SET next_reminder_at = COALESCE(last_reminder, 0) + COALESCE(notify_interval, 15) * 60",
+        "CREATE INDEX IF NOT EXISTS idx_users_next_reminder ON users (next_reminder_at) WHERE notify_enabled=1",
+        "CREATE INDEX IF NOT EXISTS idx_chats_next_reminder ON chats (next_reminder_at) WHERE notify_enabled=1",
+    ]),
+    # Почасовые суммы чистого золота по игрокам для суточного рейтинга (/top)
+    (7, [
+        """CREATE TABLE IF NOT EXISTS leaderboard_hourly (
+            bucket INTEGER,
             user_id INTEGER,
-            resource TEXT,
-            action TEXT,
-            quantity INTEGER,
-            price REAL,
-            total_gold REAL,
-            profit REAL DEFAULT 0,
-            timestamp INTEGER
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS group_users (
-            chat_id INTEGER,
-            user_id INTEGER,
-            username TEXT,
-            PRIMARY KEY (chat_id, user_id)
-        )
-    """)
-    conn.commit()
-    conn.close()
+            net_gold REAL,
+            tx_count INTEGER,
+            PRIMARY KEY (bucket, user_id)
+        ) WITHOUT ROWID""",
+        f"""INSERT INTO leaderboard_hourly (bucket, user_id, net_gold, tx_count)
+            SELECT timestamp - timestamp % {LEADERBOARD_BUCKET}, user_id,
+                   SUM(CASE WHEN action = 'sell' THEN total_gold ELSE -total_gold END), COUNT(*)
+            FROM transactions GROUP BY 1, 2""",
+    ]),
+]
+
+def get_schema_version() -> int:
+    row = _fetchone("SELECT MAX(version) as v FROM schema_version")
+    return row['v'] if row and row['v'] is not None else 0
+
+def run_migrations():
+    current = get_schema_version()
+    for version, statements in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        with transaction() as c:
+            for step in statements:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute("INSERT INTO schema_version (version, applied_at) VALUES (?, ?)", (version, int(time.time())))
+        current = version
+
+# User settings cache
+# Настройки пользователя читаются на каждый /stat, /history и таймер, а меняются
+# редко — держим их в памяти (LRU) и обновляем при записи (write-through).
+USER_CACHE_SIZE = 10000
+USER_SETTINGS_DEFAULTS = {"bonus": 0.0, "anchor": 0, "trade_level": 0, "notify_enabled": 1, "notify_interval": 15}
+
+_user_cache: "OrderedDict[int, Dict]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_gen = 0
+
+def _user_cache_write(user_id: int, values: Dict):
+    global _user_cache_gen
+    with _user_cache_lock:
+        _user_cache_gen += 1
+        cached = _user_cache.get(user_id)
+        if cached is not None:
+            cached.update({k: v for k, v in values.items() if k in USER_SETTINGS_DEFAULTS})
+
+def invalidate_user_cache(user_id: Optional[int] = None):
+    global _user_cache_gen
+    with _user_cache_lock:
+        _user_cache_gen += 1
+        if user_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(user_id, None)
+
+def get_user_settings(user_id: int) -> Dict:
+    """
+    Настройки пользователя (bonus, anchor, trade_level, notify_enabled, notify_interval)
+    из кэша; при промахе — одно чтение из БД. Незнакомый пользователь при первом
+    промахе регистрируется (INSERT OR IGNORE), как раньше делал ensure_user в get_user_bonus.
+    """
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached is not None:
+            _user_cache.move_to_end(user_id)
+            return dict(cached)
+        gen = _user_cache_gen
+    row = _fetchone("SELECT bonus, anchor, trade_level, notify_enabled, notify_interval FROM users WHERE id = ?", (user_id,))
+    settings = dict(USER_SETTINGS_DEFAULTS)
+    if row:
+        settings.update({k: row[k] for k in row.keys() if row[k] is not None})
+    else:
+        ensure_user(user_id, None)
+    with _user_cache_lock:
+        # Если за время чтения была запись — не кладём в кэш возможно устаревшее значение
+        if gen == _user_cache_gen:
+            _user_cache[user_id] = settings
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
+    return dict(settings)
 
 # User functions
 def ensure_user(user_id: int, username: str):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", (user_id, username))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)", (user_id, username))
 
 def get_user(user_id: int) -> Optional[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
     return dict(row) if row else None
 
 def update_user_bonus(user_id: int, bonus: float):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET bonus = ? WHERE id = ?", (bonus, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE users SET bonus = ? WHERE id = ?", (bonus, user_id))
+    _user_cache_write(user_id, {"bonus": bonus})
+    alert_index.update_user_bonus(user_id, bonus)
 
 def update_user_field(user_id: int, field: str, value):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute(f"UPDATE users SET {field}=? WHERE id=?", (value, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute(f"UPDATE users SET {field}=? WHERE id=?", (value, user_id))
+    _user_cache_write(user_id, {field: value})
+    if field == 'bonus':
+        alert_index.update_user_bonus(user_id, value)
 
 def ensure_group_user(chat_id: int, user_id: int, username: str):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO group_users (chat_id, user_id, username) VALUES (?, ?, ?)", (chat_id, user_id, username))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("INSERT OR IGNORE INTO group_users (chat_id, user_id, username) VALUES (?, ?, ?)", (chat_id, user_id, username))
 
 def get_group_users(chat_id: int) -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT user_id, username FROM group_users WHERE chat_id = ?", (chat_id,))
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT user_id, username FROM group_users WHERE chat_id = ?", (chat_id,))
     return [dict(r) for r in rows]
 
 def get_active_alerts() -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM alerts WHERE status='active'")
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM alerts WHERE status='active'")
+    return [dict(r) for r in rows]
+
+def get_active_alerts_for_resources(resources: List[str]) -> List[Dict]:
+    if not resources:
+        return []
+    placeholders = ', '.join('?' for _ in resources)
+    rows = _fetchall(f"SELECT * FROM alerts WHERE status='active' AND resource IN ({placeholders})", tuple(resources))
     return [dict(r) for r in rows]
 
 def get_user_active_alerts(user_id: int) -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM alerts WHERE user_id=? AND status='active'", (user_id,))
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM alerts WHERE user_id=? AND status='active'", (user_id,))
     return [dict(r) for r in rows]
 
 def get_alert_by_id(alert_id: int) -> Optional[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM alerts WHERE id = ?", (alert_id,))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone("SELECT * FROM alerts WHERE id = ?", (alert_id,))
     return dict(row) if row else None
 
-def update_alert_status(alert_id: int, status: str):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE alerts SET status=? WHERE id=?", (status, alert_id))
-    conn.commit()
-    conn.close()
+def update_alert_status(alert_id: int, status: str, outbox: Optional[List[Dict]] = None) -> bool:
+    """
+    Переводит активный алерт в status. outbox — уведомления, которые записываются
+    в той же транзакции (см. enqueue_outbox). Алерт закрывают и планировщик, и поток
+    событий рынка: статус меняет только первый, и только его уведомления уходят.
+    Возвращает True, если алерт закрыт этим вызовом.
+    """
+    with transaction() as c:
+        c.execute("UPDATE alerts SET status=? WHERE id=? AND status='active'", (status, alert_id))
+        if c.rowcount != 1:
+            return False
+        _insert_outbox(c, outbox)
+    alert_index.remove(alert_id)
+    return True
 
-def update_alert_fields(alert_id: int, fields: dict):
-    conn = get_connection()
-    c = conn.cursor()
+def update_alert_fields(alert_id: int, fields: dict, outbox: Optional[List[Dict]] = None):
     keys = ', '.join([f"{k}=?" for k in fields.keys()])
     values = list(fields.values())
     values.append(alert_id)
-    c.execute(f"UPDATE alerts SET {keys} WHERE id=?", values)
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute(f"UPDATE alerts SET {keys} WHERE id=?", values)
+        _insert_outbox(c, outbox)
 
 def insert_alert_record(user_id: int, resource: str, target_price: float, direction: str,
                         speed: float, current_price: float, alert_time: str, chat_id: Optional[int] = None) -> int:
-    conn = get_connection()
-    c = conn.cursor()
-    now = time.time()
-    c.execute("""
-        INSERT INTO alerts (user_id, resource, target_price, direction, speed, current_price, alert_time, created_at, chat_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, resource, target_price, direction, speed, current_price, alert_time, datetime.now().isoformat(), chat_id))
-    alert_id = c.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO alerts (user_id, resource, target_price, direction, speed, current_price, alert_time, created_at, chat_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, resource, target_price, direction, speed, current_price, alert_time, datetime.now().isoformat(), chat_id))
+        alert_id = c.lastrowid
+    alert_index.add(alert_id, user_id, resource, direction, target_price, get_user_settings(user_id)['bonus'])
     return alert_id
 
 def cancel_user_alerts(user_id: int) -> int:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE alerts SET status='cancelled' WHERE user_id=? AND status='active'", (user_id,))
-    count = c.rowcount
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE alerts SET status='cancelled' WHERE user_id=? AND status='active'", (user_id,))
+        count = c.rowcount
+    alert_index.remove_user(user_id)
     return count
 
+def load_alert_index():
+    """Пересобирает alert_index из активных алертов (вызывается при старте)."""
+    active = get_active_alerts()
+    bonuses = {uid: get_user_settings(uid)['bonus'] for uid in {a['user_id'] for a in active}}
+    alert_index.load(active, bonuses)
+
 # Market functions
 def insert_market_record(resource: str, buy: float, sell: float, quantity: int, timestamp: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)", (resource, buy, sell, quantity, timestamp))
-    conn.commit()
-    conn.close()
+    row = (resource, buy, sell, quantity, timestamp)
+    with transaction() as c:
+        c.execute("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)", row)
+        _update_candles(c, [row])
+
+# Сколько хранить ключи дедупликации в market_dedup
+DEDUP_RETENTION_SECONDS = 24 * 3600
+
+def ingest_market_snapshot(records: List[Dict], history_text: Optional[str] = None, dedup_key: Optional[str] = None) -> int:
+    """
+    Сохраняет все записи одного форварда рынка и строку history одной транзакцией:
+    либо применяется всё, либо ничего. Возвращает число сохранённых записей.
+    Если dedup_key уже встречался (уникальный ключ в market_dedup) — ничего не пишет и возвращает 0.
+    Свечи market_candles обновляются в той же транзакции.
+    """
+    rows = [(r['resource'], r['buy'], r['sell'], r['quantity'], r['timestamp']) for r in records]
+    now = int(time.time())
+    with transaction() as c:
+        if dedup_key is not None:
+            c.execute("INSERT OR IGNORE INTO market_dedup (digest, timestamp) VALUES (?, ?)", (dedup_key, now))
+            if c.rowcount == 0:
+                return 0
+            c.execute("DELETE FROM market_dedup WHERE timestamp < ?", (now - DEDUP_RETENTION_SECONDS,))
+        c.executemany("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)", rows)
+        _update_candles(c, rows)
+        if history_text is not None:
+            c.execute("INSERT INTO history (timestamp, text) VALUES (?, ?)", (now, history_text))
+    return len(rows)
+
+def insert_history(text: str, timestamp: Optional[int] = None):
+    with transaction() as c:
+        c.execute("INSERT INTO history (timestamp, text) VALUES (?, ?)", (timestamp or int(time.time()), text))
 
 def get_latest_market(resource: str) -> Optional[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM market WHERE resource=? ORDER BY timestamp DESC LIMIT 1", (resource,))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone("SELECT * FROM market WHERE resource=? ORDER BY timestamp DESC LIMIT 1", (resource,))
     return dict(row) if row else None
 
+def get_latest_market_per_resource() -> List[Dict]:
+    rows = _fetchall("""
+        SELECT m.* FROM market m
+        JOIN (SELECT resource, MAX(timestamp) as ts FROM market GROUP BY resource) last
+          ON m.resource = last.resource AND m.timestamp = last.ts
+        ORDER BY m.timestamp DESC, m.id DESC
+    """)
+    latest: Dict[str, Dict] = {}
+    for r in rows:
+        latest.setdefault(r['resource'], dict(r))
+    return list(latest.values())
+
 def get_latest_market_all() -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM market ORDER BY timestamp DESC LIMIT 4")
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM market ORDER BY timestamp DESC LIMIT 4")
     return [dict(r) for r in rows]
 
 def get_recent_market(resource: str, minutes: int = 15) -> List[Dict]:
     cutoff = int(time.time()) - minutes * 60
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM market WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM market WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
     return [dict(r) for r in rows]
 
+def get_recent_market_many(resources: List[str], since: int) -> Dict[str, List[Dict]]:
+    """Тики нескольких ресурсов с since одним запросом: {ресурс: [записи по возрастанию времени]}."""
+    if not resources:
+        return {}
+    placeholders = ",".join("?" * len(resources))
+    rows = _fetchall(f"SELECT * FROM market WHERE resource IN ({placeholders}) AND timestamp>=? ORDER BY resource, timestamp ASC, id ASC",
+                     (*resources, since))
+    recent: Dict[str, List[Dict]] = {}
+    for r in rows:
+        recent.setdefault(r['resource'], []).append(dict(r))
+    return recent
+
 def get_market_history(resource: str, hours: int = 24) -> List[Dict]:
     cutoff = int(time.time()) - hours * 3600
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM market WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM market WHERE resource=? AND timestamp>=? ORDER BY timestamp ASC", (resource, cutoff))
     return [dict(r) for r in rows]
 
 def get_market_week_range(resource: str, price_field: str, week_start: int) -> Tuple[float, float]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute(f"SELECT MIN({price_field}) as minp, MAX({price_field}) as maxp FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone(f"SELECT MIN({price_field}) as minp, MAX({price_field}) as maxp FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
     return (row['minp'], row['maxp']) if row else (0, 0)
 
 def get_market_week_max_price(resource: str, price_field: str, week_start: int) -> float:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute(f"SELECT MAX({price_field}) as maxp FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone(f"SELECT MAX({price_field}) as maxp FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
     return row['maxp'] if row and row['maxp'] is not None else 0.0
 
 def get_market_week_max_qty(resource: str, week_start: int) -> int:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT MAX(quantity) as maxq FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone("SELECT MAX(quantity) as maxq FROM market WHERE resource=? AND timestamp>=?", (resource, week_start))
     return row['maxq'] if row and row['maxq'] else 0
 
+# Retention
+# Сырые тики старше MARKET_RETENTION_DAYS переносятся в archive.market (отдельный
+# файл БД) небольшими пачками: каждая пачка — короткая транзакция, между пачками
+# пауза, поэтому блокировка записи не держится долго. Свечи остаются в основной БД.
+MARKET_RETENTION_DAYS = 14
+ARCHIVE_BATCH_SIZE = 2000
+ARCHIVE_BATCH_PAUSE = 0.05
+
+_ARCHIVE_BATCH_IDS = "SELECT id FROM main.market WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?"
+
+def market_retention_cutoff(now: Optional[int] = None) -> int:
+    return (now or int(time.time())) - MARKET_RETENTION_DAYS * 24 * 3600
+
+def archive_market_batch(cutoff: int, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Переносит в архив одну пачку тиков старше cutoff. Возвращает число перенесённых строк.
+    Коммит двух файлов БД в WAL не атомарен, поэтому перенос идёт двумя транзакциями:
+    сначала пачка копируется в архив, и только после её коммита из main удаляются строки,
+    которые в архиве уже есть. Сбой между ними оставляет пачку в обеих БД (в market_all
+    она до следующего запуска видна дважды); повторный перенос её дочищает — тики не теряются.
+    """
+    with transaction() as c:
+        c.execute(f"""
+            INSERT OR IGNORE INTO archive.market (id, resource, buy, sell, quantity, timestamp)
+            SELECT id, resource, buy, sell, quantity, timestamp FROM main.market
+            WHERE id IN ({_ARCHIVE_BATCH_IDS})
+        """, (cutoff, batch_size))
+    with transaction() as c:
+        c.execute(f"""
+            DELETE FROM main.market WHERE id IN (
+                SELECT id FROM archive.market WHERE id IN ({_ARCHIVE_BATCH_IDS}))
+        """, (cutoff, batch_size))
+        return c.rowcount
+
+def archive_market_ticks(cutoff: Optional[int] = None, batch_size: int = ARCHIVE_BATCH_SIZE,
+                         pause: float = ARCHIVE_BATCH_PAUSE) -> int:
+    """Переносит в архив все тики старше cutoff (по умолчанию — срок хранения). Возвращает их число."""
+    cutoff = cutoff if cutoff is not None else market_retention_cutoff()
+    total = 0
+    while True:
+        moved = archive_market_batch(cutoff, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        time.sleep(pause)
+
+def get_market_range(resource: str, since: int, until: Optional[int] = None) -> List[Dict]:
+    """
+    Сырые тики ресурса за [since, until). Если диапазон заходит за срок хранения,
+    читаются и архивные строки.
+    """
+    until = until if until is not None else int(time.time()) + 1
+    source = "market_all" if since < market_retention_cutoff() else "main.market"
+    rows = _fetchall(f"SELECT * FROM {source} WHERE resource=? AND timestamp>=? AND timestamp<? ORDER BY timestamp ASC, id ASC",
+                     (resource, since, until))
+    return [dict(r) for r in rows]
+
+# Candles
+# Свечи OHLC по ресурсам: 1 мин и 1 ч. Обновляются при каждой вставке тиков
+# (ingest_market_snapshot) и в любой момент пересобираются из сырых строк market.
+# quantity на рынке — остаток лота, а не оборот, поэтому вместо суммы
+# храним последний (close_quantity) и максимальный (max_quantity) остаток.
+CANDLE_INTERVALS = (60, 3600)
+CANDLE_MAX_POINTS = 60
+# Минутные свечи нужны только для последнего часа (/history, таймеры);
+# старые удаляются вместе с архивацией тиков (prune_minute_candles)
+MINUTE_CANDLE_KEEP_SECONDS = 2 * 3600
+
+_CANDLE_UPSERT = """
+    INSERT INTO market_candles (interval, resource, bucket,
+        open_buy, high_buy, low_buy, close_buy, open_sell, high_sell, low_sell, close_sell,
+        close_quantity, max_quantity, ticks, open_ts, close_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+    ON CONFLICT (interval, resource, bucket) DO UPDATE SET
+        open_buy = CASE WHEN excluded.open_ts < open_ts THEN excluded.open_buy ELSE open_buy END,
+        open_sell = CASE WHEN excluded.open_ts < open_ts THEN excluded.open_sell ELSE open_sell END,
+        high_buy = MAX(high_buy, excluded.high_buy),
+        low_buy = MIN(low_buy, excluded.low_buy),
+        high_sell = MAX(high_sell, excluded.high_sell),
+        low_sell = MIN(low_sell, excluded.low_sell),
+        close_buy = CASE WHEN excluded.close_ts >= close_ts THEN excluded.close_buy ELSE close_buy END,
+        close_sell = CASE WHEN excluded.close_ts >= close_ts THEN excluded.close_sell ELSE close_sell END,
+        close_quantity = CASE WHEN excluded.close_ts >= close_ts THEN excluded.close_quantity ELSE close_quantity END,
+        max_quantity = MAX(max_quantity, excluded.max_quantity),
+        ticks = ticks + 1,
+        open_ts = MIN(open_ts, excluded.open_ts),
+        close_ts = MAX(close_ts, excluded.close_ts)
+"""
+
+def _update_candles(c, rows: List[Tuple]):
+    """rows — (resource, buy, sell, quantity, timestamp) в порядке вставки в market."""
+    c.executemany(_CANDLE_UPSERT, [
+        (interval, resource, timestamp - timestamp % interval,
+         buy, buy, buy, buy, sell, sell, sell, sell, quantity, quantity, timestamp, timestamp)
+        for interval in CANDLE_INTERVALS
+        for resource, buy, sell, quantity, timestamp in rows
+    ])
+
+def _rebuild_candles(c, since: int):
+    """
+    Пересобирает свечи с начала интервала, содержащего since, из сырых строк
+    market и архива (market_all).
+    """
+    for interval in CANDLE_INTERVALS:
+        start = since - since % interval
+        if interval == 60:
+            start = max(start, int(time.time()) - MINUTE_CANDLE_KEEP_SECONDS)
+            start -= start % interval
+        c.execute("DELETE FROM market_candles WHERE interval=? AND bucket>=?", (interval, start))
+        c.execute("""
+            INSERT INTO market_candles
+            SELECT :interval, resource, bucket,
+                   MAX(CASE WHEN rn_first = 1 THEN buy END), MAX(buy), MIN(buy), MAX(CASE WHEN rn_last = 1 THEN buy END),
+                   MAX(CASE WHEN rn_first = 1 THEN sell END), MAX(sell), MIN(sell), MAX(CASE WHEN rn_last = 1 THEN sell END),
+                   MAX(CASE WHEN rn_last = 1 THEN quantity END), MAX(quantity),
+                   COUNT(*), MIN(timestamp), MAX(timestamp)
+            FROM (
+                SELECT resource, buy, sell, quantity, timestamp,
+                       timestamp - timestamp % :interval AS bucket,
+                       ROW_NUMBER() OVER (PARTITION BY resource, timestamp - timestamp % :interval
+                                          ORDER BY timestamp, id) AS rn_first,
+                       ROW_NUMBER() OVER (PARTITION BY resource, timestamp - timestamp % :interval
+                                          ORDER BY timestamp DESC, id DESC) AS rn_last
+                FROM market_all WHERE timestamp >= :start
+            )
+            GROUP BY resource, bucket
+        """, {"interval": interval, "start": start})
+
+def rebuild_candles(since: int = 0):
+    """Пересобирает market_candles начиная с since (по умолчанию — целиком)."""
+    with transaction() as c:
+        _rebuild_candles(c, since)
+
+def prune_minute_candles(older_than: Optional[int] = None) -> int:
+    """Удаляет минутные свечи старше срока хранения. Возвращает их число."""
+    older_than = older_than if older_than is not None else int(time.time()) - MINUTE_CANDLE_KEEP_SECONDS
+    with transaction() as c:
+        c.execute("DELETE FROM market_candles WHERE interval=60 AND bucket<?", (older_than,))
+        return c.rowcount
+
+def pick_candle_interval(span_seconds: int, max_points: int = CANDLE_MAX_POINTS) -> int:
+    """Самая мелкая свеча, при которой диапазон укладывается в max_points точек; иначе самая крупная."""
+    for interval in CANDLE_INTERVALS:
+        if span_seconds / interval <= max_points:
+            return interval
+    return CANDLE_INTERVALS[-1]
+
+def get_market_candles(resource: str, since: int, until: Optional[int] = None,
+                       interval: Optional[int] = None) -> List[Dict]:
+    """
+    Свечи ресурса за [since, until) по возрастанию времени. Интервал по умолчанию
+    выбирается по длине диапазона (pick_candle_interval). Помимо OHLC в каждой
+    свече есть timestamp/buy/sell/quantity закрытия — её можно подавать туда же,
+    куда и сырые записи market.
+    """
+    until = until if until is not None else int(time.time()) + 1
+    interval = interval or pick_candle_interval(until - since)
+    rows = _fetchall("""
+        SELECT * FROM market_candles
+        WHERE interval=? AND resource=? AND bucket>=? AND bucket<?
+        ORDER BY bucket ASC
+    """, (interval, resource, since - since % interval, until))
+    candles = []
+    for r in rows:
+        candle = dict(r)
+        candle.update(timestamp=r['close_ts'], buy=r['close_buy'], sell=r['close_sell'], quantity=r['close_quantity'])
+        candles.append(candle)
+    return candles
+
+def get_week_stats(week_start: int) -> Dict[str, Dict]:
+    """
+    Недельные агрегаты по всем ресурсам за один запрос:
+    {resource: {"min_buy", "max_buy", "min_sell", "max_sell", "max_qty"}}
+    Полные часы берутся из часовых свечей, неполный первый час — из сырых тиков
+    market (он в пределах срока хранения). Список ресурсов собирается обходом
+    первичного ключа свечей, и каждый ресурс читается диапазоном по ключу/индексу.
+    """
+    hour_start = (week_start + 3599) // 3600 * 3600
+    rows = _fetchall("""
+        WITH RECURSIVE resources(resource) AS (
+            SELECT MIN(resource) FROM market_candles WHERE interval=3600
+            UNION ALL
+            SELECT (SELECT MIN(resource) FROM market_candles WHERE interval=3600 AND resource>r.resource)
+            FROM resources r WHERE r.resource IS NOT NULL
+        )
+        SELECT resource,
+               MIN(low_buy) as min_buy, MAX(high_buy) as max_buy,
+               MIN(low_sell) as min_sell, MAX(high_sell) as max_sell,
+               MAX(max_quantity) as max_qty
+        FROM (
+            SELECT c.resource, c.low_buy, c.high_buy, c.low_sell, c.high_sell, c.max_quantity
+            FROM resources r JOIN market_candles c
+              ON c.interval=3600 AND c.resource=r.resource AND c.bucket>=:hour_start
+            UNION ALL
+            SELECT m.resource, m.buy, m.buy, m.sell, m.sell, m.quantity
+            FROM resources r JOIN main.market m
+              ON m.resource=r.resource AND m.timestamp>=:week_start AND m.timestamp<:hour_start
+        )
+        GROUP BY resource
+    """, {"week_start": week_start, "hour_start": hour_start})
+    return {r['resource']: {
+        "min_buy": r['min_buy'], "max_buy": r['max_buy'] or 0.0,
+        "min_sell": r['min_sell'], "max_sell": r['max_sell'] or 0.0,
+        "max_qty": r['max_qty'] or 0,
+    } for r in rows}
+
 def get_global_latest_timestamp() -> Optional[int]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT MAX(timestamp) as ts FROM market")
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone("SELECT MAX(timestamp) as ts FROM market")
     return row['ts'] if row and row['ts'] else None
 
 # Push settings
 def get_users_with_notifications_enabled() -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, notify_interval, last_reminder FROM users WHERE notify_enabled=1")
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT id, notify_interval, last_reminder FROM users WHERE notify_enabled=1")
     return [{"id": r[0], "notify_interval": r[1], "last_reminder": r[2]} for r in rows]
 
 def set_user_last_reminder(user_id: int, ts: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET last_reminder=? WHERE id=?", (ts, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE users SET last_reminder=?, next_reminder_at=? + notify_interval * 60 WHERE id=?", (ts, ts, user_id))
 
 def get_chats_with_notifications_enabled() -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT chat_id, notify_interval, last_reminder FROM chats WHERE notify_enabled=1")
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT chat_id, notify_interval, last_reminder FROM chats WHERE notify_enabled=1")
     return [{"chat_id": r[0], "notify_interval": r[1], "last_reminder": r[2]} for r in rows]
 
 def set_chat_last_reminder(chat_id: int, ts: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE chats SET last_reminder=? WHERE chat_id=?", (ts, chat_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE chats SET last_reminder=?, next_reminder_at=? + notify_interval * 60 WHERE chat_id=?", (ts, ts, chat_id))
+
+REMINDER_BATCH_SIZE = 1000
+_REMINDER_KEYS = {"users": "id", "chats": "chat_id"}
+
+def claim_due_reminders(table: str, now: int, limit: int = REMINDER_BATCH_SIZE) -> List[int]:
+    """
+    Выбирает до limit получателей из users или chats, которым пора напомнить
+    (next_reminder_at <= now, по idx_*_next_reminder), и одним executemany
+    отмечает напоминание. Возвращает их id.
+    """
+    key = _REMINDER_KEYS[table]
+    with transaction() as c:
+        ids = [r[0] for r in c.execute(
+            f"SELECT {key} FROM {table} WHERE notify_enabled=1 AND next_reminder_at<=? LIMIT ?", (now, limit))]
+        c.executemany(f"UPDATE {table} SET last_reminder=?, next_reminder_at=? + notify_interval * 60 WHERE {key}=?",
+                      [(now, now, i) for i in ids])
+    return ids
 
 def get_user_push_settings(user_id: int) -> Dict:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT notify_enabled as enabled, notify_interval as interval FROM users WHERE id=?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return {"enabled": bool(row[0]), "interval": row[1]}
-    return {"enabled": True, "interval": 15}
+    settings = get_user_settings(user_id)
+    return {"enabled": bool(settings['notify_enabled']), "interval": settings['notify_interval']}
 
 def update_user_push_settings(user_id: int, enabled: bool = None, interval: int = None):
-    conn = get_connection()
-    c = conn.cursor()
-    if enabled is not None:
-        c.execute("UPDATE users SET notify_enabled=? WHERE id=?", (1 if enabled else 0, user_id))
-    if interval is not None:
-        c.execute("UPDATE users SET notify_interval=? WHERE id=?", (interval, user_id))
-    conn.commit()
-    conn.close()
+    changed = {}
+    with transaction() as c:
+        if enabled is not None:
+            c.execute("UPDATE users SET notify_enabled=? WHERE id=?", (1 if enabled else 0, user_id))
+            changed['notify_enabled'] = 1 if enabled else 0
+        if interval is not None:
+            c.execute("UPDATE users SET notify_interval=?, next_reminder_at=last_reminder + ? * 60 WHERE id=?", (interval, interval, user_id))
+            changed['notify_interval'] = interval
+    _user_cache_write(user_id, changed)
 
 def get_chat_settings(chat_id: int) -> Dict:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM chats WHERE chat_id=?", (chat_id,))
-    row = c.fetchone()
-    conn.close()
+    row = _fetchone("SELECT * FROM chats WHERE chat_id=?", (chat_id,))
     if row:
         d = dict(row)
         d['notify_enabled'] = bool(d['notify_enabled'])
@@ -352,136 +819,232 @@ def get_chat_settings(chat_id: int) -> Dict:
     return {"notify_enabled": True, "notify_interval": 15, "pinned_message_id": None, "no_pin": False, "profit_settings": {}}
 
 def upsert_chat_settings(chat_id: int, notify_enabled: bool, interval: int, pinned_message_id: int = None, no_pin: bool = None, profit_settings: dict = None):
-    conn = get_connection()
-    c = conn.cursor()
     current = get_chat_settings(chat_id)
     new_ps = json.dumps(current['profit_settings'] | (profit_settings or {}))
-    c.execute("""
-        INSERT INTO chats (chat_id, notify_enabled, notify_interval, pinned_message_id, no_pin, profit_settings) 
-        VALUES (?, ?, ?, ?, ?, ?) 
-        ON CONFLICT(chat_id) DO UPDATE SET 
-        notify_enabled=excluded.notify_enabled, 
-        notify_interval=excluded.notify_interval, 
-        pinned_message_id=excluded.pinned_message_id,
-        no_pin=excluded.no_pin,
-        profit_settings=excluded.profit_settings
-    """, (chat_id, 1 if notify_enabled else 0, interval, pinned_message_id, 1 if no_pin else 0, new_ps))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO chats (chat_id, notify_enabled, notify_interval, pinned_message_id, no_pin, profit_settings) 
+            VALUES (?, ?, ?, ?, ?, ?) 
+            ON CONFLICT(chat_id) DO UPDATE SET 
+            notify_enabled=excluded.notify_enabled, 
+            notify_interval=excluded.notify_interval, 
+            next_reminder_at=chats.last_reminder + excluded.notify_interval * 60,
+            pinned_message_id=excluded.pinned_message_id,
+            no_pin=excluded.no_pin,
+            profit_settings=excluded.profit_settings
+        """, (chat_id, 1 if notify_enabled else 0, interval, pinned_message_id, 1 if no_pin else 0, new_ps))
 
 def set_chat_no_pin(chat_id: int, no_pin: bool):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE chats SET no_pin=? WHERE chat_id=?", (1 if no_pin else 0, chat_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE chats SET no_pin=? WHERE chat_id=?", (1 if no_pin else 0, chat_id))
 
 def unpin_all_messages(chat_id: int):
     # Placeholder: in real, use bot.unpin_chat_message
     pass
 
 def get_chats_with_profit_alerts() -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT chat_id FROM chat_profit_alerts WHERE active=1")
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT DISTINCT chat_id FROM chat_profit_alerts WHERE active=1")
     return [{"chat_id": r[0]} for r in rows]
 
 def get_chat_profit_alerts(chat_id: int) -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM chat_profit_alerts WHERE chat_id=? AND active=1", (chat_id,))
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM chat_profit_alerts WHERE chat_id=? AND active=1", (chat_id,))
     return [dict(r) for r in rows]
 
-def deactivate_profit_alert(chat_id: int, resource: str):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE chat_profit_alerts SET active=0 WHERE chat_id=? AND resource=?", (chat_id, resource))
-    conn.commit()
-    conn.close()
+def upsert_profit_alert(chat_id: int, resource: str, threshold_price: float, min_quantity: int):
+    with transaction() as c:
+        # Сначала попробуем обновить
+        c.execute("""
+            UPDATE chat_profit_alerts
+            SET threshold_price = ?, min_quantity = ?, active = 1
+            WHERE chat_id = ? AND resource = ?
+        """, (threshold_price, min_quantity, chat_id, resource))
+        # Если обновлено 0 строк — значит, записи не было, вставляем новую
+        if c.rowcount == 0:
+            c.execute("""
+                INSERT INTO chat_profit_alerts (chat_id, resource, threshold_price, min_quantity, active)
+                VALUES (?, ?, ?, ?, 1)
+            """, (chat_id, resource, threshold_price, min_quantity))
+    profit_alert_index.set(chat_id, resource, threshold_price, min_quantity)
+
+def deactivate_profit_alert(chat_id: int, resource: str, outbox: Optional[List[Dict]] = None):
+    with transaction() as c:
+        c.execute("UPDATE chat_profit_alerts SET active=0 WHERE chat_id=? AND resource=?", (chat_id, resource))
+        _insert_outbox(c, outbox)
+    profit_alert_index.remove(chat_id, resource)
+
+def restore_profit_alert(chat_id: int, resource: str, threshold_price: float) -> bool:
+    """Возвращает в работу групповой алерт, уведомление о котором не доставлено (если порог не менялся)."""
+    with transaction() as c:
+        c.execute("""
+            UPDATE chat_profit_alerts SET active=1
+            WHERE chat_id=? AND resource=? AND threshold_price=? AND active=0
+        """, (chat_id, resource, threshold_price))
+        if c.rowcount == 0:
+            return False
+        row = c.execute("SELECT min_quantity FROM chat_profit_alerts WHERE chat_id=? AND resource=? AND active=1",
+                        (chat_id, resource)).fetchone()
+    profit_alert_index.set(chat_id, resource, threshold_price, row['min_quantity'])
+    return True
 
 def clear_all_profit_alerts(chat_id: int):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE chat_profit_alerts SET active=0 WHERE chat_id=?", (chat_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE chat_profit_alerts SET active=0 WHERE chat_id=?", (chat_id,))
+    profit_alert_index.remove_chat(chat_id)
+
+def load_profit_alert_index():
+    """Пересобирает profit_alert_index из активных chat_profit_alerts (вызывается при старте)."""
+    rows = _fetchall("SELECT * FROM chat_profit_alerts WHERE active=1")
+    profit_alert_index.load([dict(r) for r in rows])
+
+# Outbox
+# Сообщение: {"key", "chat_id", "text", "priority"?, "parse_mode"?}.
+# key — ключ идемпотентности: повторная запись с тем же ключом игнорируется.
+def _insert_outbox(c: sqlite3.Cursor, messages: Optional[List[Dict]]):
+    if not messages:
+        return
+    now = int(time.time())
+    c.executemany("""
+        INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, text, parse_mode, priority, status, attempts, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)
+    """, [(m['key'], m['chat_id'], m['text'], m.get('parse_mode'), m.get('priority', 0), now, now) for m in messages])
+
+def enqueue_outbox(messages: List[Dict]):
+    with transaction() as c:
+        _insert_outbox(c, messages)
+
+def claim_outbox_batch(limit: int = 100) -> List[Dict]:
+    """Забирает готовые к отправке сообщения и помечает их 'sending'."""
+    now = int(time.time())
+    with transaction() as c:
+        c.execute("""
+            SELECT * FROM outbox WHERE status='pending' AND next_attempt_at<=?
+            ORDER BY priority, id LIMIT ?
+        """, (now, limit))
+        rows = [dict(r) for r in c.fetchall()]
+        c.executemany("UPDATE outbox SET status='sending' WHERE id=?", [(r['id'],) for r in rows])
+    return rows
+
+def mark_outbox_sent(outbox_id: int):
+    with transaction() as c:
+        c.execute("UPDATE outbox SET status='sent', sent_at=? WHERE id=?", (int(time.time()), outbox_id))
+
+def mark_outbox_retry(outbox_id: int, error: str, next_attempt_at: Optional[int]):
+    """Планирует повтор; next_attempt_at=None — попытки исчерпаны, статус 'failed'."""
+    with transaction() as c:
+        if next_attempt_at is None:
+            c.execute("UPDATE outbox SET status='failed', attempts=attempts+1, last_error=? WHERE id=?", (error, outbox_id))
+        else:
+            c.execute("UPDATE outbox SET status='pending', attempts=attempts+1, last_error=?, next_attempt_at=? WHERE id=?",
+                      (error, next_attempt_at, outbox_id))
+
+def abandon_outbox_in_flight() -> int:
+    """
+    После перезапуска помечает 'unknown' сообщения, застрявшие в 'sending': процесс мог
+    упасть и до отправки, и после неё, до mark_outbox_sent. Повторно они не отправляются.
+    """
+    with transaction() as c:
+        c.execute("UPDATE outbox SET status='unknown' WHERE status='sending'")
+        return c.rowcount
+
+def prune_outbox(older_than: int) -> int:
+    with transaction() as c:
+        c.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed', 'unknown') AND created_at < ?", (older_than,))
+        return c.rowcount
+
+def get_outbox_stats(window_seconds: int = 3600) -> Dict:
+    """Глубина очереди и задержка доставки — для подбора размера воркера."""
+    now = int(time.time())
+    pending = _fetchone("SELECT COUNT(*) as cnt, MIN(created_at) as oldest FROM outbox WHERE status IN ('pending', 'sending')")
+    sent = _fetchone("""
+        SELECT COUNT(*) as cnt, AVG(sent_at - created_at) as avg_lag, MAX(sent_at - created_at) as max_lag
+        FROM outbox WHERE status='sent' AND sent_at>=?
+    """, (now - window_seconds,))
+    failed = _fetchone("SELECT COUNT(*) as cnt FROM outbox WHERE status='failed'")
+    unknown = _fetchone("SELECT COUNT(*) as cnt FROM outbox WHERE status='unknown'")
+    return {
+        "queue_depth": pending['cnt'],
+        "oldest_pending_age": (now - pending['oldest']) if pending['oldest'] else 0,
+        "sent_recent": sent['cnt'],
+        "avg_delivery_lag": sent['avg_lag'] or 0.0,
+        "max_delivery_lag": sent['max_lag'] or 0,
+        "failed": failed['cnt'],
+        "unknown": unknown['cnt'],
+    }
 
 # Transactions
+# Суточный рейтинг (/top) считается не по transactions, а по почасовым суммам
+# leaderboard_hourly, которые insert_transaction обновляет в той же транзакции;
+# в памяти рейтинг держит leaderboard (загружается из таблицы при первом обращении).
+LEADERBOARD_KEEP_HOURS = 48
+
+def _net_gold(action: str, total_gold: float) -> float:
+    return total_gold if action == 'sell' else -total_gold
+
 def insert_transaction(user_id: int, resource: str, action: str, quantity: int, price: float, total_gold: float, profit: float = 0, timestamp: Optional[int] = None):
     ts = timestamp or int(time.time())
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO transactions (user_id, resource, action, quantity, price, total_gold, profit, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, resource, action, quantity, price, total_gold, profit, ts))
-    conn.commit()
-    conn.close()
+    net_gold = _net_gold(action, total_gold)
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO transactions (user_id, resource, action, quantity, price, total_gold, profit, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, resource, action, quantity, price, total_gold, profit, ts))
+        tx_id = c.lastrowid
+        c.execute("""
+            INSERT INTO leaderboard_hourly (bucket, user_id, net_gold, tx_count) VALUES (?, ?, ?, 1)
+            ON CONFLICT(bucket, user_id) DO UPDATE SET
+                net_gold = net_gold + excluded.net_gold, tx_count = tx_count + 1
+        """, (ts - ts % LEADERBOARD_BUCKET, user_id, net_gold))
+    leaderboard.add(tx_id, user_id, ts, net_gold)
+
+def _read_leaderboard() -> Tuple[List[Dict], int]:
+    """Почасовые суммы за последние сутки и id последней учтённой в них сделки — одним запросом (один снимок БД)."""
+    since = int(time.time()) - 24 * 3600
+    rows = _fetchall("""
+        WITH w AS (SELECT COALESCE(MAX(id), 0) AS watermark FROM transactions)
+        SELECT w.watermark, l.bucket, l.user_id, l.net_gold, l.tx_count
+        FROM w LEFT JOIN leaderboard_hourly l ON l.bucket >= ?
+    """, (since - since % LEADERBOARD_BUCKET,))
+    return [dict(r) for r in rows if r['user_id'] is not None], rows[0]['watermark']
+
+def load_leaderboard():
+    """Пересобирает leaderboard из почасовых сумм за последние сутки."""
+    leaderboard.load(_read_leaderboard)
+
+def _ensure_leaderboard():
+    leaderboard.ensure_loaded(_read_leaderboard)
+
+def prune_leaderboard_buckets(older_than: Optional[int] = None) -> int:
+    """Удаляет почасовые суммы, давно вышедшие из суточного окна."""
+    older_than = older_than or int(time.time()) - LEADERBOARD_KEEP_HOURS * 3600
+    with transaction() as c:
+        c.execute("DELETE FROM leaderboard_hourly WHERE bucket < ?", (older_than,))
+        return c.rowcount
 
 def get_user_transactions(user_id: int, days: int = 1) -> List[Dict]:
     cutoff = int(time.time()) - days * 24 * 3600
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
+    rows = _fetchall("""
         SELECT * FROM transactions WHERE user_id = ? AND timestamp >= ? ORDER BY timestamp DESC
     """, (user_id, cutoff))
-    rows = c.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
-def get_daily_profits() -> List[Dict]:
-    today_start = int(time.time()) - 24 * 3600
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT user_id, SUM(CASE WHEN action = 'sell' THEN total_gold ELSE -total_gold END) as net_gold,
-               COUNT(*) as tx_count
-        FROM transactions WHERE timestamp >= ? GROUP BY user_id ORDER BY net_gold DESC LIMIT 10
-    """, (today_start,))
-    rows = c.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+def get_daily_profits(limit: int = 10) -> List[Dict]:
+    _ensure_leaderboard()
+    return leaderboard.top(limit)
 
 def get_user_rank(user_id: int) -> int:
-    today_start = int(time.time()) - 24 * 3600
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT COUNT(*) + 1 as rank FROM (
-            SELECT SUM(CASE WHEN action = 'sell' THEN total_gold ELSE -total_gold END) as net_gold
-            FROM transactions WHERE timestamp >= ? GROUP BY user_id HAVING net_gold > (
-                SELECT COALESCE(SUM(CASE WHEN action = 'sell' THEN total_gold ELSE -total_gold END), 0)
-                FROM transactions WHERE user_id = ? AND timestamp >= ?
-            )
-        )
-    """, (today_start, user_id, today_start))
-    row = c.fetchone()
-    conn.close()
-    return row['rank'] if row else 1
+    _ensure_leaderboard()
+    return leaderboard.rank(user_id)
 
 # Other
 def get_bot_stats() -> Dict:
     # Legacy, but keep for compatibility
-    conn = get_connection()
-    c = conn.cursor()
     stats = {}
-    c.execute("SELECT COUNT(*) as cnt FROM users")
-    stats['users'] = c.fetchone()['cnt']
-    c.execute("SELECT COUNT(DISTINCT resource) as cnt FROM market")
-    stats['resources'] = c.fetchone()['cnt']
-    conn.close()
+    stats['users'] = _fetchone("SELECT COUNT(*) as cnt FROM users")['cnt']
+    stats['resources'] = _fetchone("SELECT COUNT(DISTINCT resource) as cnt FROM market")['cnt']
     return stats
 
 def get_bot_history(limit: int = 20) -> List[Dict]:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM history ORDER BY timestamp DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
+    rows = _fetchall("SELECT * FROM history ORDER BY timestamp DESC LIMIT ?", (limit,))
     return [dict(r) for r in rows]
 
 init_db()
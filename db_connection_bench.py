@@ -0,0 +1,100 @@
+# db_connection_bench.py
+"""
+Бенчмарк слоя соединений SQLite: ops/s прежней схемы (новое соединение на
+каждый вызов, журнал отката, fsync на каждый коммит) и текущей (долгоживущее
+соединение на поток, WAL, synchronous=NORMAL) на синтетической БД.
+Одна операция — запись тика, чтение последней цены и чтение пользователя.
+
+    python db_connection_bench.py --ops 2000 --threads 4
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# database при импорте создаёт bsp.db в текущем каталоге — работаем во временном
+WORKDIR = tempfile.mkdtemp(prefix="bsp-bench-")
+os.chdir(WORKDIR)
+
+import database  # noqa: E402
+
+
+class PerCallConnections:
+    """Прежний database.py: connect → запрос → commit → close на каждый вызов."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def insert_market_record(self, resource, buy, sell, quantity, timestamp):
+        conn = self._connect()
+        conn.execute("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     (resource, buy, sell, quantity, timestamp))
+        conn.commit()
+        conn.close()
+
+    def get_latest_market(self, resource):
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM market WHERE resource=? ORDER BY timestamp DESC LIMIT 1", (resource,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def get_user(self, user_id):
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+
+def make_db(name: str, journal_mode: str) -> str:
+    path = os.path.join(WORKDIR, name)
+    database.DB_PATH = path
+    database.init_db()
+    database.ensure_user(1, "bench")
+    database.close_connection()
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.close()
+    return path
+
+
+def run(layer, ops: int, threads: int) -> float:
+    now = int(time.time())
+
+    def work(offset):
+        for i in range(ops):
+            layer.insert_market_record("Дерево", 8.0 + i * 0.001, 6.0, 1000, now - offset - i)
+            layer.get_latest_market("Дерево")
+            layer.get_user(1)
+
+    workers = [threading.Thread(target=work, args=(t * ops,)) for t in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return 3 * ops * threads / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=1000, help="итераций на поток")
+    parser.add_argument("--threads", type=int, default=4, help="потоков во втором прогоне")
+    args = parser.parse_args()
+
+    before = PerCallConnections(make_db("before.db", "DELETE"))
+    database.DB_PATH = make_db("after.db", "WAL")
+    for threads in (1, args.threads):
+        old = run(before, args.ops, threads)
+        new = run(database, args.ops, threads)
+        print(f"потоков {threads}: прежняя схема {old:8.0f} ops/s  текущая {new:8.0f} ops/s  x{new / old:.1f}")
+
+
+if __name__ == "__main__":
+    main()
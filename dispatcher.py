@@ -0,0 +1,214 @@
+# dispatcher.py
+import heapq
+import itertools
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — раньше
+PRIORITY_ALERT = 0      # сработавшие таймеры и алерты покупки
+PRIORITY_INFO = 1       # перенос таймера, смена тренда
+PRIORITY_REMINDER = 2   # напоминания «БД устарела»
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+GLOBAL_RATE = 30.0
+PER_CHAT_RATE = 1.0
+MAX_ATTEMPTS = 5
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 — можно отправлять)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """retry_after из ответа 429 (telebot.apihelper.ApiTelegramException), иначе None."""
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    params = (getattr(exc, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+def _is_parse_error(exc: Exception) -> bool:
+    return getattr(exc, "error_code", None) == 400 and "parse entities" in str(getattr(exc, "description", exc))
+
+
+class OutboundDispatcher:
+    """
+    Очередь исходящих уведомлений. send() только ставит сообщение в очередь;
+    отдельный поток отправляет их по приоритету, соблюдая общий лимит бота и
+    лимит на чат (token bucket). Чат, упёршийся в лимит, не задерживает остальные.
+    На 429 сообщение возвращается в очередь через retry_after.
+    """
+
+    def __init__(self, bot=None, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 per_chat_burst: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.bot = bot
+        self._clock = clock
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        # Небольшой запас на всплеск: за любую секунду уходит не больше ~global_rate сообщений
+        self._global = TokenBucket(global_rate, max(1.0, global_rate / 10), clock())
+        self._chats: Dict[int, TokenBucket] = {}
+        # (priority, seq, chat_id, text, kwargs, attempts, on_done)
+        self._ready: List[tuple] = []
+        # (ready_at, priority, seq, chat_id, text, kwargs, attempts, on_done)
+        self._deferred: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._wait: Optional[float] = None
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self, bot=None) -> None:
+        with self._cond:
+            if bot is not None:
+                self.bot = bot
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="outbound-dispatcher", daemon=True)
+            self._thread.start()
+
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_ALERT,
+             on_done: Optional[Callable[[bool, Optional[Exception]], None]] = None, **kwargs) -> None:
+        """
+        Ставит сообщение в очередь и сразу возвращается.
+        on_done(ok, error) вызывается после окончательного результата отправки.
+        """
+        with self._cond:
+            heapq.heappush(self._ready, (priority, next(self._seq), chat_id, text, kwargs, 0, on_done))
+            self._cond.notify()
+
+    def send_many(self, chat_ids, text: str, priority: int = PRIORITY_ALERT, **kwargs) -> None:
+        with self._cond:
+            for chat_id in chat_ids:
+                heapq.heappush(self._ready, (priority, next(self._seq), chat_id, text, kwargs, 0, None))
+            self._cond.notify()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._ready) + len(self._deferred)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self._per_chat_rate, self._per_chat_burst, now)
+        return bucket
+
+    def _next_message(self) -> Optional[tuple]:
+        """
+        Берёт следующее сообщение, которое можно отправить прямо сейчас, и списывает токены.
+        Возвращает None, если отправлять нечего; тогда ждать нужно не дольше self._wait.
+        """
+        now = self._clock()
+        while self._deferred and self._deferred[0][0] <= now:
+            heapq.heappush(self._ready, heapq.heappop(self._deferred)[1:])
+        self._wait = self._deferred[0][0] - now if self._deferred else None
+        if not self._ready:
+            return None
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            self._wait = global_wait
+            return None
+        while self._ready:
+            item = heapq.heappop(self._ready)
+            chat_id = item[2]
+            chat_wait = self._chat_bucket(chat_id, now).wait_time(now)
+            if chat_wait > 0:
+                heapq.heappush(self._deferred, (now + chat_wait,) + item)
+                continue
+            self._global.take(now)
+            self._chats[chat_id].take(now)
+            return item
+        self._wait = self._deferred[0][0] - now if self._deferred else None
+        return None
+
+    def _deliver(self, item: tuple) -> None:
+        priority, seq, chat_id, text, kwargs, attempts, on_done = item
+        try:
+            self.bot.send_message(chat_id, text, **kwargs)
+            self.sent += 1
+            result = (True, None)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None and attempts + 1 < MAX_ATTEMPTS:
+                with self._cond:
+                    now = self._clock()
+                    self._chat_bucket(chat_id, now).block(now + retry_after)
+                    heapq.heappush(self._deferred, (now + retry_after, priority, seq, chat_id, text, kwargs, attempts + 1, on_done))
+                logger.warning(f"429 для чата {chat_id}, повтор через {retry_after:.0f} с")
+                return
+            if _is_parse_error(e) and kwargs.get('parse_mode'):
+                # Например, @username с подчёркиванием ломает Markdown — шлём без разметки
+                plain = {k: v for k, v in kwargs.items() if k != 'parse_mode'}
+                self.send(chat_id, text, priority, on_done=on_done, **plain)
+                return
+            self.dropped += 1
+            logger.warning(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+            result = (False, e)
+        if on_done is not None:
+            try:
+                on_done(*result)
+            except Exception:
+                logger.exception("Ошибка в on_done исходящего сообщения")
+
+    def process_pending(self) -> int:
+        """Отправляет всё, что можно отправить прямо сейчас (без ожидания). Возвращает число попыток."""
+        count = 0
+        while True:
+            with self._cond:
+                item = self._next_message()
+            if item is None:
+                return count
+            self._deliver(item)
+            count += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                item = self._next_message()
+                if item is None:
+                    self._cond.wait(self._wait)
+                    continue
+            try:
+                self._deliver(item)
+            except Exception:
+                logger.exception("Ошибка в outbound-dispatcher")
+
+
+outbound = OutboundDispatcher()
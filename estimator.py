@@ -0,0 +1,316 @@
+# estimator.py
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import database
+from tickstore import tick_store
+
+try:
+    import numpy as np
+except ImportError:  # без numpy считаем те же формулы в цикле
+    np = None
+
+# Вес точки убывает вдвое каждые HALF_LIFE_MINUTES от последнего тика
+HALF_LIFE_MINUTES = 10.0
+# Ниже этой уверенности тренд считается стабильным
+MIN_TREND_CONFIDENCE = 0.2
+# Точки ближе по времени не дают наклона (как порог 0.1 мин в прежнем calculate_speed)
+MIN_SPAN_MINUTES = 0.1
+
+
+class Estimate(NamedTuple):
+    """
+    Взвешенная линейная регрессия цены по времени на окне наблюдений.
+    slope — изменение базовой цены в минуту; intercept — сглаженная цена в момент
+    последнего тика (last_ts); spread — взвешенное СКО остатков; confidence — 0..1:
+    взвешенный R² с поправкой на эффективное число точек (две точки — 0).
+    """
+    slope: float
+    intercept: float
+    spread: float
+    confidence: float
+    points: int
+    last_ts: int
+
+    @property
+    def trend(self) -> str:
+        if self.confidence < MIN_TREND_CONFIDENCE or self.slope == 0:
+            return "stable"
+        return "up" if self.slope > 0 else "down"
+
+    def predict(self, ts: float) -> float:
+        return self.intercept + self.slope * (ts - self.last_ts) / 60.0
+
+
+def _weights(ages: Sequence[float], half_life: float) -> List[float]:
+    return [0.5 ** (age / half_life) for age in ages]
+
+
+def _finish(n: int, last_ts: int, sw: float, sw2: float, stt: float, sty: float, syy: float,
+            tm: float, ym: float) -> Optional[Estimate]:
+    if n < 2 or stt <= 0:
+        return None
+    sw, sw2, stt, sty, syy, tm, ym = map(float, (sw, sw2, stt, sty, syy, tm, ym))
+    slope = sty / stt
+    intercept = ym - slope * tm
+    sse = max(0.0, syy - slope * sty)
+    spread = math.sqrt(sse / sw)
+    r2 = 1.0 if syy <= 0 else max(0.0, 1.0 - sse / syy)
+    n_eff = sw * sw / sw2
+    confidence = r2 * max(0.0, 1.0 - 2.0 / n_eff)
+    return Estimate(slope, intercept, spread, confidence, n, last_ts)
+
+
+def _fit_python(t: Sequence[float], y: Sequence[float], half_life: float) -> Optional[Estimate]:
+    n = len(t)
+    if n < 2 or t[-1] - t[0] < MIN_SPAN_MINUTES * 60:
+        return None
+    last_ts = int(t[-1])
+    x = [(ti - last_ts) / 60.0 for ti in t]
+    w = _weights([-xi for xi in x], half_life)
+    sw = sum(w)
+    sw2 = sum(wi * wi for wi in w)
+    tm = sum(wi * xi for wi, xi in zip(w, x)) / sw
+    ym = sum(wi * yi for wi, yi in zip(w, y)) / sw
+    stt = sum(wi * (xi - tm) ** 2 for wi, xi in zip(w, x))
+    sty = sum(wi * (xi - tm) * (yi - ym) for wi, xi, yi in zip(w, x, y))
+    syy = sum(wi * (yi - ym) ** 2 for wi, yi in zip(w, y))
+    return _finish(n, last_ts, sw, sw2, stt, sty, syy, tm, ym)
+
+
+def _fit_numpy(series: List[Tuple[Sequence[float], Sequence[float]]], half_life: float) -> List[Optional[Estimate]]:
+    """Все ряды одной матричной операцией: короткие ряды дополняются точками с нулевым весом."""
+    width = max(len(t) for t, _ in series)
+    T = np.zeros((len(series), width))
+    Y = np.zeros((len(series), width))
+    M = np.zeros((len(series), width))
+    last = np.zeros(len(series))
+    for i, (t, y) in enumerate(series):
+        n = len(t)
+        if n:
+            T[i, :n] = np.asarray(t, dtype=float)
+            Y[i, :n] = np.asarray(y, dtype=float)
+            M[i, :n] = 1.0
+            last[i] = t[n - 1]
+    X = (T - last[:, None]) / 60.0
+    W = M * 0.5 ** (-X / half_life)
+    sw = W.sum(axis=1)
+    safe_sw = np.where(sw > 0, sw, 1.0)
+    tm = (W * X).sum(axis=1) / safe_sw
+    ym = (W * Y).sum(axis=1) / safe_sw
+    dx = X - tm[:, None]
+    dy = Y - ym[:, None]
+    stt = (W * dx * dx).sum(axis=1)
+    sty = (W * dx * dy).sum(axis=1)
+    syy = (W * dy * dy).sum(axis=1)
+    sw2 = (W * W).sum(axis=1)
+    results = []
+    for i, (t, _) in enumerate(series):
+        if len(t) < 2 or t[-1] - t[0] < MIN_SPAN_MINUTES * 60:
+            results.append(None)
+            continue
+        results.append(_finish(len(t), int(last[i]), sw[i], sw2[i], stt[i], sty[i], syy[i], tm[i], ym[i]))
+    return results
+
+
+def fit_batch(series: Dict[tuple, Tuple[Sequence[float], Sequence[float]]],
+              half_life: float = HALF_LIFE_MINUTES) -> Dict[tuple, Optional[Estimate]]:
+    """series: ключ -> (timestamps, prices) по возрастанию времени. Возвращает оценку по ключу (или None)."""
+    keys = list(series)
+    if not keys:
+        return {}
+    if np is not None:
+        fitted = _fit_numpy([series[k] for k in keys], half_life)
+    else:
+        fitted = [_fit_python(*series[k], half_life) for k in keys]
+    return dict(zip(keys, fitted))
+
+
+def fit_records(records: List[Dict], field: str = "buy", half_life: float = HALF_LIFE_MINUTES) -> Optional[Estimate]:
+    """Оценка по списку записей market (или свечей) по возрастанию времени."""
+    return fit_batch({(field,): ([r['timestamp'] for r in records], [r[field] for r in records])}, half_life)[(field,)]
+
+
+def estimate_resources(resources: Iterable[str], lookback_minutes: int = 60,
+                       fields: Sequence[str] = ("buy", "sell"), now: Optional[int] = None,
+                       half_life: float = HALF_LIFE_MINUTES) -> Dict[Tuple[str, str], Optional[Estimate]]:
+    """
+    Оценки для всех ресурсов и полей одним пакетным вызовом: {(ресурс, поле): Estimate | None}.
+    Данные берутся из столбцового хранилища, если оно включено, иначе одним запросом к БД.
+    """
+    resources = list(resources)
+    since = (now or int(time.time())) - lookback_minutes * 60
+    series = {}
+    if tick_store.enabled:
+        for resource in resources:
+            sl = tick_store.range(resource, since)
+            for field in fields:
+                series[(resource, field)] = (sl.array("timestamp"), sl.array(field))
+    else:
+        recent = database.get_recent_market_many(resources, since)
+        for resource in resources:
+            rows = recent.get(resource, [])
+            ts = [r['timestamp'] for r in rows]
+            for field in fields:
+                series[(resource, field)] = (ts, [r[field] for r in rows])
+    return fit_batch(series, half_life)
+
+
+class _OnlineSeries:
+    """
+    Состояние одного ряда (ресурс, поле): экспоненциально затухающие суммы регрессии
+    в координатах относительно последнего тика (минуты), EWMA цены и EWMA скорости.
+    Каждый тик обновляет состояние за O(1).
+    """
+    __slots__ = ("first_ts", "last_ts", "last_price", "anchor_ts", "anchor_price", "count",
+                 "sw", "sw2", "sx", "sy", "sxx", "sxy", "syy", "ewma_price", "ewma_velocity")
+
+    def __init__(self):
+        self.first_ts: Optional[int] = None
+        self.last_ts: Optional[int] = None
+        self.last_price = 0.0
+        self.anchor_ts: Optional[int] = None
+        self.anchor_price = 0.0
+        self.count = 0
+        self.sw = self.sw2 = self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+        self.ewma_price: Optional[float] = None
+        self.ewma_velocity: Optional[float] = None
+
+    def _shift(self, ts: int, half_life: float) -> float:
+        """Затухание весов и перенос начала координат в ts (x' = x - dt). Возвращает dt в минутах."""
+        dt = (ts - self.last_ts) / 60.0
+        if dt > 0:
+            decay = 0.5 ** (dt / half_life)
+            self.sw, self.sw2 = self.sw * decay, self.sw2 * decay * decay
+            self.sx, self.sy = self.sx * decay, self.sy * decay
+            self.sxx, self.sxy, self.syy = self.sxx * decay, self.sxy * decay, self.syy * decay
+            self.sxx += -2 * dt * self.sx + dt * dt * self.sw
+            self.sxy -= dt * self.sy
+            self.sx -= dt * self.sw
+        return dt
+
+    def add(self, ts: int, price: float, half_life: float) -> None:
+        if self.last_ts is None:
+            self.first_ts, self.last_ts, self.last_price, self.ewma_price = ts, ts, price, price
+            self.anchor_ts, self.anchor_price = ts, price
+        dt = self._shift(ts, half_life)
+        if dt > 0:
+            self.ewma_price += (1 - 0.5 ** (dt / half_life)) * (price - self.ewma_price)
+        # Скорость — от опорного тика не ближе MIN_SPAN_MINUTES: частые тики
+        # через несколько секунд иначе дают огромные мгновенные скорости
+        dv = (ts - self.anchor_ts) / 60.0
+        if dv >= MIN_SPAN_MINUTES:
+            velocity = (price - self.anchor_price) / dv
+            alpha = 1 - 0.5 ** (dv / half_life)
+            self.ewma_velocity = velocity if self.ewma_velocity is None else self.ewma_velocity + alpha * (velocity - self.ewma_velocity)
+            self.anchor_ts, self.anchor_price = ts, price
+        self.sw += 1.0
+        self.sw2 += 1.0
+        self.sy += price
+        self.syy += price * price
+        self.last_ts, self.last_price = ts, price
+        self.count += 1
+
+    def merge_older(self, older: "_OnlineSeries", half_life: float) -> None:
+        """Добавляет состояние по более ранним тикам (все старше first_ts этого ряда)."""
+        if older.last_ts is None:
+            return
+        older._shift(self.last_ts, half_life)
+        self.sw += older.sw
+        self.sw2 += older.sw2
+        self.sx += older.sx
+        self.sy += older.sy
+        self.sxx += older.sxx
+        self.sxy += older.sxy
+        self.syy += older.syy
+        self.count += older.count
+        self.first_ts = older.first_ts
+        if self.ewma_velocity is None:
+            self.ewma_velocity = older.ewma_velocity
+
+    def estimate(self) -> Optional[Estimate]:
+        if self.count < 2 or self.sw <= 0 or self.last_ts - self.first_ts < MIN_SPAN_MINUTES * 60:
+            return None
+        tm = self.sx / self.sw
+        ym = self.sy / self.sw
+        stt = self.sxx - self.sx * tm
+        if stt <= 1e-12 * self.sw:
+            return None
+        return _finish(self.count, self.last_ts, self.sw, self.sw2, stt,
+                       self.sxy - self.sx * ym, self.syy - self.sy * ym, tm, ym)
+
+
+class OnlineEstimators:
+    """
+    Оценки скорости по ресурсам, обновляемые при приёме каждого тика и читаемые без БД.
+    Регрессия — та же, что в fit_batch, но с бесконечным окном экспоненциальных весов
+    (тик часовой давности при полураспаде 10 мин весит 1/64). При старте состояние
+    прогревается из последнего часа market (warm_start) и сливается с тиками,
+    принятыми за это время.
+    """
+
+    def __init__(self, half_life: float = HALF_LIFE_MINUTES, fields: Sequence[str] = ("buy", "sell")):
+        self.half_life = half_life
+        self.fields = tuple(fields)
+        self._series: Dict[Tuple[str, str], _OnlineSeries] = {}
+        self._lock = threading.Lock()
+
+    def update(self, records: Iterable[Dict]) -> None:
+        """Добавляет тики; тики старше последнего по ресурсу пропускаются."""
+        with self._lock:
+            self._update_locked(self._series, records)
+
+    def _update_locked(self, target: Dict[Tuple[str, str], _OnlineSeries], records: Iterable[Dict]) -> None:
+        for r in sorted(records, key=lambda r: r['timestamp']):
+            ts = int(r['timestamp'])
+            for field in self.fields:
+                series = target.get((r['resource'], field))
+                if series is None:
+                    series = target[(r['resource'], field)] = _OnlineSeries()
+                if series.last_ts is not None and ts < series.last_ts:
+                    continue
+                series.add(ts, float(r[field]), self.half_life)
+
+    def get(self, resource: str, field: str = "buy", max_age: Optional[int] = None) -> Optional[Estimate]:
+        """Текущая оценка; None, если тиков мало или последний старше max_age секунд."""
+        with self._lock:
+            series = self._series.get((resource, field))
+            if series is None or (max_age is not None and series.last_ts < time.time() - max_age):
+                return None
+            return series.estimate()
+
+    def ewma(self, resource: str, field: str = "buy") -> Tuple[Optional[float], Optional[float]]:
+        """(EWMA цены, EWMA скорости в минуту)."""
+        with self._lock:
+            series = self._series.get((resource, field))
+            return (series.ewma_price, series.ewma_velocity) if series else (None, None)
+
+    def warm_start(self, lookback_minutes: int = 60) -> int:
+        """
+        Добавляет тики за последние lookback_minutes из БД. Ряды, в которые уже
+        пришли живые тики, не заменяются: к ним подмешиваются только более ранние
+        тики из БД. Возвращает число учтённых тиков из БД.
+        """
+        resources = [r['resource'] for r in database.get_latest_market_per_resource()]
+        recent = database.get_recent_market_many(resources, int(time.time()) - lookback_minutes * 60)
+        used = 0
+        with self._lock:
+            for resource, rows in recent.items():
+                live = {field: self._series.get((resource, field)) for field in self.fields}
+                cutoff = min((s.first_ts for s in live.values() if s is not None), default=None)
+                older = [r for r in rows if cutoff is None or r['timestamp'] < cutoff]
+                warm: Dict[Tuple[str, str], _OnlineSeries] = {}
+                self._update_locked(warm, older)
+                used += len(older)
+                for key, series in warm.items():
+                    current = self._series.get(key)
+                    if current is None:
+                        self._series[key] = series
+                    else:
+                        current.merge_older(series, self.half_life)
+        return used
+
+
+online_estimates = OnlineEstimators()
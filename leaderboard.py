@@ -0,0 +1,128 @@
+# leaderboard.py
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+BUCKET_SECONDS = 3600
+WINDOW_BUCKETS = 24
+
+
+class Leaderboard:
+    """
+    Рейтинг игроков по чистому золоту за последние сутки (с точностью до часа:
+    текущий час и 23 предыдущих). Суммы хранятся почасовыми корзинами на игрока;
+    итоги по окну — в отсортированном списке (-net_gold, user_id), поэтому
+    место игрока находится bisect'ом, а топ-N — срезом начала списка.
+    Корзины, вышедшие из окна, вычитаются из итогов при следующем обращении.
+
+    Сложность: место и топ-N — O(log n) и O(N); обновление итога игрока —
+    поиск O(log n) плюс сдвиг хвоста списка при удалении/вставке, то есть O(n)
+    по худшему случаю (memmove указателей: на десятках тысяч игроков — микросекунды).
+
+    Загрузка и учёт сделок идут под одной блокировкой: load() читает суммы из БД
+    вместе с максимальным id сделки, и add() пропускает сделки с id не больше
+    него — они уже в загруженных суммах.
+    """
+
+    def __init__(self, window_buckets: int = WINDOW_BUCKETS):
+        self.window_buckets = window_buckets
+        self._lock = threading.Lock()
+        # bucket -> {user_id: [net_gold, tx_count]}
+        self._buckets: Dict[int, Dict[int, List[float]]] = {}
+        # user_id -> [net_gold, tx_count] по окну
+        self._totals: Dict[int, List[float]] = {}
+        self._sorted: List[Tuple[float, int]] = []
+        self._window_start: Optional[int] = None
+        self._watermark = 0
+        self.loaded = False
+
+    def _start_for(self, now: float) -> int:
+        current = int(now) - int(now) % BUCKET_SECONDS
+        return current - (self.window_buckets - 1) * BUCKET_SECONDS
+
+    def _apply_locked(self, user_id: int, net_gold: float, tx_count: int) -> None:
+        total = self._totals.get(user_id)
+        if total is not None:
+            i = bisect_left(self._sorted, (-total[0], user_id))
+            if i < len(self._sorted) and self._sorted[i] == (-total[0], user_id):
+                del self._sorted[i]
+        else:
+            total = self._totals[user_id] = [0.0, 0]
+        total[0] += net_gold
+        total[1] += tx_count
+        if total[1] <= 0:
+            del self._totals[user_id]
+            return
+        insort(self._sorted, (-total[0], user_id))
+
+    def _advance_locked(self, now: float) -> None:
+        start = self._start_for(now)
+        if self._window_start is not None and start <= self._window_start:
+            return
+        self._window_start = start
+        for bucket in [b for b in self._buckets if b < start]:
+            for user_id, (net_gold, tx_count) in self._buckets.pop(bucket).items():
+                self._apply_locked(user_id, -net_gold, -tx_count)
+
+    def load(self, fetch: Callable[[], Tuple[Iterable[Dict], int]], now: Optional[float] = None) -> None:
+        """
+        Пересобирает рейтинг. fetch() вызывается под блокировкой и возвращает
+        (почасовые суммы {user_id, bucket, net_gold, tx_count}, максимальный id сделки в них).
+        """
+        with self._lock:
+            self._load_locked(fetch, now)
+
+    def ensure_loaded(self, fetch: Callable[[], Tuple[Iterable[Dict], int]]) -> None:
+        """Загружает рейтинг, если он ещё не загружен (первое обращение к /top)."""
+        with self._lock:
+            if not self.loaded:
+                self._load_locked(fetch, None)
+
+    def _load_locked(self, fetch, now: Optional[float]) -> None:
+        rows, watermark = fetch()
+        self._buckets.clear()
+        self._totals.clear()
+        self._sorted = []
+        self._window_start = self._start_for(now if now is not None else time.time())
+        for r in rows:
+            self._add_locked(r['user_id'], r['bucket'], r['net_gold'], r['tx_count'])
+        self._watermark = watermark
+        self.loaded = True
+
+    def _add_locked(self, user_id: int, bucket: int, net_gold: float, tx_count: int) -> None:
+        if bucket < self._window_start:
+            return
+        cell = self._buckets.setdefault(bucket, {}).setdefault(user_id, [0.0, 0])
+        cell[0] += net_gold
+        cell[1] += tx_count
+        self._apply_locked(user_id, net_gold, tx_count)
+
+    def add(self, tx_id: int, user_id: int, timestamp: int, net_gold: float, now: Optional[float] = None) -> None:
+        """Учитывает одну сделку (net_gold: + продажа, − покупка), уже записанную в БД с id tx_id."""
+        with self._lock:
+            if not self.loaded or tx_id <= self._watermark:
+                return
+            self._advance_locked(now if now is not None else time.time())
+            self._add_locked(user_id, timestamp - timestamp % BUCKET_SECONDS, net_gold, 1)
+
+    def top(self, n: int = 10, now: Optional[float] = None) -> List[Dict]:
+        with self._lock:
+            self._advance_locked(now if now is not None else time.time())
+            return [{"user_id": user_id, "net_gold": self._totals[user_id][0], "tx_count": self._totals[user_id][1]}
+                    for _, user_id in self._sorted[:n]]
+
+    def rank(self, user_id: int, now: Optional[float] = None) -> int:
+        """Место игрока: 1 + число игроков со строго большим net_gold (как прежний SQL)."""
+        with self._lock:
+            self._advance_locked(now if now is not None else time.time())
+            total = self._totals.get(user_id)
+            net_gold = total[0] if total else 0.0
+            return bisect_left(self._sorted, (-net_gold, float('-inf'))) + 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._totals)
+
+
+leaderboard = Leaderboard()
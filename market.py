@@ -1,12 +1,17 @@
 # market.py
 import re
+import hashlib
 import logging
+import threading
 import time
-from datetime import datetime, timedelta
+from collections import OrderedDict
 from typing import Optional, Dict, List, Tuple
 
 import database
+import estimator
 import users
+from snapshot import market_snapshot
+from tickstore import tick_store
 
 logger = logging.getLogger(__name__)
 
@@ -20,90 +25,79 @@ EMOJI_TO_RESOURCE = {
 RESOURCE_EMOJI = {v: k for k, v in EMOJI_TO_RESOURCE.items()}
 
 
+# Паттерны компилируются один раз при импорте
+_RESOURCE_RE = re.compile(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s*$")
+_PRICE_RE = re.compile(r"(?:[📈📉]?\s*)?Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))")
+# Альтернативный паттерн, если формат "Купить: 8.31 Продать: 6.80"
+_ALT_PRICE_RE = re.compile(r"Купить[:\s]*([0-9]+(?:[.,][0-9]+))[,;\s]+Продать[:\s]*([0-9]+(?:[.,][0-9]+))")
+# Ресурс и цены в одной строке: "Дерево: 96 342 449 🪵 Купить/продать: 8.31/6.80💰"
+_COMBINED_RE = re.compile(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s+.*Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))")
+
+
+def _parse_qty(raw: str) -> int:
+    qty_str = raw.replace(' ', '').replace(',', '')
+    return int(qty_str) if qty_str.isdigit() else 0
+
+
 def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float]]]:
     """
     Парсит текст рынка и возвращает словарь:
     { "Дерево": {"buy": float, "sell": float, "quantity": int}, ... }
     Если ни одного ресурса не найдено — возвращает None.
+    Один проход по строкам: дешёвые проверки (эмодзи в конце строки, наличие
+    «Купить») отсекают регулярки, которые заведомо не совпадут.
     """
     if not text:
         return None
 
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     resources: Dict[str, Dict[str, float]] = {}
     current_resource = None
     current_quantity = 0
 
-    # Паттерны
-    resource_pattern = re.compile(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s*$")
-    price_pattern = re.compile(r"(?:[📈📉]?\s*)?Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))")
-    # Альтернативный паттерн, если формат "Купить: 8.31 Продать: 6.80"
-    alt_price_pattern = re.compile(r"Купить[:\s]*([0-9]+(?:[.,][0-9]+))[,;\s]+Продать[:\s]*([0-9]+(?:[.,][0-9]+))")
-
-    for line in lines:
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
         # Пропускаем заголовки
-        if line.startswith("🎪") or line.lower().startswith("рынок"):
+        if line[0] == "🎪" or line[:5].lower() == "рынок":
             continue
 
-        # Resource line
-        m = resource_pattern.match(line)
-        if m:
-            name_part = m.group(1).strip()
-            qty_str = m.group(2).replace(' ', '').replace(',', '')
-            emoji = m.group(3)
-            try:
-                qty = int(qty_str) if qty_str.isdigit() else 0
-            except Exception:
-                qty = 0
-            current_quantity = qty
-            # Map emoji to standard resource name; fallback to parsed name
-            resource_name = EMOJI_TO_RESOURCE.get(emoji, name_part)
-            current_resource = resource_name
-            # ensure placeholder
-            resources[current_resource] = {"buy": 0.0, "sell": 0.0, "quantity": current_quantity}
+        # Resource line: строка всегда заканчивается эмодзи ресурса
+        if line[-1] in EMOJI_TO_RESOURCE:
+            m = _RESOURCE_RE.match(line)
+            if m:
+                current_quantity = _parse_qty(m.group(2))
+                current_resource = EMOJI_TO_RESOURCE[m.group(3)]
+                # ensure placeholder
+                resources[current_resource] = {"buy": 0.0, "sell": 0.0, "quantity": current_quantity}
+                continue
+
+        if "Купить" not in line:
             continue
 
         # Price line
-        pm = price_pattern.search(line) or alt_price_pattern.search(line)
-        if pm and current_resource:
-            buy_raw = pm.group(1).replace(',', '.')
-            sell_raw = pm.group(2).replace(',', '.')
-            try:
-                buy_price = float(buy_raw)
-                sell_price = float(sell_raw)
-            except Exception:
+        if current_resource:
+            pm = _PRICE_RE.search(line) or _ALT_PRICE_RE.search(line)
+            if pm:
+                resources[current_resource] = {
+                    "buy": float(pm.group(1).replace(',', '.')),
+                    "sell": float(pm.group(2).replace(',', '.')),
+                    "quantity": current_quantity
+                }
+                current_resource = None
+                current_quantity = 0
                 continue
-            resources[current_resource] = {
-                "buy": buy_price,
-                "sell": sell_price,
-                "quantity": current_quantity
-            }
-            current_resource = None
-            current_quantity = 0
-            continue
 
-        # Иногда ресурс и цены могут быть в одной строк: "Дерево: 96 342 449 🪵 Купить/продать: 8.31/6.80💰"
-        combined_match = re.search(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s+.*Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))", line)
-        if combined_match:
-            name_part = combined_match.group(1).strip()
-            qty_str = combined_match.group(2).replace(' ', '').replace(',', '')
-            emoji = combined_match.group(3)
-            buy_raw = combined_match.group(4).replace(',', '.')
-            sell_raw = combined_match.group(5).replace(',', '.')
-            try:
-                qty = int(qty_str) if qty_str.isdigit() else 0
-            except Exception:
-                qty = 0
-            resource_name = EMOJI_TO_RESOURCE.get(emoji, name_part)
-            try:
-                buy_price = float(buy_raw)
-                sell_price = float(sell_raw)
-            except Exception:
-                continue
-            resources[resource_name] = {"buy": buy_price, "sell": sell_price, "quantity": qty}
-            current_resource = None
-            current_quantity = 0
-            continue
+        if "Купить/продать" in line:
+            cm = _COMBINED_RE.match(line)
+            if cm:
+                resources[EMOJI_TO_RESOURCE[cm.group(3)]] = {
+                    "buy": float(cm.group(4).replace(',', '.')),
+                    "sell": float(cm.group(5).replace(',', '.')),
+                    "quantity": _parse_qty(cm.group(2)),
+                }
+                current_resource = None
+                current_quantity = 0
 
     if not resources:
         return None
@@ -154,6 +148,42 @@ def parse_market_message(text: str, sender_id: Optional[int] = None) -> Optional
     return normalized
 
 
+# Дедупликация: один и тот же снимок рынка часто пересылают несколько игроков подряд.
+# Ключ — нормализованный снимок (ресурс, базовые цены, объём) + корзина времени
+# исходного сообщения. В памяти — ограниченный LRU, в БД — уникальный market_dedup.
+DEDUP_BUCKET_SECONDS = 60
+DEDUP_MEMORY_SIZE = 2048
+
+_recent_forwards: "OrderedDict[str, None]" = OrderedDict()
+_recent_forwards_lock = threading.Lock()
+
+
+def _seen_forward(key: str) -> bool:
+    with _recent_forwards_lock:
+        if key in _recent_forwards:
+            _recent_forwards.move_to_end(key)
+            return True
+        return False
+
+
+def _remember_forward(*keys: str) -> None:
+    with _recent_forwards_lock:
+        for key in keys:
+            _recent_forwards[key] = None
+            _recent_forwards.move_to_end(key)
+        while len(_recent_forwards) > DEDUP_MEMORY_SIZE:
+            _recent_forwards.popitem(last=False)
+
+
+def snapshot_digest(parsed: Dict[str, Dict[str, float]], bucket: int) -> str:
+    """Ключ нормализованного снимка рынка: ресурсы, базовые цены, объёмы и корзина времени."""
+    parts = [str(bucket)]
+    for resource in sorted(parsed):
+        vals = parsed[resource]
+        parts.append(f"{resource}:{float(vals.get('buy', 0.0)):.4f}:{float(vals.get('sell', 0.0)):.4f}:{int(vals.get('quantity', 0) or 0)}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
 def handle_market_forward(bot, message) -> None:
     """
     Обрабатывает пересланное сообщение рынка: парсит, нормализует цены (учитывая бонус отправителя),
@@ -180,36 +210,53 @@ def handle_market_forward(bot, message) -> None:
             bot.reply_to(message, "❌ Сообщение слишком старое (более 1 часа). Отправьте свежий форвард.")
             return
 
-        parsed = parse_market_message(message.text or "", sender_id=sender_id)
+        # Корзина времени — по исходному сообщению, если Telegram его передал
+        origin_ts = int(getattr(message, "forward_date", None) or msg_ts)
+        bucket = origin_ts // DEDUP_BUCKET_SECONDS
+        text = message.text or ""
+        sender_bonus = users.get_user_bonus(sender_id) if sender_id is not None else 0.0
+        text_key = "text:" + hashlib.sha1(f"{bucket}|{sender_bonus}|{text}".encode("utf-8")).hexdigest()
+        if _seen_forward(text_key):
+            bot.reply_to(message, "✅ Данные совпадают с текущим снимком рынка — уже сохранены.")
+            return
+
+        parsed = parse_market_message(text, sender_id=sender_id)
         if not parsed:
             bot.reply_to(message, "❌ Не удалось распознать данные рынка. Проверьте формат сообщения.")
             return
 
-        saved = 0
+        digest = snapshot_digest(parsed, bucket)
+        if _seen_forward(digest):
+            _remember_forward(text_key)
+            bot.reply_to(message, "✅ Данные совпадают с текущим снимком рынка — уже сохранены.")
+            return
+
+        records = []
         for resource, vals in parsed.items():
-            buy = float(vals.get("buy", 0.0))
-            sell = float(vals.get("sell", 0.0))
-            qty = int(vals.get("quantity", 0) or 0)
-            timestamp = int(msg_ts)
-            try:
-                database.insert_market_record(resource, buy, sell, qty, timestamp)
-                saved += 1
-            except Exception as e:
-                logger.exception(f"Ошибка сохранения записи рынка для {resource}: {e}")
-
-        # Запись в history
-        try:
-            conn = database.get_connection()
-            cur = conn.cursor()
-            summary = f"Получен форвард рынка: сохранено {saved} записей (отправитель: {forward_from.username if forward_from and getattr(forward_from, 'username', None) else forward_sender_name or 'unknown'})"
-            cur.execute("INSERT INTO history (timestamp, text) VALUES (?, ?)", (int(time.time()), summary))
-            conn.commit()
-            conn.close()
-        except Exception:
-            logger.debug("Не удалось записать историю форварда", exc_info=True)
+            records.append({
+                "resource": resource,
+                "buy": float(vals.get("buy", 0.0)),
+                "sell": float(vals.get("sell", 0.0)),
+                "quantity": int(vals.get("quantity", 0) or 0),
+                "timestamp": int(msg_ts),
+            })
+
+        sender = forward_from.username if forward_from and getattr(forward_from, 'username', None) else forward_sender_name or 'unknown'
+        summary = f"Получен форвард рынка: сохранено {len(records)} записей (отправитель: {sender})"
+        saved = database.ingest_market_snapshot(records, summary, dedup_key=digest)
+        _remember_forward(text_key, digest)
+
+        # Кэши и подписчики уведомляются один раз на весь форвард. Столбцы и оценки
+        # обновляются до публикации снимка: подписчики и сброс кэша /stat должны видеть новый тик.
+        if saved:
+            tick_store.append(records)
+            estimator.online_estimates.update(records)
+            market_snapshot.update(records)
 
         if saved > 0:
             bot.reply_to(message, f"✅ Сохранено {saved} записей рынка.")
+        elif records:
+            bot.reply_to(message, "✅ Данные совпадают с текущим снимком рынка — уже сохранены.")
         else:
             bot.reply_to(message, "ℹ️ Записей для сохранения не найдено.")
 
@@ -221,102 +268,50 @@ def handle_market_forward(bot, message) -> None:
             pass
 
 
-def calculate_speed(records: List[dict], price_field: str = "buy") -> Optional[float]:
-    if not records or len(records) < 2:
-        return None
-    prev = records[-2]
-    last = records[-1]
-    price_delta = last[price_field] - prev[price_field]
-    time_delta_minutes = (last['timestamp'] - prev['timestamp']) / 60.0
-    if time_delta_minutes < 0.1:
-        return None
-    speed = price_delta / time_delta_minutes
-    return round(speed, 6)
-
-
-def get_trend(records: List[dict], price_field: str = "buy") -> str:
-    if not records or len(records) < 2:
-        return "stable"
-    prev_price = records[-2][price_field]
-    last_price = records[-1][price_field]
-    if last_price > prev_price:
-        return "up"
-    elif last_price < prev_price:
-        return "down"
-    else:
-        return "stable"
-
-
-def _calculate_speed_from_records(records: List[dict], price_field: str = "buy") -> Optional[float]:
-    if not records or len(records) < 2:
-        return None
-    prev = records[-2]
-    last = records[-1]
-    try:
-        t_delta = (last['timestamp'] - prev['timestamp']) / 60.0
-        if t_delta <= 0:
-            return None
-        price_delta = last[price_field] - prev[price_field]
-        speed = price_delta / t_delta
-        return float(speed)
-    except Exception:
-        return None
-
-
-def compute_extrapolated_price(resource: str, user_id: Optional[int] = None, lookback_minutes: int = 60) -> Tuple[Optional[float], Optional[float], str, Optional[float], Optional[int]]:
+def compute_extrapolated_prices(resources: List[str], user_id: Optional[int] = None, lookback_minutes: int = 60,
+                                bonus: Optional[float] = None) -> Dict[str, Tuple[Optional[float], Optional[float], str, Optional[float], Optional[int]]]:
     """
-    Возвращает:
-      (predicted_buy, predicted_sell, trend, adjusted_speed, last_timestamp)
-    Все цены возвращаются уже скорректированными под user_id (если указан) — то есть для отображения пользователю.
+    compute_extrapolated_price для нескольких ресурсов. Скорость и тренд берутся из
+    онлайн-оценок (estimator.online_estimates) без обращения к БД; ресурс без тиков
+    за lookback_minutes считается без скорости. Если bonus передан, цены
+    пересчитываются под него, а не под бонус user_id.
     """
+    online = estimator.online_estimates
+    max_age = lookback_minutes * 60
+    estimates = {(res, field): online.get(res, field, max_age) for res in resources for field in ("buy", "sell")}
+    if bonus is None:
+        try:
+            bonus = users.get_user_bonus(user_id) if user_id is not None else 0.0
+        except Exception:
+            bonus = 0.0
+    now_ts = int(time.time())
+    return {res: _extrapolate(res, bonus, estimates.get((res, "buy")), estimates.get((res, "sell")), now_ts)
+            for res in resources}
+
+
+def _extrapolate(resource: str, bonus: float, est_buy, est_sell, now_ts: int):
     try:
-        latest = database.get_latest_market(resource)
+        latest = market_snapshot.get_latest(resource)
         if not latest:
             return None, None, "stable", None, None
 
-        recent = database.get_recent_market(resource, minutes=lookback_minutes)
-        if not recent:
-            recent = [latest]
-
         # raw base prices are stored in DB
         last_ts = int(latest['timestamp'])
         last_buy_raw = float(latest['buy'])
         last_sell_raw = float(latest['sell'])
 
-        # compute raw speeds
-        speed_buy_raw = _calculate_speed_from_records(recent, "buy")
-        speed_sell_raw = _calculate_speed_from_records(recent, "sell")
-
-        trend = get_trend(recent, "buy")
-
-        # get user bonus and get adjusted last prices
-        try:
-            bonus = users.get_user_bonus(user_id) if user_id is not None else 0.0
-        except Exception:
-            bonus = 0.0
+        # Скорость — наклон взвешенной регрессии по окну, а не разница двух последних тиков
+        speed_buy_raw = est_buy.slope if est_buy else None
+        speed_sell_raw = est_sell.slope if est_sell else None
+        trend = est_buy.trend if est_buy else "stable"
 
         # Adjust last (base) -> for user
-        try:
-            adj_last_buy, adj_last_sell = users.adjust_prices_for_user(user_id, last_buy_raw, last_sell_raw)
-        except Exception:
-            # fallback naive
-            if bonus:
-                adj_last_buy = last_buy_raw / (1 + bonus)
-                adj_last_sell = last_sell_raw * (1 + bonus)
-            else:
-                adj_last_buy = last_buy_raw
-                adj_last_sell = last_sell_raw
+        adj_last_buy, adj_last_sell = users.adjust_prices_for_bonus(bonus, last_buy_raw, last_sell_raw)
 
         # Adjust speed for user (speed should be scaled same way as price seen by user)
-        adj_speed_buy = None
-        if speed_buy_raw is not None:
-            try:
-                adj_speed_buy = speed_buy_raw / (1 + bonus)
-            except Exception:
-                adj_speed_buy = speed_buy_raw
+        adj_speed_buy = speed_buy_raw / (1 + bonus) if speed_buy_raw is not None else None
 
         # Extrapolate forward from last record to now
-        now_ts = int(time.time())
         elapsed_minutes = max(0.0, (now_ts - last_ts) / 60.0)
 
         pred_buy = adj_last_buy
@@ -325,30 +320,21 @@ def compute_extrapolated_price(resource: str, user_id: Optional[int] = None, loo
             pred_buy = adj_last_buy + adj_speed_buy * elapsed_minutes
 
         # For sell side we try a similar approach if possible
-        adj_speed_sell = None
-        if speed_sell_raw is not None:
-            try:
-                adj_speed_sell = speed_sell_raw * (1 + bonus)  # selling speed scales opposite in some conventions; use conservative approach
-            except Exception:
-                adj_speed_sell = speed_sell_raw
-        if adj_speed_sell is not None and elapsed_minutes > 0:
-            try:
-                pred_sell = adj_last_sell + adj_speed_sell * elapsed_minutes
-            except Exception:
-                pred_sell = adj_last_sell
-
-        # round results
-        try:
-            pred_buy = float(round(pred_buy, 6))
-        except Exception:
-            pred_buy = None
-        try:
-            pred_sell = float(round(pred_sell, 6))
-        except Exception:
-            pred_sell = None
+        if speed_sell_raw is not None and elapsed_minutes > 0:
+            adj_speed_sell = speed_sell_raw * (1 + bonus)  # selling speed scales opposite in some conventions; use conservative approach
+            pred_sell = adj_last_sell + adj_speed_sell * elapsed_minutes
 
-        return pred_buy, pred_sell, trend, (adj_speed_buy if adj_speed_buy is not None else None), last_ts
+        return float(round(pred_buy, 6)), float(round(pred_sell, 6)), trend, adj_speed_buy, last_ts
 
     except Exception:
         logger.exception("Ошибка в compute_extrapolated_price")
         return None, None, "stable", None, None
+
+
+def compute_extrapolated_price(resource: str, user_id: Optional[int] = None, lookback_minutes: int = 60) -> Tuple[Optional[float], Optional[float], str, Optional[float], Optional[int]]:
+    """
+    Возвращает:
+      (predicted_buy, predicted_sell, trend, adjusted_speed, last_timestamp)
+    Все цены возвращаются уже скорректированными под user_id (если указан) — то есть для отображения пользователю.
+    """
+    return compute_extrapolated_prices([resource], user_id, lookback_minutes)[resource]
@@ -0,0 +1,45 @@
+# market_parser_bench.py
+"""
+Бенчмарк парсера рынка: пропускная способность (сообщений/с) текущего
+market._parse_market_message_lines и замороженной копии прежнего парсера
+на корпусе tests/market_corpus.py.
+
+    python market_parser_bench.py --repeat 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests"))
+
+import market  # noqa: E402
+from legacy_market_parser import _parse_market_message_lines as legacy_parse  # noqa: E402
+from market_corpus import REAL_MESSAGES, fuzzed_messages  # noqa: E402
+
+
+def throughput(parse, messages) -> float:
+    started = time.perf_counter()
+    for text in messages:
+        parse(text)
+    return len(messages) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5000, help="повторов реальных форвардов")
+    parser.add_argument("--fuzzed", type=int, default=20000, help="число сгенерированных сообщений")
+    args = parser.parse_args()
+
+    corpora = {
+        "реальные": [t for t in REAL_MESSAGES if t.strip()] * args.repeat,
+        "сгенерированные": fuzzed_messages(args.fuzzed, args.fuzzed // 10),
+    }
+    for name, messages in corpora.items():
+        old = throughput(legacy_parse, messages)
+        new = throughput(market._parse_market_message_lines, messages)
+        print(f"{name:16} {len(messages):7d} сообщ.  прежний {old:9.0f}/с  текущий {new:9.0f}/с  x{new / old:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# outbox.py
+import threading
+import time
+import logging
+from typing import Callable, Dict, Optional
+
+import database
+from dispatcher import outbound
+
+logger = logging.getLogger(__name__)
+
+# Экспоненциальная задержка повторов: 5 с, 10 с, 20 с ... но не больше 15 мин
+BACKOFF_BASE = 5
+BACKOFF_MAX = 15 * 60
+MAX_ATTEMPTS = 8
+BATCH_SIZE = 100
+POLL_INTERVAL = 5
+STATS_INTERVAL = 300
+RETENTION_SECONDS = 7 * 24 * 3600
+
+
+def message(key: str, chat_id: int, text: str, priority: int = 0, parse_mode: Optional[str] = None) -> Dict:
+    """Сообщение для database.*(outbox=[...]); key — ключ идемпотентности."""
+    return {"key": key, "chat_id": chat_id, "text": text, "priority": priority, "parse_mode": parse_mode}
+
+
+def backoff_delay(attempts: int) -> int:
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempts))
+
+
+class OutboxWorker:
+    """
+    Доставляет сообщения из таблицы outbox через dispatcher.outbound.
+    Успех — status='sent'; ошибка — повтор с экспоненциальной задержкой,
+    после MAX_ATTEMPTS — status='failed'. Каждая строка outbox уходит не больше
+    одного раза: ключ идемпотентности уникален, а строка «забирается» ('sending')
+    до отправки. Строки, оставшиеся в 'sending' после перезапуска, не переотправляются,
+    а помечаются 'unknown' (доставлены ли они, неизвестно) и видны в stats().
+    Для окончательно недоставленных сообщений вызывается обработчик,
+    зарегистрированный на префикс ключа (on_failed), — например, чтобы вернуть алерт.
+    """
+
+    def __init__(self, dispatcher=outbound):
+        self._dispatcher = dispatcher
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_stats = 0.0
+        self._failure_handlers: Dict[str, Callable[[Dict], None]] = {}
+
+    def on_failed(self, key_prefix: str, handler: Callable[[Dict], None]) -> None:
+        """handler(row) вызывается, когда сообщение с ключом «key_prefix:…» не доставлено после MAX_ATTEMPTS."""
+        self._failure_handlers[key_prefix] = handler
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        abandoned = database.abandon_outbox_in_flight()
+        if abandoned:
+            logger.warning(f"Outbox: {abandoned} сообщений в отправке на момент остановки помечены 'unknown'")
+        self._thread = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        """Сообщает воркеру, что в outbox появились новые сообщения."""
+        self._wake.set()
+
+    def drain_once(self) -> int:
+        rows = database.claim_outbox_batch(BATCH_SIZE)
+        for row in rows:
+            kwargs = {"parse_mode": row['parse_mode']} if row['parse_mode'] else {}
+            self._dispatcher.send(row['chat_id'], row['text'], row['priority'],
+                                  on_done=lambda ok, error, row=row: self._on_done(row, ok, error), **kwargs)
+        return len(rows)
+
+    def _on_done(self, row: Dict, ok: bool, error: Optional[Exception]) -> None:
+        if ok:
+            database.mark_outbox_sent(row['id'])
+            return
+        attempts = row['attempts'] + 1
+        next_at = int(time.time()) + backoff_delay(attempts) if attempts < MAX_ATTEMPTS else None
+        database.mark_outbox_retry(row['id'], str(error)[:500], next_at)
+        if next_at is None:
+            logger.warning(f"Outbox: сообщение {row['id']} не доставлено после {attempts} попыток")
+            handler = self._failure_handlers.get((row.get('idempotency_key') or '').split(':', 1)[0])
+            if handler is not None:
+                try:
+                    handler(row)
+                except Exception:
+                    logger.exception(f"Outbox: ошибка обработчика недоставленного сообщения {row['id']}")
+
+    def stats(self) -> Dict:
+        stats = database.get_outbox_stats()
+        stats["dispatcher_queue_depth"] = self._dispatcher.queue_depth()
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            try:
+                claimed = self.drain_once()
+                now = time.time()
+                if now - self._last_stats >= STATS_INTERVAL:
+                    self._last_stats = now
+                    database.prune_outbox(int(now) - RETENTION_SECONDS)
+                    logger.info(f"Outbox: {self.stats()}")
+            except Exception:
+                logger.exception("Ошибка в outbox-worker")
+                claimed = 0
+            if claimed < BATCH_SIZE:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+
+
+outbox_worker = OutboxWorker()
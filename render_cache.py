@@ -0,0 +1,45 @@
+# render_cache.py
+import threading
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+
+class RenderCache:
+    """
+    Кэш готовых текстов ответов. Ключ — (поколение, параметры), где поколение —
+    например (версия снимка рынка, минута). Кэш держит записи только текущего
+    поколения: запись с новым поколением сбрасывает все старые, а invalidate()
+    (подписка на market_snapshot) очищает кэш сразу после нового форварда.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._generation: Optional[Hashable] = None
+        self._entries: Dict[Hashable, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, generation: Hashable, key: Hashable, render: Callable[[], str]) -> str:
+        with self._lock:
+            if generation == self._generation and key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        text = render()
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._entries = {}
+            if len(self._entries) < self.max_entries:
+                self._entries[key] = text
+        return text
+
+    def invalidate(self, *_args) -> None:
+        """Сбрасывает кэш; сигнатура совместима с market_snapshot.subscribe."""
+        with self._lock:
+            self._generation = None
+            self._entries = {}
+
+    def stats(self) -> Tuple[int, int, int]:
+        with self._lock:
+            return self.hits, self.misses, len(self._entries)
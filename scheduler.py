@@ -0,0 +1,128 @@
+# scheduler.py
+import heapq
+import itertools
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Мелкую кучу не пересобираем: мёртвые записи в ней дешевле вытолкнуть с вершины
+COMPACT_MIN_HEAP = 64
+
+
+class TimerScheduler:
+    """
+    Один поток на все таймеры: очередь с приоритетом по времени срабатывания.
+    reschedule/cancel — O(log n): старая запись в куче помечается недействительной
+    и выбрасывается, когда доходит до вершины. Когда мёртвых записей становится
+    больше, чем живых, куча пересобирается из живых (амортизированно O(1) на операцию).
+    """
+
+    def __init__(self):
+        self._heap: List[list] = []
+        self._entries: Dict[int, list] = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._callback: Optional[Callable[[int], None]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, callback: Callable[[int], None]) -> None:
+        """Запускает поток планировщика; callback(alert_id) вызывается в момент срабатывания."""
+        with self._cond:
+            self._callback = callback
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="timer-scheduler", daemon=True)
+            self._thread.start()
+
+    def load_active(self) -> int:
+        """Восстанавливает очередь из alerts WHERE status='active'. Возвращает число таймеров."""
+        count = 0
+        for alert in database.get_active_alerts():
+            due = _parse_alert_time(alert.get('alert_time'))
+            if due is None:
+                continue
+            self.schedule(alert['id'], due)
+            count += 1
+        return count
+
+    def schedule(self, alert_id: int, due_ts: float) -> None:
+        """Ставит или переставляет таймер alert_id на due_ts (unix time)."""
+        with self._cond:
+            old = self._entries.pop(alert_id, None)
+            if old is not None:
+                old[2] = None
+            entry = [float(due_ts), next(self._counter), alert_id]
+            self._entries[alert_id] = entry
+            heapq.heappush(self._heap, entry)
+            self._compact_locked()
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    reschedule = schedule
+
+    def cancel(self, alert_id: int) -> bool:
+        with self._cond:
+            entry = self._entries.pop(alert_id, None)
+            if entry is None:
+                return False
+            entry[2] = None
+            self._compact_locked()
+            return True
+
+    def _compact_locked(self) -> None:
+        # reschedule каждого таймера раз в минуту иначе копил бы мёртвые записи без предела
+        if len(self._heap) > COMPACT_MIN_HEAP and len(self._heap) > 2 * len(self._entries):
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def due_time(self, alert_id: int) -> Optional[float]:
+        with self._cond:
+            entry = self._entries.get(alert_id)
+            return entry[0] if entry else None
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def _pop_due(self) -> Optional[int]:
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due_ts, _, alert_id = self._heap[0]
+                delay = due_ts - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._entries[alert_id]
+                return alert_id
+
+    def _run(self) -> None:
+        while True:
+            alert_id = self._pop_due()
+            try:
+                self._callback(alert_id)
+            except Exception:
+                logger.exception(f"Ошибка при срабатывании таймера {alert_id}")
+
+
+def _parse_alert_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+timer_scheduler = TimerScheduler()
@@ -0,0 +1,100 @@
+# snapshot.py
+import threading
+import logging
+from typing import Callable, Optional, Dict, List, Iterable
+
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class MarketSnapshot:
+    """
+    Последние цены по каждому ресурсу в памяти процесса.
+    Обновляется при сохранении форварда рынка и загружается из БД при старте,
+    так что все чтения «текущей цены» не ходят в SQLite.
+    version растёт на единицу при каждом изменении — по нему можно дёшево
+    понять, что с прошлой проверки ничего не поменялось.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Dict] = {}
+        self._version = 0
+        self._loaded = False
+        self._listeners: List[Callable[[List[str], int], None]] = []
+
+    def subscribe(self, callback: Callable[[List[str], int], None]) -> None:
+        """
+        Подписка на событие «ресурсы обновлены»: callback(resources, version)
+        вызывается после каждого update(), изменившего хотя бы один ресурс.
+        Вызывается в потоке, сохранившем форвард, — тяжёлую работу переносите в свой поток.
+        """
+        self._listeners.append(callback)
+
+    def load(self) -> None:
+        """Перечитывает последние записи по всем ресурсам из БД."""
+        rows = database.get_latest_market_per_resource()
+        with self._lock:
+            self._latest = {r['resource']: r for r in rows}
+            self._version += 1
+            self._loaded = True
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            try:
+                self.load()
+            except Exception:
+                logger.exception("Не удалось загрузить снимок рынка из БД")
+
+    def update(self, records: Iterable[Dict]) -> List[str]:
+        """
+        Атомарно применяет новые записи рынка (resource, buy, sell, quantity, timestamp).
+        Запись старше уже известной для ресурса игнорируется.
+        Возвращает список ресурсов, которые действительно изменились.
+        """
+        self._ensure_loaded()
+        changed: List[str] = []
+        with self._lock:
+            latest = dict(self._latest)
+            for rec in records:
+                resource = rec['resource']
+                current = latest.get(resource)
+                if current is not None and int(rec['timestamp']) < int(current['timestamp']):
+                    continue
+                latest[resource] = dict(rec)
+                if resource not in changed:
+                    changed.append(resource)
+            if changed:
+                self._latest = latest
+                self._version += 1
+            version = self._version
+        if changed:
+            for callback in list(self._listeners):
+                try:
+                    callback(changed, version)
+                except Exception:
+                    logger.exception("Ошибка в подписчике обновлений рынка")
+        return changed
+
+    @property
+    def version(self) -> int:
+        self._ensure_loaded()
+        return self._version
+
+    def get_latest(self, resource: str) -> Optional[Dict]:
+        self._ensure_loaded()
+        rec = self._latest.get(resource)
+        return dict(rec) if rec else None
+
+    def get_latest_all(self) -> List[Dict]:
+        self._ensure_loaded()
+        return sorted((dict(r) for r in self._latest.values()), key=lambda r: r['timestamp'], reverse=True)
+
+    def get_global_latest_timestamp(self) -> Optional[int]:
+        self._ensure_loaded()
+        timestamps = [r['timestamp'] for r in self._latest.values()]
+        return max(timestamps) if timestamps else None
+
+
+market_snapshot = MarketSnapshot()
@@ -0,0 +1,35 @@
+# tests/conftest.py
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database при импорте вызывает init_db() для bsp.db в текущем каталоге —
+# уводим его во временный каталог, чтобы тесты не трогали рабочую БД
+_WORKDIR = tempfile.mkdtemp(prefix="bsp-tests-")
+os.chdir(_WORKDIR)
+atexit.register(shutil.rmtree, _WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Чистая БД со всеми миграциями; кэши и индексы в памяти сбрасываются."""
+    import database
+    from leaderboard import leaderboard
+
+    old_path = database.DB_PATH
+    database.DB_PATH = str(tmp_path / "bsp.db")
+    database.init_db()
+    database.invalidate_user_cache()
+    leaderboard.loaded = False
+    yield database
+    database.close_connection()
+    database.DB_PATH = old_path
+    database.invalidate_user_cache()
+    leaderboard.loaded = False
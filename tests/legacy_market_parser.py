@@ -0,0 +1,105 @@
+# tests/legacy_market_parser.py
+"""
+Замороженная копия парсера рынка до перехода на однопроходный разбор
+(market._parse_market_message_lines). Нужна только тесту паритета и
+бенчмарку — не менять.
+"""
+import re
+from typing import Dict, Optional
+
+EMOJI_TO_RESOURCE = {
+    "🪵": "Дерево",
+    "🪨": "Камень",
+    "🍞": "Провизия",
+    "🐴": "Лошади"
+}
+
+
+def _parse_market_message_lines(text: str) -> Optional[Dict[str, Dict[str, float]]]:
+    """
+    Парсит текст рынка и возвращает словарь:
+    { "Дерево": {"buy": float, "sell": float, "quantity": int}, ... }
+    Если ни одного ресурса не найдено — возвращает None.
+    """
+    if not text:
+        return None
+
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    resources: Dict[str, Dict[str, float]] = {}
+    current_resource = None
+    current_quantity = 0
+
+    # Паттерны
+    resource_pattern = re.compile(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s*$")
+    price_pattern = re.compile(r"(?:[📈📉]?\s*)?Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))")
+    # Альтернативный паттерн, если формат "Купить: 8.31 Продать: 6.80"
+    alt_price_pattern = re.compile(r"Купить[:\s]*([0-9]+(?:[.,][0-9]+))[,;\s]+Продать[:\s]*([0-9]+(?:[.,][0-9]+))")
+
+    for line in lines:
+        # Пропускаем заголовки
+        if line.startswith("🎪") or line.lower().startswith("рынок"):
+            continue
+
+        # Resource line
+        m = resource_pattern.match(line)
+        if m:
+            name_part = m.group(1).strip()
+            qty_str = m.group(2).replace(' ', '').replace(',', '')
+            emoji = m.group(3)
+            try:
+                qty = int(qty_str) if qty_str.isdigit() else 0
+            except Exception:
+                qty = 0
+            current_quantity = qty
+            # Map emoji to standard resource name; fallback to parsed name
+            resource_name = EMOJI_TO_RESOURCE.get(emoji, name_part)
+            current_resource = resource_name
+            # ensure placeholder
+            resources[current_resource] = {"buy": 0.0, "sell": 0.0, "quantity": current_quantity}
+            continue
+
+        # Price line
+        pm = price_pattern.search(line) or alt_price_pattern.search(line)
+        if pm and current_resource:
+            buy_raw = pm.group(1).replace(',', '.')
+            sell_raw = pm.group(2).replace(',', '.')
+            try:
+                buy_price = float(buy_raw)
+                sell_price = float(sell_raw)
+            except Exception:
+                continue
+            resources[current_resource] = {
+                "buy": buy_price,
+                "sell": sell_price,
+                "quantity": current_quantity
+            }
+            current_resource = None
+            current_quantity = 0
+            continue
+
+        # Иногда ресурс и цены могут быть в одной строк: "Дерево: 96 342 449 🪵 Купить/продать: 8.31/6.80💰"
+        combined_match = re.search(r"^(.+?):\s*([\d, ]+)\s*([🪵🪨🍞🐴])\s+.*Купить/продать[:\s]*([0-9]+(?:[.,][0-9]+))\s*/\s*([0-9]+(?:[.,][0-9]+))", line)
+        if combined_match:
+            name_part = combined_match.group(1).strip()
+            qty_str = combined_match.group(2).replace(' ', '').replace(',', '')
+            emoji = combined_match.group(3)
+            buy_raw = combined_match.group(4).replace(',', '.')
+            sell_raw = combined_match.group(5).replace(',', '.')
+            try:
+                qty = int(qty_str) if qty_str.isdigit() else 0
+            except Exception:
+                qty = 0
+            resource_name = EMOJI_TO_RESOURCE.get(emoji, name_part)
+            try:
+                buy_price = float(buy_raw)
+                sell_price = float(sell_raw)
+            except Exception:
+                continue
+            resources[resource_name] = {"buy": buy_price, "sell": sell_price, "quantity": qty}
+            current_resource = None
+            current_quantity = 0
+            continue
+
+    if not resources:
+        return None
+    return resources
@@ -0,0 +1,64 @@
+# tests/market_corpus.py
+"""
+Корпус сообщений рынка для теста паритета парсера и бенчмарка
+(market_parser_bench.py): реальные форварды всех поддерживаемых форматов
+и сгенерированные из их кусков сообщения с мутациями символов.
+"""
+import random
+from typing import List
+
+REAL_MESSAGES = [
+    # Двухстрочный формат: ресурс, затем «Купить/продать»
+    """🎪 Рынок
+Дерево: 96 342 449 🪵
+📈 Купить/продать: 8.31/6.80💰
+Камень: 12 000 🪨
+📉 Купить/продать: 3,10/2,05💰
+Провизия: 1,234 🍞
+Купить: 4.50 Продать: 3.20
+Лошади: 77 🐴
+➖ Купить/продать: 120.5/99.9💰""",
+    """🎪 Рынок
+Дерево: 95 118 004 🪵
+📉 Купить/продать: 8.12/6.64💰
+Камень: 41 220 915 🪨
+📈 Купить/продать: 11.47/9.38💰
+Провизия: 7 502 311 🍞
+📈 Купить/продать: 15.02/12.29💰
+Лошади: 310 477 🐴
+📉 Купить/продать: 402.11/329.00💰""",
+    # Альтернативный формат цен «Купить: … Продать: …»
+    """Рынок
+Дерево: 1 000 🪵
+Купить: 8.31 Продать: 6.80
+Камень: 2 000 🪨
+Купить: 3.10; Продать: 2.05""",
+    # Ресурс и цены в одной строке
+    """🎪 Рынок ресурсов
+Дерево: 96 342 449 🪵 Купить/продать: 8.31/6.80💰
+Камень: 1 🪨 📉 Купить/продать: 3.10/2.00💰""",
+    # Ресурс без строки цены, пустые и посторонние сообщения
+    "Рынок\nДерево: 5 🪵\n",
+    "",
+    "   \n\n",
+    "Ты купил 5 🪵 на сумму 10 💰",
+]
+
+FUZZ_PIECES = [
+    "🎪 Рынок", "рынок", "РЫНОК сегодня", "Дерево: 96 342 449 🪵", "Камень: 1,000 🪨", "Провизия:  🍞",
+    "Лошади: 5🐴", "Купить/продать: 8.31/6.80💰", "📈 Купить/продать: 8,31 / 6,80", "Купить: 8.31, Продать: 6.80",
+    "Купить 8 Продать 6", "Дерево: 96 342 449 🪵 Купить/продать: 8.31/6.80💰",
+    "Камень: 12 🪨 📉 Купить/продать: 3.1/2.0", "Купить: 5 🪵", "Foo: 12 🐴", "  ", "random text",
+    "Купить/продать: 8/6", "x: 1 🪵 Купить: 1.5 Продать: 2.5", "İ рынок",
+    "Лошади: 12 🐴 \u0085 Купить/продать: 1.1/2.2",
+]
+MUTATION_CHARS = " :/.,🪵\n"
+
+
+def fuzzed_messages(count: int = 5000, mutated: int = 1000, seed: int = 42) -> List[str]:
+    """count случайных сборок из FUZZ_PIECES и mutated их копий с заменой ~5% символов."""
+    rnd = random.Random(seed)
+    messages = ["\n".join(rnd.choice(FUZZ_PIECES) for _ in range(rnd.randint(0, 12))) for _ in range(count)]
+    for text in messages[:mutated]:
+        messages.append("".join(c if rnd.random() > 0.05 else rnd.choice(MUTATION_CHARS) for c in text))
+    return messages
@@ -0,0 +1,52 @@
+# tests/test_alert_index.py
+import random
+
+from alert_index import AlertCrossingIndex
+from users import adjust_prices_for_bonus
+
+RESOURCES = ("Дерево", "Камень")
+BONUS_TIERS = (0.0, 0.05, 0.1, 0.25)
+
+
+def _linear_crossed(alerts, bonuses, resource, base_buy):
+    """Прежний перебор: цена под бонус пользователя против цели каждого алерта."""
+    hit = set()
+    for alert_id, (user_id, res, direction, target) in alerts.items():
+        if res != resource:
+            continue
+        price, _ = adjust_prices_for_bonus(bonuses[user_id], base_buy, base_buy)
+        if (direction == "down" and price <= target) or (direction == "up" and price >= target):
+            hit.add(alert_id)
+    return hit
+
+
+def _check(index, alerts, bonuses, rnd):
+    for _ in range(200):
+        resource = rnd.choice(RESOURCES)
+        base_buy = round(rnd.uniform(5, 15), 2)
+        assert set(index.crossed(resource, base_buy)) == _linear_crossed(alerts, bonuses, resource, base_buy)
+
+
+def test_crossed_matches_linear_scan():
+    rnd = random.Random(8)
+    bonuses = {user_id: rnd.choice(BONUS_TIERS) for user_id in range(200)}
+    alerts = {alert_id: (rnd.randrange(200), rnd.choice(RESOURCES), rnd.choice(["up", "down"]),
+                         round(rnd.uniform(5, 15), 2))
+              for alert_id in range(5000)}
+    index = AlertCrossingIndex()
+    index.load([{"id": a, "user_id": u, "resource": r, "direction": d, "target_price": t}
+                for a, (u, r, d, t) in alerts.items()], bonuses)
+    _check(index, alerts, bonuses, rnd)
+
+    # Закрытие алертов, отмена всех алертов игрока и смена бонуса поддерживают индекс
+    for alert_id in rnd.sample(sorted(alerts), 1000):
+        index.remove(alert_id)
+        del alerts[alert_id]
+    for user_id in range(10):
+        index.remove_user(user_id)
+        alerts = {a: info for a, info in alerts.items() if info[0] != user_id}
+    for user_id in range(10, 60):
+        bonuses[user_id] = rnd.choice(BONUS_TIERS)
+        index.update_user_bonus(user_id, bonuses[user_id])
+    assert len(index) == len(alerts)
+    _check(index, alerts, bonuses, rnd)
@@ -0,0 +1,88 @@
+# tests/test_alerts.py
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import alerts
+import estimator
+import outbox
+import snapshot
+from alert_index import alert_index
+from scheduler import TimerScheduler
+
+
+@pytest.fixture
+def alerts_db(db):
+    db.load_alert_index()
+    return db
+
+
+def _timer(db, user_id=7, resource="Дерево", target=8.0, direction="down"):
+    db.ensure_user(user_id, "u")
+    alert_time = (datetime.now() + timedelta(minutes=30)).isoformat()
+    return db.insert_alert_record(user_id, resource, target, direction, -0.1, 9.0, alert_time)
+
+
+def test_alert_is_closed_once_by_racing_threads(alerts_db):
+    alert_id = _timer(alerts_db)
+    alert = alerts_db.get_alert_by_id(alert_id)
+    start = threading.Barrier(2)
+    results = {}
+
+    def close(status, text):
+        start.wait()
+        results[status] = alerts.close_alert(alert_id, status, [outbox.message(f"{status}:{alert_id}", alert['user_id'], text)])
+
+    threads = [threading.Thread(target=close, args=("completed", "reached")),
+               threading.Thread(target=close, args=("expired", "expired"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(results.values()) == [False, True]
+    winner = next(status for status, closed in results.items() if closed)
+    sent = alerts_db._fetchall("SELECT text FROM outbox")
+    assert [r['text'] for r in sent] == ["reached" if winner == "completed" else "expired"]
+    assert alerts_db.get_alert_by_id(alert_id)['status'] == winner
+    assert alert_id not in alert_index.crossed("Дерево", 0.0)
+
+
+def test_closed_alert_is_not_reopened_or_notified(alerts_db):
+    alert_id = _timer(alerts_db)
+    assert alerts.close_alert(alert_id, 'completed', [outbox.message("a", 7, "reached")])
+    assert not alerts.close_alert(alert_id, 'expired', [outbox.message("b", 7, "expired")])
+    assert alerts_db.get_alert_by_id(alert_id)['status'] == 'completed'
+    assert [r['text'] for r in alerts_db._fetchall("SELECT text FROM outbox")] == ["reached"]
+
+
+class _BlockedBot:
+    def reply_to(self, message, text, **kwargs):
+        raise RuntimeError("Forbidden: bot was blocked by the user")
+
+
+def test_timer_is_scheduled_even_if_reply_fails(alerts_db, monkeypatch):
+    scheduler = TimerScheduler()
+    snap = snapshot.MarketSnapshot()
+    online = estimator.OnlineEstimators()
+    monkeypatch.setattr(alerts, "timer_scheduler", scheduler)
+    monkeypatch.setattr(alerts, "market_snapshot", snap)
+    monkeypatch.setattr(estimator, "online_estimates", online)
+    now = int(time.time())
+    ticks = [{"resource": "Дерево", "buy": 10.0 - 0.05 * i, "sell": 8.0, "quantity": 10, "timestamp": now - 1800 + 60 * i}
+             for i in range(30)]
+    online.update(ticks)
+    snap.update(ticks[-1:])
+    alerts_db.ensure_user(7, "u")
+    message = SimpleNamespace(text="/timer Дерево 8.0", chat=SimpleNamespace(id=7, type="private"),
+                              from_user=SimpleNamespace(id=7, username="u"))
+
+    with pytest.raises(RuntimeError):
+        alerts.cmd_timer_handler(_BlockedBot(), message)
+
+    active = alerts_db.get_user_active_alerts(7)
+    assert len(active) == 1
+    assert scheduler.due_time(active[0]['id']) is not None
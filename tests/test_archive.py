@@ -0,0 +1,44 @@
+# tests/test_archive.py
+import sqlite3
+
+import pytest
+
+
+def _ticks(db, count, ts=1000):
+    with db.transaction() as c:
+        c.executemany("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)",
+                      [("Дерево", 8.0, 6.0, 10, ts + i) for i in range(count)])
+
+
+def _count(db, table):
+    return db._fetchone(f"SELECT COUNT(*) AS n FROM {table}")['n']
+
+
+def test_batches_move_every_tick_once(db):
+    _ticks(db, 25)
+    assert db.archive_market_ticks(cutoff=2000, batch_size=10, pause=0) == 25
+    assert _count(db, "main.market") == 0
+    assert _count(db, "archive.market") == 25
+
+
+def test_crash_before_delete_keeps_ticks(db, monkeypatch):
+    _ticks(db, 5)
+    real = db.transaction
+    calls = []
+
+    def crash_on_delete():
+        calls.append(None)
+        if len(calls) == 2:
+            raise sqlite3.OperationalError("disk I/O error")
+        return real()
+
+    monkeypatch.setattr(db, "transaction", crash_on_delete)
+    with pytest.raises(sqlite3.OperationalError):
+        db.archive_market_batch(2000)
+    monkeypatch.setattr(db, "transaction", real)
+    assert _count(db, "main.market") == 5
+    assert _count(db, "archive.market") == 5
+
+    assert db.archive_market_batch(2000) == 5
+    assert _count(db, "main.market") == 0
+    assert _count(db, "archive.market") == 5
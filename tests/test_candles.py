@@ -0,0 +1,24 @@
+# tests/test_candles.py
+import random
+import time
+
+
+def _candles(db):
+    return [tuple(r) for r in db._fetchall("SELECT * FROM market_candles ORDER BY interval, resource, bucket")]
+
+
+def test_incremental_candles_match_rebuild(db):
+    rnd = random.Random(18)
+    now = int(time.time())
+    for _ in range(150):
+        # Форварды приходят не по порядку, в одну секунду бывает несколько тиков
+        ts = now - rnd.randint(0, 6 * 3600)
+        records = [{"resource": resource, "buy": round(rnd.uniform(5, 15), 2), "sell": round(rnd.uniform(3, 12), 2),
+                    "quantity": rnd.randint(0, 10 ** 6), "timestamp": ts + rnd.choice((0, 0, 1))}
+                   for resource in rnd.sample(["Дерево", "Камень", "Провизия", "Лошади"], rnd.randint(1, 4))]
+        assert db.ingest_market_snapshot(records) == len(records)
+    incremental = _candles(db)
+    assert incremental
+
+    db.rebuild_candles()
+    assert _candles(db) == incremental
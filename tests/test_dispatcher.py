@@ -0,0 +1,108 @@
+# tests/test_dispatcher.py
+from dispatcher import PRIORITY_ALERT, PRIORITY_INFO, PRIORITY_REMINDER, OutboundDispatcher
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class _TooManyRequests(Exception):
+    error_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too Many Requests: retry after {retry_after}")
+        self.result_json = {"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after}}
+
+
+class _FakeBot:
+    """Записывает отправки; first_429 — сколько первых отправок в чат ответить 429."""
+
+    def __init__(self, clock, first_429=None):
+        self.clock = clock
+        self.sent = []
+        self.first_429 = dict(first_429 or {})
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.first_429.get(chat_id):
+            self.first_429[chat_id] -= 1
+            raise _TooManyRequests(5)
+        self.sent.append((self.clock(), chat_id, text))
+
+
+def _dispatcher(bot, clock, **kwargs):
+    return OutboundDispatcher(bot, clock=clock, **kwargs)
+
+
+def test_alerts_go_before_reminders():
+    clock = _Clock()
+    bot = _FakeBot(clock)
+    d = _dispatcher(bot, clock)
+    d.send(1, "reminder", PRIORITY_REMINDER)
+    d.send(2, "info", PRIORITY_INFO)
+    d.send(3, "alert", PRIORITY_ALERT)
+    d.send(4, "alert 2", PRIORITY_ALERT)
+    assert d.process_pending() == 3
+    assert [text for _, _, text in bot.sent] == ["alert", "alert 2", "info"]
+
+
+def test_global_rate_limit():
+    clock = _Clock()
+    bot = _FakeBot(clock)
+    d = _dispatcher(bot, clock, global_rate=30.0)
+    d.send_many(range(100), "reminder", PRIORITY_REMINDER)
+    for _ in range(1000):
+        d.process_pending()
+        clock.advance(0.01)
+    times = [ts for ts, _, _ in bot.sent]
+    assert len(times) == 100
+    for start in times:
+        # Запас на всплеск — 3 сообщения сверх 30 в секунду
+        assert sum(1 for ts in times if start <= ts < start + 1.0) <= 33
+
+
+def test_per_chat_limit_does_not_hold_other_chats():
+    clock = _Clock()
+    bot = _FakeBot(clock)
+    d = _dispatcher(bot, clock)
+    for i in range(3):
+        d.send(1, f"busy {i}")
+    d.send(2, "other")
+    d.process_pending()
+    assert [(chat, text) for _, chat, text in bot.sent] == [(1, "busy 0"), (2, "other")]
+
+    for _ in range(30):
+        clock.advance(0.1)
+        d.process_pending()
+    busy = [ts for ts, chat, _ in bot.sent if chat == 1]
+    assert len(busy) == 3
+    assert all(b - a >= 1.0 - 1e-9 for a, b in zip(busy, busy[1:]))
+
+
+def test_429_requeues_after_retry_after():
+    clock = _Clock()
+    bot = _FakeBot(clock, first_429={1: 1})
+    d = _dispatcher(bot, clock)
+    results = []
+    d.send(1, "alert", on_done=lambda ok, error: results.append(ok))
+    d.send(2, "other")
+    d.process_pending()
+    assert [chat for _, chat, _ in bot.sent] == [2]
+    assert d.queue_depth() == 1
+    assert results == []
+
+    clock.advance(4.9)
+    d.process_pending()
+    assert [chat for _, chat, _ in bot.sent] == [2]
+
+    clock.advance(0.2)
+    d.process_pending()
+    assert [(chat, text) for _, chat, text in bot.sent] == [(2, "other"), (1, "alert")]
+    assert results == [True]
+    assert d.queue_depth() == 0
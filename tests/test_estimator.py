@@ -0,0 +1,42 @@
+# tests/test_estimator.py
+import math
+import time
+
+import estimator
+
+
+def _ticks(now, count=30, step=60):
+    return [{"resource": "Дерево", "buy": 10.0 + 0.05 * i + 0.01 * math.sin(i), "sell": 8.0 + 0.04 * i,
+             "quantity": 100, "timestamp": now - (count - i) * step} for i in range(count)]
+
+
+def test_ticks_closer_than_min_span_give_no_speed():
+    online = estimator.OnlineEstimators()
+    now = int(time.time())
+    online.update([{"resource": "Дерево", "buy": 10.0, "sell": 8.0, "quantity": 1, "timestamp": now - 3},
+                   {"resource": "Дерево", "buy": 11.0, "sell": 8.0, "quantity": 1, "timestamp": now}])
+    assert online.get("Дерево") is None
+    assert online.ewma("Дерево")[1] is None
+    assert estimator.fit_records([{"timestamp": now - 3, "buy": 10.0}, {"timestamp": now, "buy": 11.0}]) is None
+
+
+def test_warm_start_merges_with_live_ticks(db):
+    now = int(time.time())
+    rows = _ticks(now)
+    db.ingest_market_snapshot(rows[:-1])
+    db.ingest_market_snapshot(rows[-1:])
+
+    expected = estimator.OnlineEstimators()
+    expected.update(rows)
+
+    online = estimator.OnlineEstimators()
+    online.update(rows[-1:])          # живой тик пришёл, пока warm_start читал БД
+    assert online.warm_start() == len(rows) - 1
+
+    got, want = online.get("Дерево"), expected.get("Дерево")
+    assert got.points == want.points == len(rows)
+    for field in ("slope", "intercept", "spread", "confidence"):
+        assert math.isclose(getattr(got, field), getattr(want, field), rel_tol=1e-9, abs_tol=1e-12)
+    # второй прогрев ничего не добавляет
+    assert online.warm_start() == 0
+    assert online.get("Дерево").points == len(rows)
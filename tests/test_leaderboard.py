@@ -0,0 +1,66 @@
+# tests/test_leaderboard.py
+import random
+import threading
+import time
+
+from leaderboard import Leaderboard, leaderboard
+
+
+def _sql_nets(db, start):
+    rows = db._fetchall("""
+        SELECT user_id, SUM(CASE WHEN action='sell' THEN total_gold ELSE -total_gold END) AS net, COUNT(*) AS cnt
+        FROM transactions WHERE timestamp >= ? GROUP BY user_id
+    """, (start,))
+    return {r['user_id']: (r['net'], r['cnt']) for r in rows}
+
+
+def _check(db, board, now):
+    start = now - now % 3600 - 23 * 3600
+    nets = _sql_nets(db, start)
+    expected = sorted(nets, key=lambda u: (-nets[u][0], u))[:10]
+    top = board.top(10, now=now)
+    assert [p['user_id'] for p in top] == expected
+    for p in top:
+        assert abs(p['net_gold'] - nets[p['user_id']][0]) < 1e-6 and p['tx_count'] == nets[p['user_id']][1]
+    for user_id in list(nets) + [10 ** 6]:
+        mine = nets.get(user_id, (0.0, 0))[0]
+        assert board.rank(user_id, now=now) == 1 + sum(1 for net, _ in nets.values() if net > mine + 1e-9)
+
+
+def test_matches_sql_and_slides_window(db):
+    rnd = random.Random(1)
+    now = int(time.time())
+    for _ in range(2000):
+        db.insert_transaction(rnd.randint(1, 150), "Дерево", rnd.choice(["buy", "sell"]), 1, 1.0,
+                              round(rnd.uniform(1, 1000), 2), timestamp=now - rnd.randint(0, 40 * 3600))
+    assert [p['user_id'] for p in db.get_daily_profits()] == [p['user_id'] for p in leaderboard.top(10, now=now)]
+    _check(db, leaderboard, now)
+
+    board = Leaderboard()
+    board.load(db._read_leaderboard, now=now)
+    later = now + 5 * 3600
+    for _ in range(200):
+        ts = later - rnd.randint(0, 3000)
+        user_id, gold = rnd.randint(1, 150), rnd.uniform(1, 500)
+        db.insert_transaction(user_id, "Дерево", "sell", 1, 1.0, gold, timestamp=ts)
+        board.add(db._fetchone("SELECT MAX(id) FROM transactions")[0], user_id, ts, gold, now=later)
+    _check(db, board, later)
+
+
+def test_transaction_during_load_is_counted_once(db):
+    now = int(time.time())
+    db.insert_transaction(1, "Дерево", "sell", 1, 1.0, 100.0, timestamp=now)
+    inserter = threading.Thread(target=db.insert_transaction, args=(2, "Дерево", "sell", 1, 1.0, 50.0),
+                                kwargs={"timestamp": now})
+
+    def fetch():
+        result = db._read_leaderboard()
+        inserter.start()      # сделка коммитится после чтения, add ждёт блокировку загрузки
+        time.sleep(0.1)
+        return result
+
+    leaderboard.ensure_loaded(fetch)
+    inserter.join()
+    # сделка, уже вошедшая в загруженные суммы, повторно не учитывается
+    leaderboard.add(1, 1, now, 100.0)
+    assert {p['user_id']: (p['net_gold'], p['tx_count']) for p in leaderboard.top()} == {1: (100.0, 1), 2: (50.0, 1)}
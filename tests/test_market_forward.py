@@ -0,0 +1,93 @@
+# tests/test_market_forward.py
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import estimator
+import market
+import snapshot
+import tickstore
+
+
+class _Bot:
+    def __init__(self):
+        self.replies = []
+
+    def reply_to(self, message, text, **kwargs):
+        self.replies.append(text)
+
+
+def _forward(text, ts, user_id=555):
+    return SimpleNamespace(text=text, date=ts, forward_date=ts,
+                           forward_from=SimpleNamespace(id=user_id, username="trader"),
+                           forward_sender_name=None)
+
+
+def _text(buy, sell):
+    return f"🎪 Рынок\nДерево: 1 000 🪵\n📈 Купить/продать: {buy:.2f}/{sell:.2f}💰"
+
+
+@pytest.fixture
+def forward_env(db, monkeypatch, tmp_path):
+    """Свежие снимок, столбцы и онлайн-оценки вместо синглтонов процесса."""
+    snap = snapshot.MarketSnapshot()
+    online = estimator.OnlineEstimators()
+    store = tickstore.TickStore(str(tmp_path / "ticks"))
+    monkeypatch.setattr(market, "market_snapshot", snap)
+    monkeypatch.setattr(market, "tick_store", store)
+    monkeypatch.setattr(estimator, "online_estimates", online)
+    monkeypatch.setattr(market, "_recent_forwards", type(market._recent_forwards)())
+    return SimpleNamespace(db=db, snapshot=snap, online=online, store=store, bot=_Bot())
+
+
+def test_subscribers_see_estimates_of_published_tick(forward_env):
+    seen = []
+
+    def on_update(resources, version):
+        series = forward_env.online._series.get(("Дерево", "buy"))
+        seen.append((forward_env.snapshot.get_latest("Дерево")["timestamp"], series.last_ts if series else None))
+
+    forward_env.snapshot.subscribe(on_update)
+    now = int(time.time())
+    for i, ts in enumerate((now - 1200, now - 600, now)):
+        market.handle_market_forward(forward_env.bot, _forward(_text(8.0 + i, 6.0 + i), ts))
+
+    assert [ts for ts, _ in seen] == [now - 1200, now - 600, now]
+    assert all(ts == last_ts for ts, last_ts in seen)
+
+
+def test_subscribers_see_tick_store_with_published_tick(forward_env):
+    seen = []
+    forward_env.snapshot.subscribe(
+        lambda resources, version: seen.append(forward_env.store.week_stats(0)["Дерево"]["max_buy"]))
+    now = int(time.time())
+    market.handle_market_forward(forward_env.bot, _forward(_text(8.0, 6.0), now - 600))
+    market.handle_market_forward(forward_env.bot, _forward(_text(9.5, 7.0), now))
+
+    assert seen == [8.0, 9.5]
+
+
+def _counts(db):
+    return {table: db._fetchone(f"SELECT COUNT(*) AS n FROM {table}")['n'] for table in ("market", "history", "market_candles")}
+
+
+def test_duplicate_forward_skips_writes(forward_env, monkeypatch):
+    db, bot = forward_env.db, forward_env.bot
+    now = int(time.time())
+    market.handle_market_forward(bot, _forward(_text(8.0, 6.0), now))
+    saved = _counts(db)
+    version = forward_env.snapshot.version
+
+    # Тот же форвард от другого игрока с тем же бонусом и после перезапуска (пустой LRU)
+    market.handle_market_forward(bot, _forward(_text(8.0, 6.0), now, user_id=556))
+    monkeypatch.setattr(market, "_recent_forwards", type(market._recent_forwards)())
+    market.handle_market_forward(bot, _forward(_text(8.0, 6.0), now))
+
+    assert _counts(db) == saved
+    assert forward_env.snapshot.version == version
+    assert bot.replies[0].startswith("✅ Сохранено")
+    assert all("уже сохранены" in reply for reply in bot.replies[1:])
+
+    market.handle_market_forward(bot, _forward(_text(8.5, 6.0), now))
+    assert _counts(db)["market"] == saved["market"] + 1
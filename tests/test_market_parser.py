@@ -0,0 +1,28 @@
+# tests/test_market_parser.py
+import pytest
+
+import market
+from legacy_market_parser import _parse_market_message_lines as legacy_parse
+from market_corpus import REAL_MESSAGES, fuzzed_messages
+
+
+@pytest.mark.parametrize("text", REAL_MESSAGES)
+def test_parity_on_real_messages(text):
+    assert market._parse_market_message_lines(text) == legacy_parse(text)
+
+
+def test_parity_on_fuzzed_messages():
+    mismatches = [t for t in fuzzed_messages() if market._parse_market_message_lines(t) != legacy_parse(t)]
+    assert not mismatches, mismatches[:3]
+
+
+def test_all_formats_are_parsed():
+    parsed = market._parse_market_message_lines(REAL_MESSAGES[0])
+    assert parsed == {
+        "Дерево": {"buy": 8.31, "sell": 6.80, "quantity": 96342449},
+        "Камень": {"buy": 3.10, "sell": 2.05, "quantity": 12000},
+        "Провизия": {"buy": 4.50, "sell": 3.20, "quantity": 1234},
+        "Лошади": {"buy": 120.5, "sell": 99.9, "quantity": 77},
+    }
+    combined = market._parse_market_message_lines(REAL_MESSAGES[3])
+    assert combined["Камень"] == {"buy": 3.10, "sell": 2.00, "quantity": 1}
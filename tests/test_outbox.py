@@ -0,0 +1,34 @@
+# tests/test_outbox.py
+import outbox
+
+
+class _RecordingDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, chat_id, text, priority=0, on_done=None, **kwargs):
+        self.sent.append(text)
+        on_done(True, None)
+
+    def queue_depth(self):
+        return 0
+
+
+def test_duplicate_key_is_enqueued_once(db):
+    db.enqueue_outbox([outbox.message("alert:1:final:7", 7, "reached")])
+    db.enqueue_outbox([outbox.message("alert:1:final:7", 7, "reached again")])
+    dispatcher = _RecordingDispatcher()
+    assert outbox.OutboxWorker(dispatcher).drain_once() == 1
+    assert dispatcher.sent == ["reached"]
+
+
+def test_in_flight_rows_are_not_resent_after_restart(db):
+    db.enqueue_outbox([outbox.message("a", 7, "first"), outbox.message("b", 7, "second")])
+    # Процесс упал после claim: сообщения могли уйти, а mark_outbox_sent не выполнился
+    assert len(db.claim_outbox_batch()) == 2
+
+    assert db.abandon_outbox_in_flight() == 2
+    dispatcher = _RecordingDispatcher()
+    assert outbox.OutboxWorker(dispatcher).drain_once() == 0
+    assert dispatcher.sent == []
+    assert db.get_outbox_stats()["unknown"] == 2
@@ -0,0 +1,57 @@
+# tests/test_profit_alerts.py
+import logging
+import time
+
+import pytest
+
+import alerts
+import outbox
+from alert_index import profit_alert_index
+from snapshot import market_snapshot
+
+
+class _FailingDispatcher:
+    def send(self, chat_id, text, priority=0, on_done=None, **kwargs):
+        on_done(False, RuntimeError("chat not found"))
+
+    def queue_depth(self):
+        return 0
+
+
+@pytest.fixture
+def profit_db(db):
+    db.load_profit_alert_index()
+    market_snapshot.load()
+    db.upsert_profit_alert(-100, "Дерево", 8.0, 10)
+    market_snapshot.update([{"resource": "Дерево", "buy": 7.5, "sell": 6.0, "quantity": 50,
+                             "timestamp": int(time.time())}])
+    return db
+
+
+def _matching(resource="Дерево"):
+    return [a["chat_id"] for a in profit_alert_index.matching(resource, 7.5, 50)]
+
+
+def test_db_failure_is_logged_and_alert_stays_active(profit_db, monkeypatch, caplog):
+    def broken(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(profit_db, "deactivate_profit_alert", broken)
+    with caplog.at_level(logging.ERROR, logger="alerts"):
+        assert alerts.fire_profit_alerts(None, ["Дерево"]) == 0
+    assert "Ошибка группового алерта" in caplog.text
+    assert _matching() == [-100]
+
+
+def test_undelivered_notification_restores_alert(profit_db):
+    assert alerts.fire_profit_alerts(None, ["Дерево"]) == 1
+    assert _matching() == []
+
+    worker = outbox.OutboxWorker(_FailingDispatcher())
+    worker.on_failed("buyalert", alerts._restore_undelivered_profit_alert)
+    with profit_db.transaction() as c:
+        c.execute("UPDATE outbox SET attempts=?", (outbox.MAX_ATTEMPTS - 1,))
+    assert worker.drain_once() == 1
+
+    assert _matching() == [-100]
+    assert profit_db.get_chat_profit_alerts(-100)[0]["threshold_price"] == 8.0
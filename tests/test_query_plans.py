@@ -0,0 +1,66 @@
+# tests/test_query_plans.py
+"""
+Горячие запросы не должны читать таблицы полным проходом. SQL перехватывается
+из самих функций database (set_trace_callback), а план каждого SELECT
+проверяется через EXPLAIN QUERY PLAN.
+"""
+import re
+import time
+
+# Таблицы, растущие со временем: полный проход по ним недопустим
+GROWING_TABLES = {"market", "alerts", "transactions", "chat_profit_alerts", "users", "chats",
+                  "market_candles", "leaderboard_hourly", "outbox"}
+FULL_SCAN = re.compile(r"^SCAN (?:\w+\.)?(\w+)(?: AS \w+)?$")
+
+
+def _hot_queries(db):
+    now = int(time.time())
+    db.ingest_market_snapshot([
+        {"resource": r, "buy": 10.0, "sell": 9.0, "quantity": 100, "timestamp": now}
+        for r in ("Дерево", "Камень")
+    ])
+    db.insert_alert_record(1, "Дерево", 12.0, "up", 0.5, 10.0, "2026-01-01 00:00:00")
+    db.upsert_profit_alert(-100, "Камень", 8.0, 10)
+    db.insert_transaction(1, "Дерево", "sell", 5, 10.0, 50.0, timestamp=now)
+
+    return [
+        lambda: db.get_latest_market("Дерево"),
+        lambda: db.get_recent_market("Дерево"),
+        lambda: db.get_recent_market_many(["Дерево", "Камень"], now - 900),
+        lambda: db.get_market_range("Дерево", now - 3600),
+        lambda: db.get_market_candles("Дерево", now - 24 * 3600, interval=3600),
+        lambda: db.get_week_stats(now - 7 * 24 * 3600 + 123),
+        lambda: db.get_active_alerts(),
+        lambda: db.get_active_alerts_for_resources(["Дерево"]),
+        lambda: db.get_user_active_alerts(1),
+        lambda: db.get_chat_profit_alerts(-100),
+        lambda: db.get_user_transactions(1),
+        lambda: db.load_leaderboard(),
+        lambda: db.claim_due_reminders("users", now),
+        lambda: db.claim_due_reminders("chats", now),
+    ]
+
+
+def _captured_selects(db, calls):
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        for call in calls:
+            call()
+    finally:
+        conn.set_trace_callback(None)
+    return [s for s in statements if re.match(r"\s*(SELECT|WITH)\b", s, re.I)]
+
+
+def test_hot_queries_use_indexes(db):
+    selects = _captured_selects(db, _hot_queries(db))
+    assert selects
+    conn = db.get_connection()
+    offenders = []
+    for sql in selects:
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+            m = FULL_SCAN.match(row[3])
+            if m and m.group(1) in GROWING_TABLES:
+                offenders.append((row[3], " ".join(sql.split())))
+    assert not offenders, offenders
@@ -0,0 +1,40 @@
+# tests/test_scheduler.py
+import threading
+import time
+
+from scheduler import COMPACT_MIN_HEAP, TimerScheduler
+
+
+def test_reschedule_does_not_grow_heap():
+    scheduler = TimerScheduler()
+    far = time.time() + 3600
+    for alert_id in range(10):
+        scheduler.schedule(alert_id, far + alert_id)
+    for i in range(10000):
+        scheduler.reschedule(i % 10, far + i)
+    assert len(scheduler) == 10
+    assert len(scheduler._heap) <= max(COMPACT_MIN_HEAP, 2 * len(scheduler)) + 1
+    for alert_id in range(10):
+        scheduler.cancel(alert_id)
+    assert len(scheduler._heap) <= COMPACT_MIN_HEAP + 1
+
+
+def test_timers_fire_in_order_after_compaction():
+    scheduler = TimerScheduler()
+    fired = []
+    done = threading.Event()
+
+    def callback(alert_id):
+        fired.append(alert_id)
+        if len(fired) == 3:
+            done.set()
+
+    now = time.time()
+    for i in range(500):
+        scheduler.schedule(i % 3, now + 3600 + i)
+    scheduler.schedule(2, now + 0.05)
+    scheduler.schedule(0, now + 0.10)
+    scheduler.schedule(1, now + 0.15)
+    scheduler.start(callback)
+    assert done.wait(5)
+    assert fired == [2, 0, 1]
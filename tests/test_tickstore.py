@@ -0,0 +1,40 @@
+# tests/test_tickstore.py
+import struct
+
+from tickstore import HEADER_FORMAT, TickStore, np
+
+
+def _rows(start, count):
+    return [{"resource": "Дерево", "timestamp": start + i * 60, "buy": 8.0 + i / 100, "sell": 6.0 + i / 100,
+             "quantity": 1000 - i} for i in range(count)]
+
+
+def test_append_reopen_and_range(tmp_path):
+    store = TickStore(str(tmp_path))
+    rows = _rows(1_000_000, 5000)    # больше начальной ёмкости — файлы растут
+    assert store.append(rows) == 5000
+
+    reopened = TickStore(str(tmp_path))
+    sl = reopened.range("Дерево", 1_000_000 + 100 * 60, 1_000_000 + 200 * 60)
+    assert sl.size == 100
+    assert sl.records(last=1) == [{k: v for k, v in rows[199].items() if k != "resource"}]
+    # заголовок и столбцы в одном (нативном) порядке байтов
+    with open(tmp_path / "Дерево.timestamp", "rb") as f:
+        assert struct.unpack(HEADER_FORMAT, f.read(8))[0] == 5000
+    if np is not None:
+        assert sl.array("timestamp").tolist() == list(sl.timestamp)
+        assert sl.array("buy").tolist() == list(sl.buy)
+
+
+def test_week_stats_match_database(db, tmp_path):
+    rows = _rows(2_000_000, 300)
+    db.ingest_market_snapshot(rows)
+    store = TickStore(str(tmp_path))
+    assert store.sync_from_db() == 300
+    week_start = 2_000_000 + 50 * 60 + 1
+    expected = db._fetchone("""
+        SELECT MIN(buy), MAX(buy), MIN(sell), MAX(sell), MAX(quantity) FROM market
+        WHERE resource='Дерево' AND timestamp>=?
+    """, (week_start,))
+    stats = store.week_stats(week_start)["Дерево"]
+    assert (stats["min_buy"], stats["max_buy"], stats["min_sell"], stats["max_sell"], stats["max_qty"]) == tuple(expected)
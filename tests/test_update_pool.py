@@ -0,0 +1,84 @@
+# tests/test_update_pool.py
+import threading
+import time
+
+import telebot
+from telebot import types
+
+import update_pool
+
+
+def _update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "u"},
+            "text": f"msg {update_id}",
+        },
+    })
+
+
+def test_polling_offset_advances_on_receipt():
+    bot = telebot.TeleBot("1:test", threaded=False)
+    handled = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    @bot.message_handler(func=lambda m: True)
+    def on_message(message):
+        release.wait(5)  # воркеры ещё заняты, когда приходит следующий опрос
+        with lock:
+            handled.append(message.message_id)
+
+    # Сервер Telegram отдаёт все обновления с update_id >= offset
+    server = [_update(1, 10), _update(2, 20), _update(3, 10)]
+    offsets = []
+
+    def get_updates(offset=None, **kwargs):
+        offsets.append(offset)
+        return [u for u in server if u.update_id >= offset]
+
+    bot.get_updates = get_updates
+    pool = update_pool.attach(bot, workers=2, queue_size=10)
+
+    bot._TeleBot__retrieve_updates(timeout=0, long_polling_timeout=0)
+    bot._TeleBot__retrieve_updates(timeout=0, long_polling_timeout=0)
+    release.set()
+    assert pool.join(timeout=5)
+
+    assert offsets == [1, 4]
+    assert sorted(handled) == [1, 2, 3]
+
+
+def test_chat_order_kept_and_slow_chat_does_not_block_others():
+    handled = {1: [], 2: []}
+    slow_started = threading.Event()
+    release = threading.Event()
+
+    def process(updates):
+        for update in updates:
+            chat_id = update.message.chat.id
+            if update.update_id == 1:
+                slow_started.set()
+                release.wait(5)  # долгий /stat в чате 1
+            handled[chat_id].append(update.update_id)
+
+    pool = update_pool.ShardedUpdatePool(process, workers=2, queue_size=100)
+    pool.start()
+    pool.submit([_update(i, 1 if i % 3 else 2) for i in range(1, 61)])
+
+    assert slow_started.wait(5)
+    for _ in range(500):
+        if len(handled[2]) == 20:
+            break
+        time.sleep(0.01)
+    # Чат 2 обработан целиком, пока чат 1 стоит на первом обновлении
+    assert handled[2] == [i for i in range(1, 61) if i % 3 == 0]
+    assert handled[1] == []
+
+    release.set()
+    assert pool.join(timeout=5)
+    assert handled[1] == [i for i in range(1, 61) if i % 3]
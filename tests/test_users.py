@@ -0,0 +1,11 @@
+# tests/test_users.py
+import users
+
+
+def test_bonus_lookup_registers_new_user(db):
+    assert users.get_user_bonus(42) == 0.0
+    assert db.get_user(42) is not None
+    # после регистрации запись в БД и кэш совпадают
+    db.update_user_field(42, 'anchor', 1)
+    assert db.get_user_settings(42)['anchor'] == 1
+    assert db.get_user(42)['anchor'] == 1
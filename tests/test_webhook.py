@@ -0,0 +1,74 @@
+# tests/test_webhook.py
+import http.client
+import json
+
+import pytest
+
+import webhook
+
+
+class _Bot:
+    def __init__(self):
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        self.updates.extend(updates)
+
+
+@pytest.fixture
+def server():
+    bot = _Bot()
+    srv = webhook.WebhookServer(bot, host="127.0.0.1", port=0, secret="s3cret")
+    srv.start()
+    yield srv, bot
+    srv.shutdown()
+
+
+def _post(srv, body: bytes, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", srv.port, timeout=5)
+    conn.putrequest("POST", webhook.WEBHOOK_PATH)
+    for name, value in (headers or {}).items():
+        conn.putheader(name, value)
+    conn.endheaders(body)
+    status = conn.getresponse().status
+    conn.close()
+    return status
+
+
+def _headers(body: bytes, **extra):
+    return {webhook.SECRET_HEADER: "s3cret", "Content-Length": str(len(body)), **extra}
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        webhook.WebhookServer(_Bot(), host="127.0.0.1", port=0, secret="")
+
+
+def test_valid_update_is_dispatched(server):
+    srv, bot = server
+    body = json.dumps({"update_id": 7}).encode()
+    assert _post(srv, body, _headers(body)) == 200
+    assert [u.update_id for u in bot.updates] == [7]
+
+
+def test_wrong_secret_is_rejected(server):
+    srv, bot = server
+    body = json.dumps({"update_id": 7}).encode()
+    assert _post(srv, body, _headers(body, **{webhook.SECRET_HEADER: "nope"})) == 403
+    assert bot.updates == []
+
+
+@pytest.mark.parametrize("body, length", [
+    (b"[]", None),
+    (b"123", None),
+    (b"{not json", None),
+    (b'{"message": {}}', None),
+    (b"{}", "abc"),
+])
+def test_malformed_requests_get_400(server, body, length):
+    srv, bot = server
+    headers = _headers(body)
+    if length is not None:
+        headers["Content-Length"] = length
+    assert _post(srv, body, headers) == 400
+    assert bot.updates == []
@@ -0,0 +1,223 @@
+# tickstore.py
+import logging
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import database
+
+try:
+    import numpy as np
+except ImportError:  # numpy не обязателен: без него агрегаты считаются по memoryview
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Каталог столбцового хранилища; пустая строка — хранилище выключено
+TICKSTORE_DIR = os.getenv("TICKSTORE_DIR", "")
+INITIAL_CAPACITY = 4096
+HEADER_SIZE = 8  # число записей (int64) в начале файла timestamp; выравнивает данные по 8 байт
+# Всё хранится в порядке байтов хоста: memoryview.cast умеет только нативный порядок,
+# поэтому заголовок и dtype numpy тоже нативные. Файлы не переносимы между
+# машинами с разным порядком байтов — при переносе хранилище пересобирается из БД.
+HEADER_FORMAT = "=q"
+
+# (столбец, формат memoryview / struct, dtype numpy)
+COLUMNS = (("timestamp", "q", "=i8"), ("buy", "d", "=f8"), ("sell", "d", "=f8"), ("quantity", "q", "=i8"))
+
+
+def _min(values):
+    return min(values) if np is None else values.min()
+
+
+def _max(values):
+    return max(values) if np is None else values.max()
+
+
+class TickSlice(NamedTuple):
+    """Срез ряда по времени: memoryview на отображённые файлы, без копирования."""
+    timestamp: memoryview
+    buy: memoryview
+    sell: memoryview
+    quantity: memoryview
+
+    @property
+    def size(self) -> int:
+        return len(self.timestamp)
+
+    def array(self, column: str):
+        """Столбец как numpy-массив поверх того же буфера (или memoryview без numpy)."""
+        view = getattr(self, column)
+        if np is None:
+            return view
+        dtype = next(d for name, _, d in COLUMNS if name == column)
+        return np.frombuffer(view, dtype=dtype)
+
+    def records(self, last: Optional[int] = None) -> List[Dict]:
+        """Последние last записей (или все) в виде словарей, как строки market."""
+        start = 0 if last is None else max(0, self.size - last)
+        return [
+            {"timestamp": self.timestamp[i], "buy": self.buy[i], "sell": self.sell[i], "quantity": self.quantity[i]}
+            for i in range(start, self.size)
+        ]
+
+
+class _Column:
+    def __init__(self, path: str, fmt: str, capacity: int):
+        self.fmt = fmt
+        self.itemsize = struct.calcsize(fmt)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        self.capacity = max(capacity, (size - HEADER_SIZE) // self.itemsize if size > HEADER_SIZE else 0)
+        self._map()
+
+    def _map(self) -> None:
+        size = HEADER_SIZE + self.capacity * self.itemsize
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        # Старое отображение не закрываем: читатели могут держать срезы на него,
+        # данные в нём те же — это тот же файл
+        self.mm = mmap.mmap(self.fd, size)
+        self.view = memoryview(self.mm)[HEADER_SIZE:].cast(self.fmt)
+
+    def grow(self, needed: int) -> None:
+        while self.capacity < needed:
+            self.capacity *= 2
+        self._map()
+
+
+class ColumnSeries:
+    """
+    Ряд тиков одного ресурса: по файлу на столбец, фиксированная ширина записи,
+    только дописывание в конец по возрастанию timestamp. Число записей хранится
+    в заголовке файла timestamp и обновляется после записи значений, поэтому
+    читатель без блокировки всегда видит согласованный префикс.
+    """
+
+    def __init__(self, directory: str, resource: str, capacity: int = INITIAL_CAPACITY):
+        base = os.path.join(directory, resource.replace(os.sep, "_"))
+        self.resource = resource
+        self._columns = {name: _Column(f"{base}.{name}", fmt, capacity) for name, fmt, _ in COLUMNS}
+        self._ts = self._columns["timestamp"]
+        self._count = struct.unpack_from(HEADER_FORMAT, self._ts.mm, 0)[0]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def last_timestamp(self) -> Optional[int]:
+        return self._ts.view[self._count - 1] if self._count else None
+
+    def append(self, rows: Iterable[Dict]) -> int:
+        """Дописывает тики; записи старше последней пропускаются (порядок по времени). Вызывать под блокировкой."""
+        count = self._count
+        last = self.last_timestamp()
+        added = 0
+        for r in rows:
+            ts = int(r['timestamp'])
+            if last is not None and ts < last:
+                continue
+            if count + 1 > self._ts.capacity:
+                for column in self._columns.values():
+                    column.grow(count + 1)
+            for name, column in self._columns.items():
+                column.view[count] = int(r[name]) if column.fmt == "q" else float(r[name])
+            count += 1
+            last = ts
+            added += 1
+        if added:
+            struct.pack_into(HEADER_FORMAT, self._ts.mm, 0, count)
+            self._count = count
+        return added
+
+    def range(self, since: int, until: Optional[int] = None) -> TickSlice:
+        """Срез [since, until) двоичным поиском по timestamp."""
+        n = self._count
+        ts = self._ts.view
+        lo = bisect_left(ts, since, 0, n)
+        hi = n if until is None else bisect_left(ts, until, lo, n)
+        return TickSlice(*(self._columns[name].view[lo:hi] for name, _, _ in COLUMNS))
+
+    def flush(self) -> None:
+        for column in self._columns.values():
+            column.mm.flush()
+
+
+class TickStore:
+    """
+    Необязательное столбцовое хранилище тиков на mmap-файлах (по ряду на ресурс).
+    Пополняется при приёме форвардов рядом с SQLite, которая остаётся источником
+    истины; при старте догружает из БД то, чего в файлах ещё нет (sync_from_db).
+    """
+
+    def __init__(self, directory: str = TICKSTORE_DIR):
+        self.directory = directory
+        self._series: Dict[str, ColumnSeries] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _get(self, resource: str) -> ColumnSeries:
+        series = self._series.get(resource)
+        if series is None:
+            with self._lock:
+                series = self._series.get(resource)
+                if series is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    series = self._series[resource] = ColumnSeries(self.directory, resource)
+        return series
+
+    def append(self, records: Iterable[Dict]) -> int:
+        if not self.enabled:
+            return 0
+        by_resource: Dict[str, List[Dict]] = {}
+        for r in records:
+            by_resource.setdefault(r['resource'], []).append(r)
+        added = 0
+        for resource, rows in by_resource.items():
+            series = self._get(resource)
+            with self._lock:
+                added += series.append(sorted(rows, key=lambda r: r['timestamp']))
+        return added
+
+    def range(self, resource: str, since: int, until: Optional[int] = None) -> TickSlice:
+        return self._get(resource).range(since, until)
+
+    def resources(self) -> List[str]:
+        return list(self._series)
+
+    def sync_from_db(self) -> int:
+        """Догружает из БД тики новее последних записанных в файлы. Возвращает число добавленных."""
+        added = 0
+        for latest in database.get_latest_market_per_resource():
+            series = self._get(latest['resource'])
+            last = series.last_timestamp()
+            rows = database.get_market_range(latest['resource'], 0 if last is None else last + 1)
+            with self._lock:
+                added += series.append(rows)
+        for series in self._series.values():
+            series.flush()
+        logger.info(f"Столбцовое хранилище: догружено из БД {added} тиков")
+        return added
+
+    def week_stats(self, week_start: int) -> Dict[str, Dict]:
+        """То же, что database.get_week_stats, но прямо по столбцам."""
+        stats = {}
+        for resource in self.resources():
+            sl = self.range(resource, week_start)
+            if not sl.size:
+                continue
+            buy, sell, qty = sl.array("buy"), sl.array("sell"), sl.array("quantity")
+            stats[resource] = {
+                "min_buy": float(_min(buy)), "max_buy": float(_max(buy)),
+                "min_sell": float(_min(sell)), "max_sell": float(_max(sell)),
+                "max_qty": int(_max(qty)),
+            }
+        return stats
+
+
+tick_store = TickStore()
@@ -0,0 +1,164 @@
+# update_pool.py
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Число воркеров и глубина очереди каждого шарда
+POOL_WORKERS = int(os.getenv("BOT_WORKERS", "8"))
+POOL_QUEUE_SIZE = int(os.getenv("BOT_WORKER_QUEUE", "1000"))
+STATS_INTERVAL = 60
+LATENCY_SAMPLES = 2000
+
+
+def update_chat_id(update) -> int:
+    """Ключ шардирования: id чата, иначе id пользователя, иначе update_id."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+    callback = getattr(update, "callback_query", None)
+    if callback is not None:
+        if callback.message is not None:
+            return callback.message.chat.id
+        return callback.from_user.id
+    for field in ("inline_query", "chosen_inline_result", "my_chat_member", "chat_member", "chat_join_request"):
+        event = getattr(update, field, None)
+        if event is not None:
+            chat = getattr(event, "chat", None)
+            return chat.id if chat is not None else event.from_user.id
+    return update.update_id
+
+
+class _Shard:
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+
+class ShardedUpdatePool:
+    """
+    Пул воркеров для входящих обновлений. Обновление попадает в шард chat_id % workers,
+    и каждый шард обрабатывается одним потоком по порядку: внутри чата сохраняется
+    очерёдность (register_next_step_handler видит ответ после своего вопроса),
+    а разные чаты идут параллельно. Очереди ограничены: при переполнении submit
+    ждёт, и источник обновлений (polling, webhook) естественно притормаживает.
+    """
+
+    def __init__(self, process: Callable[[list], None], workers: int = POOL_WORKERS,
+                 queue_size: int = POOL_QUEUE_SIZE):
+        self._process = process
+        self._shards = [_Shard(i, queue_size) for i in range(max(1, workers))]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+
+    @property
+    def workers(self) -> int:
+        return len(self._shards)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for shard in self._shards:
+                t = threading.Thread(target=self._run, args=(shard,), name=f"updates-{shard.index}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            threading.Thread(target=self._stats_loop, name="updates-stats", daemon=True).start()
+
+    def submit(self, updates: list) -> None:
+        """Раскладывает обновления по шардам; блокируется, если очередь шарда заполнена."""
+        for update in updates:
+            shard = self._shards[update_chat_id(update) % len(self._shards)]
+            shard.queue.put(update)
+            depth = shard.queue.qsize()
+            if depth > shard.max_depth:
+                shard.max_depth = depth
+            self.submitted += 1
+
+    def queue_depth(self) -> int:
+        return sum(shard.queue.qsize() for shard in self._shards)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт, пока все поставленные обновления будут обработаны (для тестов и остановки)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for shard in self._shards:
+            while shard.queue.unfinished_tasks:
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+                time.sleep(0.01)
+        return True
+
+    def stats(self) -> dict:
+        samples = sorted(x for shard in self._shards for x in shard.latencies)
+        pct = lambda p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000 if samples else 0.0
+        return {
+            "workers": len(self._shards),
+            "submitted": self.submitted,
+            "processed": sum(shard.processed for shard in self._shards),
+            "errors": sum(shard.errors for shard in self._shards),
+            "queue_depth": [shard.queue.qsize() for shard in self._shards],
+            "max_depth": max(shard.max_depth for shard in self._shards),
+            "p50_ms": pct(50),
+            "p99_ms": pct(99),
+        }
+
+    def _run(self, shard: _Shard) -> None:
+        while True:
+            update = shard.queue.get()
+            started = time.perf_counter()
+            try:
+                self._process([update])
+            except Exception:
+                shard.errors += 1
+                logger.exception(f"Ошибка при обработке обновления {update.update_id}")
+            finally:
+                shard.latencies.append(time.perf_counter() - started)
+                shard.processed += 1
+                shard.queue.task_done()
+
+    def _stats_loop(self) -> None:
+        last = 0
+        while True:
+            time.sleep(STATS_INTERVAL)
+            stats = self.stats()
+            if stats["submitted"] == last:
+                continue
+            last = stats["submitted"]
+            logger.info(
+                f"Пул обновлений: воркеров {stats['workers']}, обработано {stats['processed']}, "
+                f"ошибок {stats['errors']}, очередь {sum(stats['queue_depth'])} (макс. {stats['max_depth']}), "
+                f"p50 {stats['p50_ms']:.1f} мс, p99 {stats['p99_ms']:.1f} мс"
+            )
+
+
+def attach(bot, workers: int = POOL_WORKERS, queue_size: int = POOL_QUEUE_SIZE) -> ShardedUpdatePool:
+    """
+    Подключает пул к TeleBot(threaded=False): polling и webhook вызывают
+    bot.process_new_updates, который теперь только раскладывает обновления по шардам,
+    а исходный обработчик реестра выполняется в воркерах. bot.last_update_id
+    сдвигается сразу при получении обновлений.
+    """
+    pool = ShardedUpdatePool(bot.process_new_updates, workers, queue_size)
+
+    def receive(updates: list) -> None:
+        # Смещение polling сдвигается при получении, а не после обработки в воркере:
+        # иначе следующий get_updates запросит те же обновления ещё раз
+        for update in updates:
+            if update.update_id > bot.last_update_id:
+                bot.last_update_id = update.update_id
+        pool.submit(updates)
+
+    bot.process_new_updates = receive
+    pool.start()
+    return pool
@@ -32,16 +32,22 @@ def set_user_bonus(user_id: int, bonus: float) -> None:
 def get_user_bonus(user_id: int) -> float:
     """
     Возвращает бонус пользователя в виде float.
+    Читает из кэша настроек; при промахе — один SELECT (и регистрация нового пользователя).
     """
     try:
-        ensure_user(user_id)
-        user = database.get_user(user_id)
-        return float(user.get('bonus', 0.0)) if user else 0.0
+        return float(database.get_user_settings(user_id).get('bonus') or 0.0)
     except Exception:
         logger.exception(f"Ошибка при get_user_bonus {user_id}")
         return 0.0
 
 
+def adjust_prices_for_bonus(bonus: float, base_buy: float, base_sell: float) -> Tuple[float, float]:
+    """Базовые цены, пересчитанные под бонус (то, что видит игрок с этим бонусом)."""
+    adj_buy = base_buy / (1 + bonus) if bonus else base_buy
+    adj_sell = base_sell / (1 + bonus) if bonus else base_sell
+    return float(round(adj_buy, 6)), float(round(adj_sell, 6))
+
+
 def adjust_prices_for_user(user_id: Optional[int], base_buy: float, base_sell: float) -> Tuple[float, float]:
     """
     Корректирует базовые цены для пользователя с учётом его бонуса.
@@ -49,9 +55,7 @@ def adjust_prices_for_user(user_id: Optional[int], base_buy: float, base_sell: f
     """
     try:
         bonus = get_user_bonus(user_id) if user_id is not None else 0.0
-        adj_buy = base_buy / (1 + bonus) if bonus else base_buy
-        adj_sell = base_sell / (1 + bonus) if bonus else base_sell
-        return float(round(adj_buy, 6)), float(round(adj_sell, 6))
+        return adjust_prices_for_bonus(bonus, base_buy, base_sell)
     except Exception:
         logger.exception(f"Ошибка при adjust_prices_for_user {user_id}")
         return base_buy, base_sell
@@ -84,7 +88,6 @@ def get_user_notify_settings(user_id: int) -> Tuple[bool, int]:
     Возвращает кортеж: (уведомления включены?, интервал в минутах)
     """
     try:
-        ensure_user(user_id)
         settings = database.get_user_push_settings(user_id)
         return settings['enabled'], settings['interval']
     except Exception:
@@ -0,0 +1,147 @@
+# webhook.py
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, List, Optional
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")            # публичный https-адрес, который отдаётся Telegram
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")    # обязателен: без него endpoint принимал бы чужие обновления
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1024 * 1024
+LATENCY_SAMPLES = 10000
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Стандартная очередь accept (5) под всплеском даёт повтор SYN и секундные задержки
+    request_queue_size = 128
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class WebhookServer:
+    """
+    Встроенный HTTP-сервер для режима webhook. Принимает POST от Telegram на path,
+    сверяет секретный заголовок и передаёт обновление в dispatch — по умолчанию
+    bot.process_new_updates, то есть в тот же реестр обработчиков, что и polling.
+    Без секрета сервер не создаётся.
+
+    stats() считает время приёма: сколько занял вызов dispatch. При подключённом
+    update_pool это постановка в очередь шарда, а время работы обработчиков —
+    в update_pool.ShardedUpdatePool.stats().
+    """
+
+    def __init__(self, bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                 secret: str = WEBHOOK_SECRET, dispatch: Optional[Callable[[list], None]] = None):
+        if not secret:
+            raise ValueError("Для режима webhook нужен WEBHOOK_SECRET")
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.dispatch = dispatch or bot.process_new_updates
+        # Время приёма одного обновления (с): вызов dispatch до ответа Telegram
+        self.intake_latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.received = 0
+        self.rejected = 0
+        self._httpd = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+                if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ""), server.secret):
+                    server.rejected += 1
+                    return self._reply(403)
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    if length <= 0 or length > MAX_BODY_SIZE:
+                        return self._reply(400)
+                    payload = json.loads(self.rfile.read(length))
+                    if not isinstance(payload, dict):
+                        return self._reply(400)
+                    update = types.Update.de_json(payload)
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    return self._reply(400)
+                server.handle(update)
+                self._reply(200)
+
+            def _reply(self, code: int):
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+        return Handler
+
+    def handle(self, update) -> None:
+        self.received += 1
+        started = time.perf_counter()
+        try:
+            self.dispatch([update])
+        except Exception:
+            logger.exception(f"Ошибка при обработке обновления {update.update_id}")
+        finally:
+            self.intake_latencies.append(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        samples = list(self.intake_latencies)
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "intake_p50_ms": percentile(samples, 50) * 1000,
+            "intake_p99_ms": percentile(samples, 99) * 1000,
+        }
+
+    def start(self) -> None:
+        """Запускает сервер в фоновом потоке (для тестов и встраивания)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="webhook", daemon=True)
+            self._thread.start()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def run(bot, url: str = WEBHOOK_URL, dispatch: Optional[Callable[[list], None]] = None) -> None:
+    """Регистрирует webhook у Telegram и обслуживает входящие обновления до остановки процесса."""
+    if not url:
+        raise ValueError("Для режима webhook нужен WEBHOOK_URL")
+    server = WebhookServer(bot, dispatch=dispatch)
+    bot.remove_webhook()
+    bot.set_webhook(url=url.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    logger.info(f"Webhook слушает {WEBHOOK_HOST}:{server.port}{WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
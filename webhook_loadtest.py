@@ -0,0 +1,115 @@
+# webhook_loadtest.py
+"""
+Нагрузочный тест режима webhook.
+
+Поднимает локальный WebhookServer с реестром обработчиков за update_pool, как в
+боевом режиме (или бьёт в уже запущенный по --url), шлёт записанные обновления
+POST-запросами в несколько потоков и печатает p50/p99 времени ответа, времени
+приёма (постановка в очередь пула) и времени работы обработчиков в воркерах пула.
+
+    python webhook_loadtest.py --updates updates.jsonl --requests 5000 --concurrency 32
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+import update_pool
+import webhook
+
+SAMPLE_UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "load", "username": "load"},
+        "text": "/ping",
+    },
+}
+
+
+def load_updates(path):
+    if not path:
+        return [SAMPLE_UPDATE]
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_local_server(secret, handler_ms):
+    """
+    Сервер с TeleBot без сети: один обработчик на всё, имитирующий работу handler_ms.
+    Обработчики выполняет update_pool, как в bot.main.
+    """
+    bot = telebot.TeleBot("0:loadtest", threaded=False)
+
+    @bot.message_handler(func=lambda m: True)
+    def _any(message):
+        if handler_ms:
+            time.sleep(handler_ms / 1000)
+
+    pool = update_pool.attach(bot)
+    server = webhook.WebhookServer(bot, host="127.0.0.1", port=0, secret=secret)
+    server.start()
+    return server, pool, f"http://127.0.0.1:{server.port}{server.path}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="файл JSON lines с записанными обновлениями Telegram")
+    parser.add_argument("--url", help="адрес уже запущенного webhook; по умолчанию — локальный сервер")
+    parser.add_argument("--secret", default="loadtest-secret")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--handler-ms", type=float, default=0.0, help="имитация работы обработчика (локальный сервер)")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates)
+    server = pool = None
+    url = args.url
+    if not url:
+        server, pool, url = make_local_server(args.secret, args.handler_ms)
+
+    update_ids = itertools.count(1)
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def post(i):
+        body = dict(updates[i % len(updates)])
+        with lock:
+            body["update_id"] = next(update_ids)
+        req = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST", headers={
+            "Content-Type": "application/json", webhook.SECRET_HEADER: args.secret})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                resp.read()
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+        list(clients.map(post, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    print(f"запросов: {args.requests}, ошибок: {len(errors)}, за {elapsed:.2f} с ({args.requests / elapsed:.0f} req/s)")
+    print(f"ответ:      p50={webhook.percentile(latencies, 50) * 1000:.2f} мс  p99={webhook.percentile(latencies, 99) * 1000:.2f} мс")
+    if server is not None:
+        pool.join()
+        intake, handlers = server.stats(), pool.stats()
+        print(f"приём:      p50={intake['intake_p50_ms']:.2f} мс  p99={intake['intake_p99_ms']:.2f} мс  (принято {intake['received']}, отклонено {intake['rejected']})")
+        print(f"обработчик: p50={handlers['p50_ms']:.2f} мс  p99={handlers['p99_ms']:.2f} мс  (обработано {handlers['processed']}, ошибок {handlers['errors']})")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# week_stats_bench.py
+"""
+Бенчмарк недельной статистики для /stat на неделе плотных тиков: прежние
+шесть запросов на ресурс против database.get_week_stats (и столбцового
+хранилища, если задан --tickstore). --history-days добавляет более старую
+историю часовых свечей, чтобы видеть, что время не растёт с её объёмом.
+
+    python week_stats_bench.py --tick-seconds 30 --history-days 365
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+# database при импорте создаёт bsp.db в текущем каталоге — работаем во временном
+WORKDIR = tempfile.mkdtemp(prefix="bsp-bench-")
+os.chdir(WORKDIR)
+
+import database  # noqa: E402
+from tickstore import TickStore  # noqa: E402
+
+RESOURCES = ("Дерево", "Камень", "Провизия", "Лошади")
+WEEK = 7 * 24 * 3600
+
+
+def fill(now: int, tick_seconds: int, history_days: int) -> int:
+    rnd = random.Random(1)
+    rows = [(r, rnd.uniform(5, 10), rnd.uniform(3, 6), rnd.randint(1, 10 ** 6), ts)
+            for ts in range(now - WEEK - 3600, now, tick_seconds) for r in RESOURCES]
+    with database.transaction() as c:
+        c.executemany("INSERT INTO market (resource, buy, sell, quantity, timestamp) VALUES (?, ?, ?, ?, ?)", rows)
+    database.rebuild_candles(0)
+    if history_days:
+        first = now - WEEK - 3600
+        first -= first % 3600
+        with database.transaction() as c:
+            c.executemany("INSERT OR IGNORE INTO market_candles VALUES (3600, ?, ?, 7, 8, 6, 7, 4, 5, 3, 4, 10, 10, 1, ?, ?)",
+                          [(r, b, b, b) for r in RESOURCES
+                           for b in range(first - history_days * 86400, first, 3600)])
+    return len(rows)
+
+
+def per_resource_queries(week_start: int) -> dict:
+    """Прежний cmd_stat: шесть отдельных проходов по неделе на каждый ресурс."""
+    return {r: (database.get_market_week_max_price(r, "buy", week_start),
+                database.get_market_week_max_price(r, "sell", week_start),
+                database.get_market_week_range(r, "buy", week_start),
+                database.get_market_week_range(r, "sell", week_start),
+                database.get_market_week_max_qty(r, week_start))
+            for r in RESOURCES}
+
+
+def timed(func, week_start: int, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(week_start)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tick-seconds", type=int, default=30, help="шаг тиков по каждому ресурсу")
+    parser.add_argument("--history-days", type=int, default=0, help="дней более старых часовых свечей")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tickstore", action="store_true", help="также замерить столбцовое хранилище")
+    args = parser.parse_args()
+
+    database.DB_PATH = os.path.join(WORKDIR, "bench.db")
+    database.init_db()
+    now = int(time.time())
+    rows = fill(now, args.tick_seconds, args.history_days)
+    week_start = now - WEEK
+    print(f"тиков: {rows}, свечей: {database._fetchone('SELECT COUNT(*) FROM market_candles')[0]}")
+
+    old, new = per_resource_queries(week_start), database.get_week_stats(week_start)
+    for r in RESOURCES:
+        max_buy, max_sell, buy_range, sell_range, max_qty = old[r]
+        stats = new[r]
+        assert (stats["min_buy"], stats["max_buy"]) == buy_range and (stats["min_sell"], stats["max_sell"]) == sell_range
+        assert stats["max_buy"] == max_buy and stats["max_sell"] == max_sell and stats["max_qty"] == max_qty
+
+    timings = {
+        "6 запросов на ресурс": timed(per_resource_queries, week_start, args.repeat),
+        "get_week_stats": timed(database.get_week_stats, week_start, args.repeat),
+    }
+    if args.tickstore:
+        store = TickStore(os.path.join(WORKDIR, "ticks"))
+        store.sync_from_db()
+        timings["TickStore.week_stats"] = timed(store.week_stats, week_start, args.repeat)
+    for name, ms in timings.items():
+        print(f"{name:22} {ms:8.2f} мс")
+
+
+if __name__ == "__main__":
+    main()